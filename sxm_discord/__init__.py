@@ -2,10 +2,22 @@
 
 """Top-level package for sxm-discord."""
 
-from .player import DiscordPlayer
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .player import DiscordPlayer
 
 __author__ = """Christopher Bailey"""
 __email__ = "cbailey@mort.is"
 __version__ = "0.2.5"
 
 __all__ = ["DiscordPlayer"]
+
+
+def __getattr__(name: str):
+    # `DiscordPlayer` is loaded lazily so `import sxm_discord` stays cheap
+    if name == "DiscordPlayer":
+        from .player import DiscordPlayer
+
+        return DiscordPlayer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,249 @@
+import logging
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from discord_slash import SlashCommand  # type: ignore
+from discord_slash.utils.manage_commands import create_option  # type: ignore
+from sqlalchemy import literal_column
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.session import Session
+from sqlalchemy.sql import ColumnElement
+from sxm_player.models import DBEpisode, DBSong
+
+from sxm_discord.channels import ChannelIndex
+
+__all__ = [
+    "AutocompleteSlashCommand",
+    "PrefixIndex",
+    "create_autocomplete_option",
+]
+
+INTERACTION_AUTOCOMPLETE = 4
+RESPONSE_AUTOCOMPLETE = 8
+
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+MAX_PREFIX_MATCHES = 500
+PREFIX_CACHE_SIZE = 256
+ARCHIVE_INDEX_SIZE = 5000
+
+# (name, value) of a autocomplete choice
+Choice = Tuple[str, str]
+AutocompleteHandler = Callable[[str], List[Choice]]
+
+
+def normalize_prefix(value: str) -> str:
+    return " ".join(value.lower().split())
+
+
+def create_autocomplete_option(name: str, description: str, **kwargs) -> dict:
+    """`create_option` for a string option that has autocomplete"""
+
+    option = create_option(name=name, description=description, option_type=3, **kwargs)
+    option["autocomplete"] = True
+    # Discord does not allow `choices` with `autocomplete`
+    option.pop("choices", None)
+    return option
+
+
+class PrefixIndex:
+    """Sorted keys for prefix lookups of autocomplete choices.
+
+    Items are given in priority order and can have multiple keys (title,
+    artist, GUID, etc.). Results are capped at `MAX_CHOICES` and cached per
+    prefix.
+    """
+
+    _keys: List[str]
+    _entries: List[Tuple[int, Choice]]
+    _top: List[Choice]
+    _cache: "OrderedDict[str, List[Choice]]"
+
+    def __init__(self, items: Iterable[Tuple[Iterable[str], str, str]]):
+        entries: List[Tuple[str, int, Choice]] = []
+        self._top = []
+
+        for rank, (keys, name, value) in enumerate(items):
+            choice = (name[:MAX_CHOICE_LENGTH], value[:MAX_CHOICE_LENGTH])
+            if len(self._top) < MAX_CHOICES:
+                self._top.append(choice)
+
+            for key in {normalize_prefix(k) for k in keys if k}:
+                entries.append((key, rank, choice))
+
+        entries.sort()
+        self._keys = [e[0] for e in entries]
+        self._entries = [(e[1], e[2]) for e in entries]
+        self._cache = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def search(self, prefix: str) -> List[Choice]:
+        prefix = normalize_prefix(prefix)
+        if prefix == "":
+            return self._top
+
+        choices = self._cache.get(prefix)
+        if choices is not None:
+            self._cache.move_to_end(prefix)
+            return choices
+
+        matches: List[Tuple[int, Choice]] = []
+        index = bisect_left(self._keys, prefix)
+        while (
+            index < len(self._keys)
+            and len(matches) < MAX_PREFIX_MATCHES
+            and self._keys[index].startswith(prefix)
+        ):
+            matches.append(self._entries[index])
+            index += 1
+
+        matches.sort(key=lambda m: m[0])
+        choices = []
+        for _, choice in matches:
+            if choice not in choices:
+                choices.append(choice)
+                if len(choices) >= MAX_CHOICES:
+                    break
+
+        self._cache[prefix] = choices
+        if len(self._cache) > PREFIX_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return choices
+
+
+def build_channel_index(channel_index: ChannelIndex) -> PrefixIndex:
+    return PrefixIndex(
+        (
+            (channel.id, channel.name, str(channel.channel_number)),
+            channel.pretty_name,
+            channel.id,
+        )
+        for channel in channel_index.channels
+    )
+
+
+def build_song_index(
+    db: Session,
+    limit: int = ARCHIVE_INDEX_SIZE,
+    is_playable: Optional[Callable[[Optional[str]], bool]] = None,
+) -> PrefixIndex:
+    rowid = literal_column("songs.rowid")
+    songs = db.query(rowid, DBSong.guid, DBSong.title, DBSong.artist, DBSong.file_path)
+
+    return PrefixIndex(
+        ((guid, title, artist), f'"{title}" by {artist}', guid)
+        for _, guid, title, artist, _ in _query_playable(
+            songs, rowid, limit, is_playable
+        )
+    )
+
+
+def build_episode_index(
+    db: Session,
+    limit: int = ARCHIVE_INDEX_SIZE,
+    is_playable: Optional[Callable[[Optional[str]], bool]] = None,
+) -> PrefixIndex:
+    rowid = literal_column("episodes.rowid")
+    episodes = db.query(
+        rowid, DBEpisode.guid, DBEpisode.title, DBEpisode.show, DBEpisode.file_path
+    )
+
+    return PrefixIndex(
+        ((guid, title, show), f'"{title}" ({show})', guid)
+        for _, guid, title, show, _ in _query_playable(
+            episodes, rowid, limit, is_playable
+        )
+    )
+
+
+def _query_playable(
+    query: Query,
+    rowid: ColumnElement,
+    limit: int,
+    is_playable: Optional[Callable[[Optional[str]], bool]],
+) -> Iterator[tuple]:
+    """Yields up to `limit` rows with a playable file, newest first.
+
+    Newest is by rowid, `air_time` has no index but files are added as they
+    air. Rows are read `limit` at a time, the rowid must be the first column
+    and the file path the last.
+    """
+
+    count = 0
+    last: Optional[int] = None
+    while True:
+        page = query if last is None else query.filter(rowid < last)
+        rows = page.order_by(rowid.desc()).limit(limit).all()
+        if len(rows) == 0:
+            return
+
+        for row in rows:
+            last = row[0]
+            if is_playable is None or is_playable(row[-1]):
+                count += 1
+                yield row
+                if count >= limit:
+                    return
+
+
+def get_focused_option(options: List[dict]) -> Optional[dict]:
+    for option in options:
+        if option.get("focused"):
+            return option
+
+        focused = get_focused_option(option.get("options", []))
+        if focused is not None:
+            return focused
+    return None
+
+
+class AutocompleteSlashCommand(SlashCommand):
+    """`SlashCommand` that also answers autocomplete interactions.
+
+    Handlers are looked up by the name of the focused option and must not do
+    any IO, Discord only gives a few seconds to respond.
+    """
+
+    autocomplete_handlers: Dict[str, AutocompleteHandler]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.autocomplete_handlers = {}
+        self._log = logging.getLogger("sxm_discord.autocomplete")
+
+    async def on_socket_response(self, msg):
+        if (
+            msg["t"] == "INTERACTION_CREATE"
+            and msg["d"]["type"] == INTERACTION_AUTOCOMPLETE
+        ):
+            return await self._on_autocomplete(msg["d"])
+        return await super().on_socket_response(msg)
+
+    async def _on_autocomplete(self, interaction: dict):
+        option = get_focused_option(interaction["data"].get("options", []))
+
+        choices: List[Choice] = []
+        if option is not None:
+            handler = self.autocomplete_handlers.get(option["name"])
+            if handler is not None:
+                try:
+                    choices = handler(str(option.get("value", "")))
+                except Exception:
+                    self._log.exception(f"autocomplete for {option['name']} failed")
+
+        response = {
+            "type": RESPONSE_AUTOCOMPLETE,
+            "data": {
+                "choices": [
+                    {"name": name, "value": value}
+                    for name, value in choices[:MAX_CHOICES]
+                ]
+            },
+        }
+        await self.req.post_initial_response(
+            response, interaction["id"], interaction["token"]
+        )
@@ -1,15 +1,28 @@
 import asyncio
+import logging
+import threading
 import time
 import traceback
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Union
-
-from discord import Activity, Game, Intents, TextChannel, VoiceChannel
+from functools import partial
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from discord import (
+    Activity,
+    File,
+    Game,
+    HTTPException,
+    Intents,
+    TextChannel,
+    VoiceChannel,
+)
 from discord.ext.commands import BadArgument, Bot, Cog
-from discord_slash import SlashCommand, SlashContext, cog_ext  # type: ignore
+from discord.player import AudioPlayer as VoicePlayer
+from discord_slash import SlashContext, cog_ext  # type: ignore
 from discord_slash.utils.manage_commands import create_option  # type: ignore
-from sxm.models import XMChannel
-from sxm_player.models import Episode, PlayerState, Song
+from sxm.models import XMChannel, XMCutMarker
+from sxm_player.models import DBSong, Episode, Song
 from sxm_player.queue import EventMessage, EventTypes
 from sxm_player.signals import TerminateInterrupt
 from sxm_player.workers import (
@@ -18,20 +31,63 @@ from sxm_player.workers import (
     SXMStatusSubscriber,
 )
 
+from sxm_discord.autocomplete import AutocompleteSlashCommand
+from sxm_discord.clips import export_song
+from sxm_discord.execution import deferrable
+from sxm_discord.idle import (
+    EMPTY_TIMEOUT,
+    IDLE_TIMEOUT,
+    VoiceIdleMonitor,
+    has_listeners,
+)
+from sxm_discord.logs import (
+    DEFAULT_CAPACITY,
+    RingBuffer,
+    configure_logging,
+    get_logger,
+)
+from sxm_discord.loudness import LoudnessIndex
+from sxm_discord.manifest import ArchiveManifest
+from sxm_discord.metrics import (
+    MetricsServer,
+    MetricsWriter,
+    event_latency,
+    instrument_http,
+    monitor_loop_lag,
+    observe,
+)
 from sxm_discord.music import AudioPlayer, PlayType
+from sxm_discord.prefetch import FilePrefetcher
+from sxm_discord.profiler import SamplingProfiler
+from sxm_discord.recorder import EventRecorder
+from sxm_discord.rewind import RewindBuffer, create_rewind_buffer, to_ms
+from sxm_discord.serializer import PlayerCommandSerializer
+from sxm_discord.snapshot import StateSnapshot
+from sxm_discord.state import DiscordPlayerState
 from sxm_discord.sxm import SXMArchivedCommands, SXMCommands
+from sxm_discord.tracing import (
+    JSONLExporter,
+    OTLPExporter,
+    run_in_executor,
+    trace_db,
+    trace_http,
+    tracer,
+)
 from sxm_discord.utils import (
     SXM_COG_NAME,
     generate_embed_from_archived,
     generate_now_playing_embed,
     get_recent_songs,
     get_root_command,
+    paginate_lines,
     send_message,
 )
+from sxm_discord.watchdog import LoopWatchdog
 
-from .checks import is_playing, no_pm, require_voice
-from .converters import CountConverter
+from .checks import is_playing, no_pm, require_owner, require_voice
+from .converters import CountConverter, IntRangeConverter
 from .models import (
+    REPLAY_EMOJI,
     ArchivedSongCarousel,
     ReactionCarousel,
     SongActivity,
@@ -41,6 +97,27 @@ from .models import (
 )
 
 CAROUSEL_TIMEOUT = 30
+MAX_PROFILE_SECONDS = 300
+# seconds `on_close` gets before the bot disconnects anyways
+SHUTDOWN_TIMEOUT = 10
+
+
+class MusicBot(Bot):
+    """`Bot` that awaits `on_close` before disconnecting, `cog_unload` is
+    called by `close` too but can not await anything"""
+
+    on_close: Optional[Callable[[], Awaitable[None]]] = None
+
+    async def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            try:
+                await asyncio.wait_for(on_close(), SHUTDOWN_TIMEOUT)
+            except Exception:
+                logging.getLogger("sxm_discord.bot").exception(
+                    "error while shutting down"
+                )
+        await super().close()
 
 
 class DiscordWorker(
@@ -52,18 +129,37 @@ class DiscordWorker(
     name=SXM_COG_NAME,
 ):
     bot: Bot
-    slash: SlashCommand
+    slash: AutocompleteSlashCommand
     root_command: str
     token: str
     output_channel: Optional[TextChannel] = None
     player: AudioPlayer
+    rewind: Optional[RewindBuffer] = None
+    loudness: Optional[LoudnessIndex] = None
+    prefetcher: Optional[FilePrefetcher] = None
+    idle_monitor: VoiceIdleMonitor
+    metrics_server: Optional[MetricsServer] = None
+    watchdog: Optional[LoopWatchdog] = None
+    profiler: Optional[SamplingProfiler] = None
+    recorder: Optional[EventRecorder] = None
+    log_buffer: Optional[RingBuffer] = None
     carousels: Dict[int, ReactionCarousel] = {}
 
     _output_channel_id: Optional[int] = None
     _last_update: float = 0
     _update_interval: float = 5
-    _voice_timeout: int = 0
+    _last_index_refresh: float = 0
+    _index_refresh_interval: float = 300
+    _last_loudness_pass: float = 0
+    _loudness_interval: float = 60
+    _last_manifest_scan: float = 0
+    _manifest_interval: float = 300
+    _last_stall_report: float = 0
+    _stall_report_interval: float = 600
+    _reported_stalls: int = 0
     _pending: Optional[Tuple[XMChannel, VoiceChannel]] = None
+    # seconds to wait for a new HLS stream after resetting live
+    _live_resume_delay: float = 10
 
     def __init__(
         self,
@@ -81,6 +177,17 @@ class DiscordWorker(
             None,
             None,
         ),
+        state_snapshot: Optional[StateSnapshot] = None,
+        rewind_minutes: int = 0,
+        metrics_host: str = "127.0.0.1",
+        metrics_port: Optional[int] = None,
+        watchdog_ms: int = 0,
+        trace_file: Optional[str] = None,
+        trace_endpoint: Optional[str] = None,
+        record_events: Optional[str] = None,
+        log_levels: Optional[Dict[str, int]] = None,
+        log_sample: Optional[Dict[str, int]] = None,
+        log_buffer: int = DEFAULT_CAPACITY,
         *args,
         **kwargs,
     ):
@@ -92,30 +199,80 @@ class DiscordWorker(
         kwargs["name"] = "music"
         super().__init__(*args, **kwargs)
 
-        self._state = PlayerState()
+        self.log_buffer = configure_logging(log_buffer, log_levels, log_sample)
+        self._event_log = get_logger("events")
+        self._status_log = get_logger("status")
+
+        self._state = DiscordPlayerState()
         self._state.sxm_running = sxm_status
-        self._state.update_stream_data(stream_data)
         self._state.processed_folder = processed_folder
         self._state.update_channels(channels)
         self._state.set_raw_live(raw_live_data)
-        self._event_queues = [self.sxm_status_queue, self.hls_stream_queue]
+        if state_snapshot is not None:
+            self._state.load_snapshot(state_snapshot)
+        self._state.update_stream_data(stream_data)
+        if record_events is not None:
+            self.recorder = EventRecorder(record_events)
+            self.recorder.record_state(
+                self._state.sxm_running,
+                self._state.get_raw_channels(),
+                self._state.get_raw_live(),
+            )
+        self._event_queues = [
+            ("sxm_status", self.sxm_status_queue),
+            ("hls_stream", self.hls_stream_queue),
+        ]
 
         self.root_command = get_root_command()
 
         self.token = token
-        self.bot = Bot(
+        self.bot = MusicBot(
             command_prefix=f"/{self.root_command}",
             description=description,
             intents=Intents.default(),
             help_command=None,
         )
-        self.slash = SlashCommand(self.bot, sync_commands=True, sync_on_cog_reload=True)
+        self.bot.on_close = self._shutdown
+        self.slash = AutocompleteSlashCommand(
+            self.bot, sync_commands=True, sync_on_cog_reload=True
+        )
+        self.slash.autocomplete_handlers.update(self.get_autocomplete_handlers())
         self.bot.add_cog(self)
-        self.player = AudioPlayer(self.event_queue, self.bot.loop)
+        self.idle_monitor = VoiceIdleMonitor(self.bot.loop, self._on_voice_idle)
+        self.rewind = create_rewind_buffer(
+            rewind_minutes, lambda: self._state.radio_time
+        )
+        if processed_folder is not None:
+            self.loudness = LoudnessIndex(processed_folder)
+            self.archive_manifest = ArchiveManifest(processed_folder)
+            self.prefetcher = FilePrefetcher()
+        self.player = self._create_player()
+        self.player_commands = PlayerCommandSerializer()
 
         if output_channel_id is not None:
             self._output_channel_id = output_channel_id
 
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(
+                metrics_host, metrics_port, self._collect_metrics
+            )
+            instrument_http(self.bot.http)
+            self.bot.loop.create_task(self.metrics_server.start())
+            self.bot.loop.create_task(monitor_loop_lag())
+
+        if trace_endpoint is not None:
+            tracer.start(OTLPExporter(trace_endpoint), self.bot.loop)
+        elif trace_file is not None:
+            tracer.start(JSONLExporter(trace_file), self.bot.loop)
+        if tracer.enabled:
+            trace_http(self.bot.http)
+            if self._state.db is not None:
+                trace_db(self._state.db.get_bind())
+
+        if watchdog_ms > 0:
+            self.watchdog = LoopWatchdog(self.bot.loop, watchdog_ms / 1000)
+            self.watchdog.start()
+
         self.bot.loop.create_task(self.event_loop())
 
     def run(self):
@@ -125,12 +282,37 @@ class DiscordWorker(
         except (KeyboardInterrupt, TerminateInterrupt, RuntimeError):
             pass
 
-    def __unload(self):
-        self.bot.loop.create_task(self.bot_output("Music bot shutting down"))
+    async def _shutdown(self):
+        """Cleanup that has to be awaited, ran by `MusicBot.close` while the
+        bot is still connected"""
+
+        await self.bot_output("Music bot shutting down")
 
         if self.player is not None:
-            self.player.cleanup()
-            self.bot.loop.create_task(self.player.stop())
+            await self.player.cleanup()
+            await self.player.stop()
+
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+
+        # last, so spans of the rest of the shutdown are exported too
+        if tracer.enabled:
+            await tracer.flush()
+
+    def cog_unload(self):
+        # ran by `Bot.close` after `_shutdown`
+        if self.loudness is not None:
+            self.loudness.shutdown()
+
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self._report_stalls()
+
+        if self.recorder is not None:
+            self.recorder.close()
 
     @Cog.listener()
     async def on_ready(self) -> None:
@@ -155,6 +337,25 @@ class DiscordWorker(
         if self._state.sxm_running:
             await self._sxm_running_message()
 
+        if self.player.voice is None:
+            for guild in self.bot.guilds:
+                if guild.me is not None and guild.me.voice is not None:
+                    self._log.info("Found old voice channel for bot, leaving...")
+                    await guild.me.move_to(None)
+
+    @Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        if self.player.voice is None:
+            return
+
+        channel = self.player.voice.channel
+        if (
+            member.id == self.bot.user.id
+            or before.channel == channel
+            or after.channel == channel
+        ):
+            self._check_voice_idle()
+
     @Cog.listener()
     async def on_reaction_add(self, reaction, user):
         # ignore bot user reactions
@@ -164,7 +365,16 @@ class DiscordWorker(
         carousel = self.carousels.get(reaction.message.id)
         if carousel is not None:
             carousel.message = reaction.message
-            await carousel.handle_reaction(self._state, reaction.emoji)
+            if isinstance(carousel, SXMCutCarousel) and reaction.emoji == REPLAY_EMOJI:
+                guild = reaction.message.guild
+                await self._replay_cut(
+                    reaction.message.channel,
+                    user,
+                    guild.id if guild is not None else 0,
+                    carousel.current,
+                )
+            else:
+                await carousel.handle_reaction(self._state, reaction.emoji)
 
     # helper methods
     async def bot_output(self, message: str):
@@ -180,31 +390,13 @@ class DiscordWorker(
 
     async def _event_loop(self):
         while not self.shutdown_event.is_set():
-            was_connected = self._state.sxm_running
-
-            for queue in self._event_queues:
+            events: List[Tuple[str, EventMessage]] = []
+            for name, queue in self._event_queues:
                 event = queue.safe_get()
-
                 if event:
-                    self._log.debug(
-                        f"Received event: {event.msg_src}, " f"{event.msg_type.name}"
-                    )
-                    await self._handle_event(event)
-
-            if self._state.sxm_running and not was_connected:
-                await self._sxm_running_message()
-                if self._pending is not None:
-                    await self.bot_output(
-                        "Automatically resuming previous channel: "
-                        f"`{self._pending[0].id}`"
-                    )
-                    await self._reset_live(self._pending[1], self._pending[0])
-            elif not self._state.sxm_running and was_connected:
-                await self.bot_output(
-                    "Connection to SXM was lost. Will automatically reconnect"
-                )
-                if self.player.is_playing and self.player.play_type == PlayType.LIVE:
-                    await self.player.stop(disconnect=False)
+                    events.append((name, event))
+
+            await self._process_events(events)
 
             if time.monotonic() > (self._last_update + self._update_interval):
                 await self.update()
@@ -212,6 +404,41 @@ class DiscordWorker(
 
             await asyncio.sleep(0.1)
 
+    async def _process_events(self, events: List[Tuple[str, EventMessage]]):
+        """Handles events received from the queues in one pass of the loop"""
+
+        was_connected = self._state.sxm_running
+
+        for name, event in events:
+            self._event_log.debug(
+                "received event", source=event.msg_src, type=event.msg_type.name
+            )
+            if self.recorder is not None:
+                self.recorder.record(name, event)
+
+            start = time.perf_counter()
+            await self._handle_event(event)
+            observe(
+                event_latency,
+                event.msg_type.name,
+                time.perf_counter() - start,
+            )
+
+        if self._state.sxm_running and not was_connected:
+            await self._sxm_running_message()
+            if self._pending is not None:
+                await self.bot_output(
+                    "Automatically resuming previous channel: "
+                    f"`{self._pending[0].id}`"
+                )
+                await self._reset_live(self._pending[1], self._pending[0])
+        elif not self._state.sxm_running and was_connected:
+            await self.bot_output(
+                "Connection to SXM was lost. Will automatically reconnect"
+            )
+            if self.player.is_playing and self.player.play_type == PlayType.LIVE:
+                await self.player.stop(disconnect=False)
+
     async def event_loop(self):
         while True:
             try:
@@ -229,16 +456,17 @@ class DiscordWorker(
     def _get_acvitity(self):
         activity: Optional[Activity] = None
         if self.player.play_type == PlayType.LIVE:
-            if self._state.live is not None:
+            timeline = self._state.timeline
+            if timeline is not None:
                 xm_channel = self._state.get_channel(self._state.stream_channel)
                 activity = SXMActivity(
                     start=self._state.start_time,
                     radio_time=self._state.radio_time,
                     channel=xm_channel,
-                    live_channel=self._state.live,
+                    timeline=timeline,
                 )
             else:
-                self._log.debug("Could not update status, live is none")
+                self._status_log.debug("no live timeline for status")
         elif self.player.current is not None and isinstance(
             self.player.current.audio_file, Song
         ):
@@ -248,38 +476,179 @@ class DiscordWorker(
 
         return activity
 
+    def _collect_metrics(self, metrics: MetricsWriter) -> None:
+        for name, queue in self._event_queues:
+            try:
+                size = queue.qsize()
+            except NotImplementedError:  # macOS
+                continue
+            metrics.gauge(
+                "sxm_discord_queue_depth",
+                "Events waiting on sxm-player queues",
+                size,
+                queue=name,
+            )
+
+        for guild_id, depth in sorted(self.player_commands.depths.items()):
+            metrics.gauge(
+                "sxm_discord_player_command_depth",
+                "Player commands waiting or running",
+                depth,
+                guild=guild_id,
+            )
+        for name, count in sorted(self.player_commands.executed.items()):
+            metrics.counter(
+                "sxm_discord_player_commands",
+                "Player commands that ran",
+                count,
+                command=name,
+            )
+        for name, count in sorted(self.player_commands.superseded.items()):
+            metrics.counter(
+                "sxm_discord_player_commands_superseded",
+                "Player commands dropped for a newer one",
+                count,
+                command=name,
+            )
+
+        metrics.gauge(
+            "sxm_discord_carousels",
+            "Carousels waiting for reactions",
+            len(self.carousels),
+        )
+        metrics.gauge(
+            "sxm_discord_playing",
+            "If the bot is playing audio",
+            int(self.player.is_playing),
+        )
+        metrics.gauge(
+            "sxm_discord_bot_latency_seconds",
+            "Discord websocket heartbeat latency",
+            self.bot.latency,
+        )
+
+        if self.prefetcher is not None:
+            metrics.counter(
+                "sxm_discord_prefetch_hits",
+                "Archive files that were prefetched when they started",
+                self.prefetcher.hits,
+            )
+            metrics.counter(
+                "sxm_discord_prefetch_misses",
+                "Archive files that were not prefetched when they started",
+                self.prefetcher.misses,
+            )
+        if self.archive_manifest is not None:
+            metrics.gauge(
+                "sxm_discord_archive_files",
+                "Playable files in the archive",
+                len(self.archive_manifest),
+            )
+        if self.watchdog is not None:
+            for stall in self.watchdog.stalls.values():
+                metrics.counter(
+                    "sxm_discord_loop_stalls",
+                    "Times the event loop was blocked over the watchdog threshold",
+                    stall.count,
+                    location=stall.name,
+                )
+        if self.rewind is not None:
+            metrics.gauge(
+                "sxm_discord_rewind_packets",
+                "Opus packets in the rewind buffer",
+                len(self.rewind),
+            )
+
+    def _create_player(self) -> AudioPlayer:
+        return AudioPlayer(
+            self.event_queue,
+            self.bot.loop,
+            on_state_change=self._check_voice_idle,
+            rewind=self.rewind,
+            loudness=self.loudness,
+            prefetcher=self.prefetcher,
+        )
+
+    def _check_voice_idle(self) -> None:
+        """Arms or cancels the idle timer for the current voice channel"""
+
+        voice = self.player.voice
+        if voice is None:
+            self.idle_monitor.cancel_all()
+            return
+
+        guild_id = voice.guild.id
+        if not has_listeners(voice.channel):
+            self.idle_monitor.arm(guild_id, "empty", EMPTY_TIMEOUT)
+        elif not self.player.is_playing:
+            self.idle_monitor.arm(guild_id, "idle", IDLE_TIMEOUT)
+        else:
+            self.idle_monitor.cancel(guild_id)
+
+    async def _on_voice_idle(self, guild_id: int, reason: str) -> None:
+        voice = self.player.voice
+        if voice is None or voice.guild.id != guild_id:
+            return
+
+        if reason == "empty":
+            if has_listeners(voice.channel):
+                return self._check_voice_idle()
+
+            self._log.info("No one is listening, leaving voice...")
+            await self.player_commands.run(guild_id, "stop", self._leave_voice)
+        elif reason == "idle":
+            if self.player.is_playing:
+                return
+
+            await self.player_commands.run(guild_id, "idle_stop", self._stop_idle)
+
+    async def _leave_voice(self) -> None:
+        self._pending = None
+        await self.player.stop()
+
+    async def _stop_idle(self) -> None:
+        # a command queued before the timer ran out may have started something
+        if self.player.is_playing:
+            return
+
+        self._log.info("In voice, but nothing is playing, exiting...")
+        await self.player.stop(kill_hls=False)
+        if self._pending is not None and self._state.sxm_running:
+            self._log.info("SXM stream disappeared. Restarting...")
+            self.bot.loop.create_task(
+                self._reset_live(self._pending[1], self._pending[0])
+            )
+
     async def update(self):
         activity: Optional[Activity] = None
         if self.player.is_playing:
-            self._voice_timeout = 0
             activity = self._get_acvitity()
-        elif self.player.voice is not None:
-            self._voice_timeout += 1
-
-            if self._voice_timeout > 5:
-                self._log.info("In voice, but nothing is playing, exiting...")
-                await self.player.stop(kill_hls=False)
-                if self._pending is not None and self._state.sxm_running:
-                    self._log.info("SXM stream disappeared. Restarting...")
-                    self.bot.loop.create_task(
-                        self._reset_live(self._pending[1], self._pending[0])
-                    )
-        elif self.player.voice is None and self.bot.user is not None:
-            self._voice_timeout = 0
-
-            if len(self.bot.guilds) > 0:
-                guild = self.bot.guilds[0]
-                member = guild.get_member(self.bot.user.id)
-                if member.voice is not None:
-                    self._log.info("Found old voice channel for bot, leaving...")
-                    await member.move_to(None)
 
-        self._log.debug(f"Updating bot's status: {activity}")
+        self._status_log.debug("updating status", activity=activity)
         try:
             await self.bot.change_presence(activity=activity)
         except AttributeError:
             pass
 
+        if time.monotonic() > (self._last_manifest_scan + self._manifest_interval):
+            self._last_manifest_scan = time.monotonic()
+            self.bot.loop.create_task(self._scan_archive())
+
+        if time.monotonic() > (self._last_index_refresh + self._index_refresh_interval):
+            self.bot.loop.create_task(self.refresh_indexes())
+            self._last_index_refresh = time.monotonic()
+
+        if time.monotonic() > (self._last_loudness_pass + self._loudness_interval):
+            self._last_loudness_pass = time.monotonic()
+            self.bot.loop.create_task(self._analyze_loudness())
+
+        if self.recorder is not None:
+            self.recorder.flush()
+
+        if time.monotonic() > (self._last_stall_report + self._stall_report_interval):
+            self._last_stall_report = time.monotonic()
+            self._report_stalls()
+
         for key, carousel in list(self.carousels.items()):
             seconds_ago = (datetime.now() - carousel.last_update).total_seconds()
             if seconds_ago > CAROUSEL_TIMEOUT:
@@ -288,6 +657,40 @@ class DiscordWorker(
                 await carousel.clear_reactions()
                 del self.carousels[key]
 
+    def _report_stalls(self) -> None:
+        if self.watchdog is None or self.watchdog.total_stalls == self._reported_stalls:
+            return
+
+        self._reported_stalls = self.watchdog.total_stalls
+        self._log.info(
+            f"event loop stalls (over {self.watchdog.threshold * 1000:.0f}ms):\n"
+            f"{self.watchdog.report(stacks=True)}"
+        )
+
+    async def _scan_archive(self):
+        if self.archive_manifest is None:
+            return
+
+        was_ready = self.archive_manifest.ready
+        try:
+            await self.archive_manifest.refresh()
+        except Exception:
+            self._log.exception("error while scanning archive")
+            return
+
+        if not was_ready:
+            # indexes were built before it was known which files exist
+            await self.refresh_indexes()
+
+    async def _analyze_loudness(self):
+        if self.loudness is None or self._state.db is None:
+            return
+
+        try:
+            await self.loudness.analyze(self._state.db)
+        except Exception:
+            self._log.exception("error while analyzing loudness")
+
     async def _handle_event(self, event: EventMessage):
         if event.msg_type == EventTypes.SXM_STATUS:
             self._state.sxm_running = event.msg
@@ -330,6 +733,13 @@ class DiscordWorker(
     ) -> None:
         """Queues a file to be played"""
 
+        await self._run_player_command(
+            ctx, "add_file", partial(self._add_file, ctx, item, message)
+        )
+
+    async def _add_file(
+        self, ctx: SlashContext, item: Union[Song, Episode], message: bool
+    ) -> None:
         if self.player.is_playing:
             if self.player.play_type != PlayType.FILE:
                 self._pending = None
@@ -349,14 +759,37 @@ class DiscordWorker(
                 await send_message(ctx, f"added {item.bold_name} to now playing queue")
 
     async def _reset_live(self, voice_channel: VoiceChannel, xm_channel: XMChannel):
+        guild_id = voice_channel.guild.id
+        if not await self.player_commands.run(
+            guild_id, "reset_live", self._restart_player
+        ):
+            return
+
+        # do not hold up other commands while waiting for the stream
+        await asyncio.sleep(self._live_resume_delay)
+        await self.player_commands.run(
+            guild_id,
+            "resume_live",
+            partial(self._resume_live, voice_channel, xm_channel),
+        )
+
+    async def _restart_player(self) -> None:
         await self.player.stop(kill_hls=False)
         await self.player.cleanup()
-        self.player = AudioPlayer(self.event_queue, self.bot.loop)
-        await asyncio.sleep(10)
+        self.player = self._create_player()
+
+    async def _resume_live(
+        self, voice_channel: VoiceChannel, xm_channel: XMChannel
+    ) -> None:
+        if self.player.is_playing or self._pending is None:
+            self._log.debug("something else was started, not resuming live")
+            return
+
         await self.player.set_voice(voice_channel)
         await self.player.add_live_stream(xm_channel)
 
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def playing(self, ctx: SlashContext) -> None:
         """Responds with what the bot currently playing"""
 
@@ -406,6 +839,7 @@ class DiscordWorker(
                 latest=latest_cut,
                 channel=xm_channel,
                 body=message,
+                replayable=self.rewind is not None,
             )
             await self.create_carousel(ctx, carousel)
         else:
@@ -422,6 +856,7 @@ class DiscordWorker(
             )
         ],
     )
+    @deferrable()
     async def recent(self, ctx: SlashContext, count: int = 3) -> None:
         """Responds with the last 1-10 songs that been
         played on this channel"""
@@ -443,6 +878,96 @@ class DiscordWorker(
         )
         await self.create_carousel(ctx, carousel)
 
+    async def _get_recent_cut(
+        self, ctx: SlashContext, number: int
+    ) -> Optional[XMCutMarker]:
+        """Returns `number` most recent song cut of the live channel"""
+
+        try:
+            number = await IntRangeConverter(name="number").convert(ctx, number)
+        except BadArgument as e:
+            await send_message(ctx, str(e))
+            return None
+
+        if not await is_playing(ctx):
+            return None
+
+        if self.player.play_type != PlayType.LIVE:
+            await send_message(ctx, "Can only be used while SXM is playing")
+            return None
+
+        _, song_cuts, _ = get_recent_songs(self._state, number)
+        if len(song_cuts) < number:
+            await send_message(ctx, "Song is no longer available")
+            return None
+        return song_cuts[number - 1]
+
+    def _is_listening(self, member) -> bool:
+        """If `member` is in the voice channel of the player"""
+
+        voice = self.player.voice
+        member_voice = getattr(member, "voice", None)
+        return (
+            voice is not None
+            and member_voice is not None
+            and member_voice.channel is not None
+            and member_voice.channel.id == voice.channel.id
+        )
+
+    async def _replay_cut(self, ctx, member, guild_id: int, cut: XMCutMarker) -> None:
+        """Replays a cut of the live channel from the rewind buffer.
+
+        Checks are done here since it is used by both `replay` and the replay
+        reaction of recent song carousels.
+        """
+
+        if self.rewind is None:
+            await send_message(ctx, "Replaying songs is not enabled")
+            return
+
+        if not self.player.is_playing or self.player.play_type != PlayType.LIVE:
+            await send_message(ctx, "Can only replay songs while SXM is playing")
+            return
+
+        if not self._is_listening(member):
+            await send_message(ctx, "Can only replay songs from my voice channel")
+            return
+
+        if not await self.player_commands.run(
+            guild_id, "replay", partial(self._start_replay, ctx, cut)
+        ):
+            await send_message(ctx, "Skipped, a newer request replaced this one")
+
+    async def _start_replay(self, ctx, cut: XMCutMarker) -> None:
+        start = to_ms(cut.time)
+        end = start + int(cut.duration.total_seconds() * 1000)
+
+        if await self.player.add_replay(start, end):
+            await send_message(
+                ctx, f"Replaying **{cut.cut.title}**, then back to live radio"
+            )
+        else:
+            await send_message(ctx, "Song is no longer available to replay")
+
+    @cog_ext.cog_subcommand(
+        base=get_root_command(),
+        options=[
+            create_option(
+                name="number",
+                description="Recent song to replay, 1 is the current one (1-10)",
+                option_type=4,
+                required=False,
+            )
+        ],
+    )
+    @deferrable()
+    async def replay(self, ctx: SlashContext, number: int = 1) -> None:
+        """Replays a recent song of the SXM channel that is playing"""
+
+        cut = await self._get_recent_cut(ctx, number)
+        if cut is not None:
+            await self._replay_cut(ctx, ctx.author, ctx.guild_id or 0, cut)
+
     @cog_ext.cog_subcommand(
         base=get_root_command(),
         options=[
@@ -454,6 +979,7 @@ class DiscordWorker(
             )
         ],
     )
+    @deferrable()
     async def repeat(self, ctx: SlashContext, do_repeat: Optional[bool] = None) -> None:
         """Set/Unset play queue to repeat infinitely"""
 
@@ -478,22 +1004,27 @@ class DiscordWorker(
             await send_message(ctx, f"Set repeat to {status}")
 
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def reset(self, ctx: SlashContext) -> None:
         """Forces bot to leave voice and hard resets audio player"""
 
         if not await require_voice(ctx):
             return
 
+        await self._run_player_command(ctx, "reset", partial(self._reset_player, ctx))
+
+    async def _reset_player(self, ctx: SlashContext) -> None:
         await self._summon(ctx)
         self._pending = None
         await self.player.stop()
         await self.player.cleanup()
 
-        self.player = AudioPlayer(self.event_queue, self.bot.loop)
+        self.player = self._create_player()
 
         await send_message(ctx, "Bot reset successfully")
 
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def stop(self, ctx: SlashContext) -> None:
         """Stops playing audio and leaves the voice channel.
         This also clears the queue.
@@ -502,6 +1033,9 @@ class DiscordWorker(
         if not await no_pm(ctx) or not await is_playing(ctx):
             return
 
+        await self._run_player_command(ctx, "stop", partial(self._stop_player, ctx))
+
+    async def _stop_player(self, ctx: SlashContext) -> None:
         self._pending = None
         await self.player.stop()
         await send_message(ctx, "Stopped playing music")
@@ -513,7 +1047,97 @@ class DiscordWorker(
         summoned_channel = ctx.author.voice.channel
         await self.player.set_voice(summoned_channel)
 
+    def _profile_thread(self, thread: threading.Thread) -> Optional[str]:
+        if thread is threading.main_thread():
+            return "event-loop"
+        if isinstance(thread, VoicePlayer):
+            return "voice-player"
+        return None
+
+    @cog_ext.cog_subcommand(
+        base=get_root_command(),
+        subcommand_group="admin",
+        name="profile",
+        options=[
+            create_option(
+                name="seconds",
+                description=f"How long to profile for (1-{MAX_PROFILE_SECONDS})",
+                option_type=4,
+                required=False,
+            )
+        ],
+    )
+    @deferrable(slow=True)
+    async def admin_profile(self, ctx: SlashContext, seconds: int = 30) -> None:
+        """Profiles the bot and PMs a summary and the collapsed stacks"""
+
+        if not await require_owner(ctx):
+            return
+
+        try:
+            seconds = await IntRangeConverter(
+                max_number=MAX_PROFILE_SECONDS, name="seconds"
+            ).convert(ctx, seconds)
+        except BadArgument as e:
+            await send_message(ctx, str(e))
+            return
+
+        if self.profiler is not None and self.profiler.running:
+            await send_message(ctx, "A profile is already running")
+            return
+
+        self.profiler = SamplingProfiler(self._profile_thread)
+        self.profiler.start()
+        await send_message(ctx, f"Profiling for {seconds}s, results will be PM'd")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            result = await self.bot.loop.run_in_executor(None, self.profiler.stop)
+
+        summary = await self.bot.loop.run_in_executor(None, result.summary)
+        collapsed = result.collapsed().encode("utf8")
+        filename = f"sxm-discord-{datetime.now():%Y%m%d-%H%M%S}.collapsed.txt"
+        self._log.info(f"profile done:\n{summary}")
+
+        try:
+            await ctx.author.send(
+                "Profile done, open the file with https://www.speedscope.app",
+                file=File(BytesIO(collapsed), filename=filename),
+            )
+            for page in paginate_lines(summary):
+                await ctx.author.send(f"```{page}```")
+        except HTTPException:
+            self._log.exception("could not send profile")
+
+    @cog_ext.cog_subcommand(
+        base=get_root_command(), subcommand_group="admin", name="logs"
+    )
+    @deferrable()
+    async def admin_logs(self, ctx: SlashContext) -> None:
+        """PMs the recent log records, debug ones included"""
+
+        if not await require_owner(ctx):
+            return
+
+        if self.log_buffer is None or len(self.log_buffer) == 0:
+            await send_message(ctx, "No log records are kept")
+            return
+
+        records = self.log_buffer.render().encode("utf8")
+        filename = f"sxm-discord-{datetime.now():%Y%m%d-%H%M%S}.log"
+        try:
+            await ctx.author.send(
+                f"Last {len(self.log_buffer)} log records",
+                file=File(BytesIO(records), filename=filename),
+            )
+        except HTTPException:
+            self._log.exception("could not send logs")
+            await send_message(ctx, "Could not PM the logs")
+            return
+        await send_message(ctx, "Logs sent as a PM")
+
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def summon(self, ctx: SlashContext) -> None:
         """Summons the bot to join your voice channel"""
 
@@ -528,7 +1152,70 @@ class DiscordArchivedWorker(
     DiscordWorker,
     name=SXM_COG_NAME,
 ):
+    @cog_ext.cog_subcommand(
+        base=get_root_command(),
+        options=[
+            create_option(
+                name="number",
+                description="Recent song to save, 2 is the last finished one (1-10)",
+                option_type=4,
+                required=False,
+            )
+        ],
+    )
+    @deferrable()
+    async def save(self, ctx: SlashContext, number: int = 2) -> None:
+        """Saves a recent song of the SXM channel that is playing to the
+        archive"""
+
+        if (
+            self.rewind is None
+            or self._state.db is None
+            or self._state.processed_folder is None
+        ):
+            await send_message(ctx, "Saving songs is not enabled")
+            return
+
+        cut = await self._get_recent_cut(ctx, number)
+        if cut is None:
+            return
+
+        db = self._state.db
+        if db.query(DBSong.guid).filter_by(guid=cut.guid).first() is not None:
+            await send_message(ctx, "Song is already in the archive")
+            return
+
+        channel_id = self._state.stream_channel
+        if channel_id is None or channel_id != self.rewind.channel_id:
+            await send_message(ctx, "Song is no longer available")
+            return
+
+        db_song = await run_in_executor(
+            export_song,
+            self.rewind,
+            cut,
+            channel_id,
+            self._state.processed_folder,
+        )
+        if db_song is None:
+            await send_message(
+                ctx, "Song is not in the replay buffer, it may not have finished yet"
+            )
+            return
+
+        if self.archive_manifest is not None:
+            await self.bot.loop.run_in_executor(
+                None, self.archive_manifest.add_file, db_song.file_path
+            )
+        db.add(db_song)
+        db.commit()
+        self._log.info(f"saved {cut.guid}: {db_song.file_path}")
+        await send_message(
+            ctx, f"Saved {Song.from_orm(db_song).bold_name} to the archive"
+        )
+
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def skip(self, ctx: SlashContext) -> None:
         """Skips current song. Does not work for SXM"""
 
@@ -539,10 +1226,14 @@ class DiscordArchivedWorker(
             await send_message(ctx, "Cannot skip. SXM radio is playing")
             return
 
+        await self._run_player_command(ctx, "skip", partial(self._skip_song, ctx))
+
+    async def _skip_song(self, ctx: SlashContext) -> None:
         await self.player.skip()
         await send_message(ctx, "Song skipped")
 
     @cog_ext.cog_subcommand(base=get_root_command())
+    @deferrable()
     async def upcoming(self, ctx: SlashContext) -> None:
         """Displaying the songs/shows on play queue. Does not
         work for live SXM radio"""
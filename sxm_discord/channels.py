@@ -0,0 +1,104 @@
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sxm.models import XMChannel
+
+__all__ = ["ChannelIndex", "normalize_name"]
+
+FUZZY_THRESHOLD = 0.3
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(value: str) -> str:
+    """Lowercases and strips everything but letters and numbers"""
+
+    return _NON_ALPHANUMERIC.sub("", value.lower())
+
+
+def get_trigrams(value: str) -> Set[str]:
+    value = f"  {normalize_name(value)} "
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+class ChannelIndex:
+    """Precomputed lookups for a list of `XMChannel`.
+
+    Built once per channel list (see `version`) so every lookup by ID,
+    channel number or name is a single dict lookup. Also keeps a trigram
+    index of channel names for fuzzy matching.
+    """
+
+    version: int
+    channels: Tuple[XMChannel, ...]
+
+    _lookup: Dict[str, XMChannel]
+    _trigrams: Dict[str, List[int]]
+    _channel_trigrams: List[int]
+
+    def __init__(self, channels: Iterable[XMChannel], version: int = 0):
+        self.version = version
+        self.channels = tuple(sorted(channels, key=lambda c: int(c.channel_number)))
+
+        self._lookup = {}
+        self._trigrams = {}
+        self._channel_trigrams = []
+
+        for index, channel in enumerate(self.channels):
+            keys = [
+                channel.id.lower(),
+                str(channel.channel_number),
+                normalize_name(channel.id),
+                normalize_name(channel.name),
+                normalize_name(channel.streaming_name),
+            ]
+            for key in keys:
+                # first channel wins, same as `PlayerState.get_channel`
+                if key and key not in self._lookup:
+                    self._lookup[key] = channel
+
+            trigrams = get_trigrams(channel.name) | get_trigrams(channel.id)
+            self._channel_trigrams.append(len(trigrams))
+            for trigram in trigrams:
+                self._trigrams.setdefault(trigram, []).append(index)
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def get(self, name: str) -> Optional[XMChannel]:
+        """Returns channel with matching ID, channel number or name"""
+
+        name = name.strip()
+        channel = self._lookup.get(name.lower())
+        if channel is None:
+            channel = self._lookup.get(normalize_name(name))
+        return channel
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[XMChannel, float]]:
+        """Returns channels with the most similar names to `query`"""
+
+        trigrams = get_trigrams(query)
+        if len(trigrams) == 0:
+            return []
+
+        hits: Counter = Counter()
+        for trigram in trigrams:
+            hits.update(self._trigrams.get(trigram, []))
+
+        results: List[Tuple[XMChannel, float]] = []
+        for index, count in hits.items():
+            union = len(trigrams) + self._channel_trigrams[index] - count
+            results.append((self.channels[index], count / union))
+
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:limit]
+
+    def find(self, query: str) -> Optional[XMChannel]:
+        """Returns exact match for `query` or closest fuzzy match"""
+
+        channel = self.get(query)
+        if channel is None:
+            results = self.search(query, limit=1)
+            if len(results) > 0 and results[0][1] >= FUZZY_THRESHOLD:
+                channel = results[0][0]
+        return channel
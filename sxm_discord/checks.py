@@ -1,11 +1,13 @@
 from discord import TextChannel
 from discord_slash import SlashContext  # type: ignore
 
+from sxm_discord.tracing import traced
 from sxm_discord.utils import get_cog, send_message
 
 __all__ = ["no_pm", "require_voice"]
 
 
+@traced()
 async def no_pm(ctx: SlashContext):
     if not isinstance(ctx.channel, TextChannel):
         await send_message(
@@ -16,6 +18,7 @@ async def no_pm(ctx: SlashContext):
     return True
 
 
+@traced()
 async def require_voice(ctx: SlashContext):
     if not await no_pm(ctx):
         return False
@@ -29,6 +32,7 @@ async def require_voice(ctx: SlashContext):
     return True
 
 
+@traced()
 async def require_player_voice(ctx: SlashContext):
     if get_cog(ctx).player.voice is None:
         await send_message(
@@ -39,6 +43,7 @@ async def require_player_voice(ctx: SlashContext):
     return True
 
 
+@traced()
 async def require_sxm(ctx: SlashContext):
     if get_cog(ctx)._state.sxm_running:
         return True
@@ -46,6 +51,7 @@ async def require_sxm(ctx: SlashContext):
     return False
 
 
+@traced()
 async def require_matching_voice(ctx: SlashContext):
     if not await require_voice(ctx):
         return False
@@ -68,6 +74,15 @@ async def require_matching_voice(ctx: SlashContext):
     return True
 
 
+@traced()
+async def require_owner(ctx: SlashContext):
+    if await get_cog(ctx).bot.is_owner(ctx.author):
+        return True
+    await send_message(ctx, "Only the owner of the bot can do that")
+    return False
+
+
+@traced()
 async def is_playing(ctx: SlashContext):
     if not get_cog(ctx).player.is_playing:
         await send_message(
@@ -0,0 +1,171 @@
+"""Exports live cuts from the `RewindBuffer` into the archive.
+
+The Opus packets are copied as is into a Ogg container, so exporting a song
+is just writing a few MB to disk.
+"""
+
+import os
+import struct
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+from sxm.models import XMCutMarker, XMSong
+from sxm_player.models import DBSong
+from sxm_player.utils import get_art_url_by_size
+
+from sxm_discord.rewind import FRAME_MS, RewindBuffer, to_ms
+
+__all__ = ["export_song", "write_ogg_opus"]
+
+OPUS_RATE = 48000
+OPUS_CHANNELS = 2
+FRAME_SAMPLES = OPUS_RATE // 1000 * FRAME_MS
+OGG_SERIAL = 0x53584D44
+MAX_SEGMENTS = 255
+VENDOR = b"sxm-discord"
+UNKNOWN_ARTIST = "Unknown Artist"
+
+HEADER_BOS = 0x02
+HEADER_EOS = 0x04
+
+_BIT_REVERSE = bytes(int(f"{i:08b}"[::-1], 2) for i in range(256))
+
+
+def ogg_crc(data: bytes) -> int:
+    """CRC-32 of a Ogg page (polynomial 0x04c11db7, not reflected)"""
+
+    # zlib only has the reflected CRC-32, which gives the same result on bit
+    # reversed input. 0xFFFFFFFF in and out undo zlib's pre/post inversion
+    crc = zlib.crc32(data.translate(_BIT_REVERSE), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def _ogg_page(
+    packets: List[bytes], granule: int, sequence: int, header_type: int
+) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing.extend(b"\xff" * (len(packet) // 255))
+        lacing.append(len(packet) % 255)
+
+    page = bytearray(
+        struct.pack(
+            "<4sBBqIIIB",
+            b"OggS",
+            0,
+            header_type,
+            granule,
+            OGG_SERIAL,
+            sequence,
+            0,
+            len(lacing),
+        )
+    )
+    page.extend(lacing)
+    for packet in packets:
+        page.extend(packet)
+
+    page[22:26] = struct.pack("<I", ogg_crc(bytes(page)))
+    return bytes(page)
+
+
+def _opus_tags(tags: Iterable[Tuple[str, str]]) -> bytes:
+    comments = [f"{key}={value}".encode("utf8") for key, value in tags]
+
+    data = bytearray(b"OpusTags")
+    data.extend(struct.pack("<I", len(VENDOR)))
+    data.extend(VENDOR)
+    data.extend(struct.pack("<I", len(comments)))
+    for comment in comments:
+        data.extend(struct.pack("<I", len(comment)))
+        data.extend(comment)
+    return bytes(data)
+
+
+def write_ogg_opus(
+    path: str, packets: Iterable[bytes], tags: Iterable[Tuple[str, str]] = ()
+) -> int:
+    """Writes 20ms Opus packets to a Ogg Opus file, returns packets written"""
+
+    head = struct.pack("<8sBBHIhB", b"OpusHead", 1, OPUS_CHANNELS, 0, OPUS_RATE, 0, 0)
+
+    total = 0
+    with open(path, "wb") as f:
+        f.write(_ogg_page([head], 0, 0, HEADER_BOS))
+        f.write(_ogg_page([_opus_tags(tags)], 0, 1, 0))
+
+        sequence = 2
+        page: List[bytes] = []
+        segments = 0
+        for packet in packets:
+            needed = len(packet) // 255 + 1
+            if segments + needed > MAX_SEGMENTS:
+                f.write(_ogg_page(page, total * FRAME_SAMPLES, sequence, 0))
+                sequence += 1
+                page = []
+                segments = 0
+
+            page.append(packet)
+            segments += needed
+            total += 1
+
+        f.write(_ogg_page(page, total * FRAME_SAMPLES, sequence, HEADER_EOS))
+    return total
+
+
+def _path_filter(value: str) -> str:
+    return value.replace(os.sep, "-").replace("?", "").strip(". ")
+
+
+def export_song(
+    rewind: RewindBuffer,
+    cut: XMCutMarker,
+    channel_id: str,
+    processed_folder: str,
+) -> Optional[DBSong]:
+    """Writes a song cut from the rewind buffer to the processed folder.
+
+    Uses the same folder layout as the `sxm_player` archive processor.
+    Returns the `DBSong` to insert or `None` if the cut is not in the buffer.
+    """
+
+    if not isinstance(cut.cut, XMSong):
+        return None
+
+    start = to_ms(cut.time)
+    end = start + int(cut.duration.total_seconds() * 1000)
+    if not rewind.contains(start) or not rewind.contains(end - FRAME_MS):
+        return None
+
+    title = cut.cut.title
+    # SXM sends some cuts without any artists
+    artist = cut.cut.artists[0].name if len(cut.cut.artists) > 0 else UNKNOWN_ARTIST
+    album: Optional[str] = None
+    image_url: Optional[str] = None
+    folder = os.path.join(processed_folder, channel_id, "songs", _path_filter(artist))
+    if cut.cut.album is not None and cut.cut.album.title is not None:
+        album = cut.cut.album.title
+        image_url = get_art_url_by_size(cut.cut.album.arts, "MEDIUM")
+        folder = os.path.join(folder, _path_filter(album))
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{_path_filter(title)}.{cut.guid}.opus")
+
+    tags = [("TITLE", title), ("ARTIST", artist)]
+    if album is not None:
+        tags.append(("ALBUM", album))
+
+    if write_ogg_opus(path, rewind.iter_packets(start, end), tags) == 0:
+        os.remove(path)
+        return None
+
+    return DBSong(
+        guid=cut.guid,
+        title=title,
+        artist=artist,
+        album=album,
+        air_time=cut.time,
+        channel=channel_id,
+        file_path=path,
+        image_url=image_url,
+    )
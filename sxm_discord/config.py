@@ -0,0 +1,18 @@
+"""Lightweight settings shared between the runner and the Discord worker.
+
+This module must not import `discord` or anything else heavy since it is
+loaded while `sxm-player` is still parsing CLI options.
+"""
+
+import os
+
+ROOT_COMMAND_ENV = "SXM_INTERNAL_ROOT_COMMAND"
+SXM_COG_NAME = "SXMMusic"
+
+
+def set_root_command(value: str):
+    os.environ[ROOT_COMMAND_ENV] = value
+
+
+def get_root_command() -> str:
+    return os.environ.get(ROOT_COMMAND_ENV, "Music")
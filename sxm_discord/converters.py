@@ -4,12 +4,14 @@ from typing import List, Union
 from discord.ext.commands import BadArgument, Converter
 from sxm.models import XMChannel
 
+from sxm_discord.tracing import traced
 from sxm_discord.utils import get_cog
 
 
 class XMChannelConverter(Converter):
+    @traced()
     async def convert(self, ctx, channel_id: str) -> XMChannel:
-        channel: XMChannel = get_cog(ctx)._state.get_channel(channel_id)
+        channel = get_cog(ctx)._state.find_channel(channel_id)
 
         if channel is None:
             raise BadArgument(
@@ -21,19 +23,22 @@ class XMChannelConverter(Converter):
 
 
 class XMChannelListConverter(XMChannelConverter):
+    @traced()
     async def convert(  # type: ignore
         self, ctx, channel_ids: Union[str, List[str]]
     ) -> List[XMChannel]:
         if isinstance(channel_ids, str):
             channel_ids = channel_ids.split(",")
-        channels: List[XMChannel] = []
+        channel_ids = [c for c in channel_ids if c.strip() != ""]
+
+        if len(channel_ids) > 5:
+            raise BadArgument("too many `channel_ids`. Cannot be more than 5")
 
+        channels: List[XMChannel] = []
         for channel_id in channel_ids:
             channel = await super().convert(ctx, channel_id)
-            channels.append(channel)
-
-        if len(channels) > 5:
-            raise BadArgument("too many `channel_ids`. Cannot be more than 5")
+            if channel not in channels:
+                channels.append(channel)
 
         return channels
 
@@ -51,6 +56,7 @@ class IntRangeConverter(Converter):
             f"{self.min_number} and {self.max_number}"
         )
 
+    @traced()
     async def convert(self, ctx, argument: Union[str, int]) -> int:
         try:
             argument = int(argument)
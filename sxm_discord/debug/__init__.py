@@ -0,0 +1,4 @@
+"""Tools for reproducing and benchmarking the bot offline.
+
+Nothing in here is imported by the bot itself.
+"""
@@ -0,0 +1,447 @@
+"""Generates a processed folder with a large archive to scale test against.
+
+The database is the `songs.db` `sxm-player` creates and files are laid out
+like its processor does, `<channel>/songs/<artist>/<album>/<title>.<guid>.mp3`
+and `<channel>/shows/<show>/<title>.<date>.<guid>.mp3`. Each file is a second
+of silent MP3, so FFmpeg can play them.
+
+The archive looks like one recorded over years. Channels are archived in
+proportion to Zipf weights. Each channel plays from its own rotation of
+songs, where a few hits air far more than the rest and popular artists are
+on several channels. Air times go back from now at the pace the channel
+plays songs.
+
+Rows are written straight through `sqlite3` with the indexes added at the
+end. A 10M song archive takes a few minutes and about 6GB of disk. Use
+`--files songs` for archives that size, so plays of the same song share a
+file instead of creating millions of files:
+
+.. code-block:: console
+
+    $ python -m sxm_discord.debug.archive /tmp/archive --songs 10000000 --files songs
+"""
+
+import logging
+import os
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from zlib import crc32
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.session import Session
+from sxm_player.models import Base, DBEpisode, DBSong
+
+__all__ = ["CHANNELS", "FILE_MODES", "create_archive", "get_searches"]
+
+# (ID, name) of the channels archived, most listened to first
+CHANNELS: Tuple[Tuple[str, str], ...] = (
+    ("octane", "Octane"),
+    ("hits1", "SiriusXM Hits 1"),
+    ("thepulse", "The Pulse"),
+    ("siriusxmu", "SiriusXMU"),
+    ("altnation", "Alt Nation"),
+    ("80son8", "80s on 8"),
+    ("90son9", "90s on 9"),
+    ("bpm", "BPM"),
+    ("lithium", "Lithium"),
+    ("thehighway", "The Highway"),
+    ("hiphopnation", "Hip-Hop Nation"),
+    ("classicrewind", "Classic Rewind"),
+    ("firstwave", "1st Wave"),
+    ("thebridge", "The Bridge"),
+    ("coffeehouse", "The Coffee House"),
+    ("liquidmetal", "Liquid Metal"),
+)
+# "all" writes a file per play like `sxm-player`, "songs" one per song that
+# every play of it shares and "none" writes no files
+FILE_MODES = ("all", "songs", "none")
+CHUNK_SIZE = 50000
+EPISODE_RATIO = 0.01
+
+# silent MPEG-1 Layer III frame, 32kbps 44.1kHz mono
+MP3_FRAME = b"\xff\xfb\x10\xc0" + b"\x00" * 100
+MP3_FRAMES_PER_SECOND = 39
+
+_WORDS = (
+    "Midnight Fire Neon Heart Summer Ghost River Electric Golden Wild Broken "
+    "Silver Dream Velvet Thunder Paper Glass Ocean Highway Shadow Crystal Honey "
+    "Static Lonely Burning Falling Rebel Hollow Sugar Diamond Northern Lucky "
+    "Seven Wolves Satellite Cherry Blue Black Red Young Stone Rose Desert Iron "
+    "Echo Gravity Paradise Starlight Runaway Holy Tokyo Rain Sunset Machine "
+    "Kingdom Mirror Ashes Signal Crown Comet Hurricane Lights Forever Nothing"
+).split()
+_FIRST_NAMES = (
+    "Ava Mason Lily Jack Chloe Noah Zoe Miles Ruby Leo Nina Caleb Ivy Owen Mia "
+    "Cole Jade Reid Luna Beck Sadie Wade Maya Dean Tess Jude Cora Finn Lola"
+).split()
+_LAST_NAMES = (
+    "Carter Hayes Monroe Brooks Reyes Sloane Walker Keller Vance Harper Quinn "
+    "Lowe Marsh Fox Ellison Grant Pierce Rhodes Shaw Wilde Hart Cross Lane"
+).split()
+
+SongKey = Tuple[str, str, Optional[str]]
+
+
+def _zipf_weights(count: int, exponent: float) -> List[float]:
+    return list(accumulate(1 / (rank**exponent) for rank in range(1, count + 1)))
+
+
+def _choose(rng: random.Random, cum_weights: List[float]) -> int:
+    return bisect(cum_weights, rng.random() * cum_weights[-1])
+
+
+def _guid(rng: random.Random) -> str:
+    value = f"{rng.getrandbits(128):032x}"
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+
+def _artist_name(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.4:
+        return f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+    if kind < 0.7:
+        name = f"The {rng.choice(_WORDS)} {rng.choice(_WORDS)}"
+        return name if name.endswith("s") else f"{name}s"
+    return f"{rng.choice(_WORDS)} {rng.choice(_WORDS)}"
+
+
+def _title(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 3)))
+
+
+def get_searches(seed: int = 0, count: int = 50) -> List[str]:
+    """Search terms like users type, prefixes of titles and artists"""
+
+    rng = random.Random(seed)
+    searches: List[str] = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            searches.append(rng.choice(_FIRST_NAMES + _WORDS)[:3])
+        elif kind < 0.8:
+            searches.append(f"{rng.choice(_WORDS)} {rng.choice(_WORDS)}")
+        else:
+            searches.append(_artist_name(rng))
+    return searches
+
+
+class _Rotation:
+    """Songs a channel plays and how often it plays them"""
+
+    songs: List[SongKey]
+    weights: List[float]
+    # seconds between plays and radio time of the previous play
+    pace: float
+    cursor: datetime
+
+    def __init__(
+        self,
+        rng: random.Random,
+        size: int,
+        artists: List[Tuple[str, List[Tuple[str, Optional[str]]]]],
+        artist_weights: List[float],
+        now: datetime,
+    ):
+        songs: Dict[SongKey, None] = {}
+        for _ in range(size * 10):
+            if len(songs) >= size:
+                break
+
+            artist, catalog = artists[_choose(rng, artist_weights)]
+            for title, album in rng.sample(catalog, rng.randint(1, len(catalog))):
+                songs[(artist, title, album)] = None
+
+        self.songs = list(songs)
+        rng.shuffle(self.songs)
+        self.weights = _zipf_weights(len(self.songs), 0.9)
+        self.pace = rng.uniform(200, 260)
+        self.cursor = now
+
+
+def _format_time(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def _path_filter(value: str) -> str:
+    return value.replace("/", "-")
+
+
+class _FileWriter:
+    """Writes silent MP3s, hard linking to one file where possible"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.created: Set[str] = set()
+        self.count = 0
+        self._template = os.path.join(folder, "silence.template")
+        with open(self._template, "wb") as f:
+            f.write(MP3_FRAME * MP3_FRAMES_PER_SECOND)
+        self._link = hasattr(os, "link")
+
+    def write(self, path: str) -> None:
+        folder = os.path.dirname(path)
+        if folder not in self.created:
+            os.makedirs(folder, exist_ok=True)
+            self.created.add(folder)
+
+        if self._link:
+            try:
+                os.link(self._template, path)
+                self.count += 1
+                return
+            except OSError:
+                self._link = False
+
+        with open(path, "wb") as f:
+            f.write(MP3_FRAME * MP3_FRAMES_PER_SECOND)
+        self.count += 1
+
+    def close(self) -> None:
+        os.remove(self._template)
+
+
+def _generate_songs(
+    rng: random.Random,
+    folder: str,
+    count: int,
+    channels: Sequence[str],
+    files: str,
+    missing: float,
+    writer: _FileWriter,
+    now: datetime,
+) -> Iterator[tuple]:
+    # rotations change over the years, the more that is archived the more
+    # different songs there are, about 20 plays of each
+    rotation_size = min(max(count // len(channels) // 20, 300), 20000)
+    artist_count = max(50, rotation_size * len(channels) // 3)
+    artists = []
+    for _ in range(artist_count):
+        name = _artist_name(rng)
+        albums = [_title(rng) for _ in range(rng.randint(1, 4))]
+        catalog = [
+            (_title(rng), rng.choice(albums) if rng.random() < 0.9 else None)
+            for _ in range(rng.randint(1, 12))
+        ]
+        artists.append((name, catalog))
+    artist_weights = _zipf_weights(artist_count, 1.1)
+
+    rotations = [
+        _Rotation(
+            rng,
+            int(rotation_size * rng.uniform(0.5, 1.5)),
+            artists,
+            artist_weights,
+            now,
+        )
+        for _ in channels
+    ]
+    channel_weights = _zipf_weights(len(channels), 0.8)
+    song_files: Dict[Tuple[str, SongKey], str] = {}
+
+    for _ in range(count):
+        channel_index = _choose(rng, channel_weights)
+        channel = channels[channel_index]
+        rotation = rotations[channel_index]
+        song = rotation.songs[_choose(rng, rotation.weights)]
+        artist, title, album = song
+
+        rotation.cursor -= timedelta(seconds=rotation.pace * rng.uniform(0.6, 1.4))
+        guid = _guid(rng)
+
+        song_folder = os.path.join(folder, channel, "songs", _path_filter(artist))
+        if album is not None:
+            song_folder = os.path.join(song_folder, _path_filter(album))
+        file_path = os.path.join(song_folder, f"{_path_filter(title)}.{guid}.mp3")
+
+        if missing > 0 and rng.random() < missing:
+            pass
+        elif files == "all":
+            writer.write(file_path)
+        elif files == "songs":
+            shared = song_files.get((channel, song))
+            if shared is None:
+                writer.write(file_path)
+                song_files[(channel, song)] = file_path
+            else:
+                file_path = shared
+
+        image_url = None
+        if album is not None:
+            image_url = f"https://albumart.example.com/{crc32(album.encode()):08x}.jpg"
+
+        yield (
+            guid,
+            title,
+            artist,
+            album,
+            _format_time(rotation.cursor),
+            channel,
+            file_path,
+            image_url,
+        )
+
+
+def _generate_episodes(
+    rng: random.Random,
+    folder: str,
+    count: int,
+    channels: Sequence[str],
+    files: str,
+    writer: _FileWriter,
+    now: datetime,
+) -> Iterator[tuple]:
+    shows = [
+        f"{_title(rng)} with {_artist_name(rng)}" for _ in range(max(5, count // 50))
+    ]
+    show_weights = _zipf_weights(len(shows), 1.0)
+    cursors = {channel: now for channel in channels}
+
+    for index in range(count):
+        channel = channels[index % len(channels)]
+        show = shows[_choose(rng, show_weights)]
+        cursors[channel] -= timedelta(hours=rng.choice((1, 2, 3, 4)))
+        air_time = cursors[channel]
+        title = f"{show} {air_time.strftime('%B %d')}"
+        guid = _guid(rng)
+
+        file_path = os.path.join(
+            folder,
+            channel,
+            "shows",
+            _path_filter(show),
+            f"{_path_filter(title)}.{air_time.strftime('%Y-%m-%d-%H.%M')}.{guid}.mp3",
+        )
+        if files != "none":
+            writer.write(file_path)
+
+        yield (guid, title, show, _format_time(air_time), channel, file_path, None)
+
+
+def _insert(cursor, table: str, rows: Iterator[tuple], log: logging.Logger) -> int:
+    total = 0
+    chunk: List[tuple] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            cursor.executemany(
+                f"INSERT INTO {table} VALUES ({', '.join('?' * len(row))})", chunk
+            )
+            total += len(chunk)
+            chunk = []
+            if total % (CHUNK_SIZE * 20) == 0:
+                log.info(f"{table}: {total} rows")
+
+    if len(chunk) > 0:
+        cursor.executemany(
+            f"INSERT INTO {table} VALUES ({', '.join('?' * len(chunk[0]))})", chunk
+        )
+        total += len(chunk)
+    return total
+
+
+def create_archive(
+    folder: str,
+    songs: int,
+    episodes: Optional[int] = None,
+    channels: Optional[Sequence[str]] = None,
+    files: str = "all",
+    missing: float = 0,
+    seed: int = 0,
+) -> Session:
+    """Archives `songs` songs and `episodes` shows into empty `folder`.
+
+    `missing` is the fraction of songs without a file, like ones that were
+    deleted from the processed folder.
+    """
+
+    if files not in FILE_MODES:
+        raise ValueError(f"`files` has to be one of {FILE_MODES}")
+    if channels is None:
+        channels = [channel_id for channel_id, _ in CHANNELS]
+    if episodes is None:
+        episodes = int(songs * EPISODE_RATIO)
+
+    log = logging.getLogger("sxm_discord.archive")
+    os.makedirs(folder, exist_ok=True)
+    song_db = os.path.join(folder, "songs.db")
+    if os.path.exists(song_db):
+        raise FileExistsError(f"{song_db} already exists")
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = time.monotonic()
+
+    engine = create_engine(f"sqlite:///{song_db}")
+    tables = [DBSong.__table__, DBEpisode.__table__]  # type: ignore
+    Base.metadata.create_all(engine)
+    # far faster to build the indexes once at the end
+    for table in tables:
+        for index in table.indexes:
+            index.drop(engine)
+
+    writer = _FileWriter(folder)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode = OFF")
+        cursor.execute("PRAGMA synchronous = OFF")
+
+        song_rows = _generate_songs(
+            rng, folder, songs, channels, files, missing, writer, now
+        )
+        _insert(cursor, "songs", song_rows, log)
+        episode_rows = _generate_episodes(
+            rng, folder, episodes, channels, files, writer, now
+        )
+        _insert(cursor, "episodes", episode_rows, log)
+        connection.commit()
+    finally:
+        connection.close()
+        writer.close()
+
+    log.info("building indexes")
+    for table in tables:
+        for index in table.indexes:
+            index.create(engine)
+
+    log.info(
+        f"archived {songs} songs and {episodes} shows with {writer.count} files "
+        f"in {time.monotonic() - start:.0f}s"
+    )
+    return sessionmaker(bind=engine)()
+
+
+@click.command()
+@click.argument("folder", type=click.Path(file_okay=False))
+@click.option("--songs", type=int, default=100000, help="Songs to archive")
+@click.option("--episodes", type=int, help="Shows to archive, 1% of songs default")
+@click.option(
+    "--files",
+    type=click.Choice(FILE_MODES),
+    default="all",
+    help="File for every play, one per song or none",
+)
+@click.option(
+    "--missing", type=float, default=0, help="Fraction of songs without a file"
+)
+@click.option("--seed", type=int, default=0, help="Seed for the random archive")
+def main(
+    folder: str,
+    songs: int,
+    episodes: Optional[int],
+    files: str,
+    missing: float,
+    seed: int,
+):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    create_archive(folder, songs, episodes, files=files, missing=missing, seed=seed)
+
+
+if __name__ == "__main__":
+    main()
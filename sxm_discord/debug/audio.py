@@ -0,0 +1,649 @@
+"""Benchmarks of the audio pipeline, `AudioPlayer` down to the voice packets.
+
+`AudioPlayer` plays into the stand-in voice client from
+`sxm_discord.debug.fakes`, which reads frames in real time like
+`discord.VoiceClient` and times every one of them. Measured are how far
+frames are off the 20ms pace (jitter), the silence between tracks (gap),
+how long until audio after a `skip` or after starting to play, and the CPU
+used per second of audio by the bot and by FFmpeg.
+
+The scenarios are a live channel sent as MPEG-TS over UDP by a local
+sender, archived files, one file on repeat and a random playlist with
+skips. With FFmpeg on the `PATH` everything runs through real FFmpeg, the
+sender included. Without it, sources read silent Opus frames (from a UDP
+socket for the live channel), so only the Python side is measured.
+
+.. code-block:: console
+
+    $ python -m sxm_discord.debug.audio --json before.json
+    $ python -m sxm_discord.debug.audio --baseline before.json
+"""
+
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import socket
+import subprocess  # nosec
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, cast
+
+import click
+from discord import FFmpegOpusAudio
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+from sxm.models import XMChannel
+from sxm_player.models import DBSong, Song
+from sxm_player.queue import Queue
+
+from sxm_discord.debug.archive import CHANNELS, create_archive
+from sxm_discord.debug.bench import compare_results, percentile
+from sxm_discord.debug.fakes import (
+    FRAME_LENGTH,
+    SILENCE,
+    FakeOpusAudio,
+    FakeQueue,
+    FakeVoiceChannel,
+    FakeVoiceClient,
+    create_raw_channel,
+)
+from sxm_discord.metrics import UNDERRUN_GAP
+from sxm_discord.music import AudioPlayer
+
+__all__ = ["AudioEnv", "FrameProbe", "compare_cpu", "run_scenarios"]
+
+BACKENDS = ("auto", "ffmpeg", "fake")
+# tracks of the fake backend, as long as the archive's silent MP3s
+FAKE_TRACK_FRAMES = 50
+# frames the fake live sender stays ahead of real time
+SENDER_AHEAD = 5
+# how far into a track the playlist skips it
+SKIP_AFTER = 0.3
+# timings with fewer samples (like the start of a scenario) are too noisy
+# to compare against a baseline, p99 needs far more to not just be the max
+MIN_SAMPLES = 5
+MIN_P99_SAMPLES = 100
+# changes in timing smaller than this are lost in scheduler noise (and
+# Discord's jitter buffer)
+MIN_TIMING_REGRESSION = 0.005
+# CPU seconds per second of audio over the baseline by less than this
+# is always noise
+MIN_CPU_REGRESSION = 0.01
+
+
+def _cpu_children() -> float:
+    """CPU time of the exited child processes (FFmpeg)"""
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _UDPOpusAudio:
+    """Reads the Opus frames `_FakeSender` sends to `url` (`udp://host:port`)"""
+
+    def __init__(self, url: str, *args, **kwargs):
+        host, port = url[len("udp://") :].rsplit(":", 1)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, int(port)))
+        self._socket.settimeout(1)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        try:
+            return self._socket.recv(1024)
+        except socket.timeout:
+            # sender stopped, end of stream
+            return b""
+
+    def cleanup(self) -> None:
+        self._socket.close()
+
+
+class _FakeTrackAudio(FakeOpusAudio):
+    length = FAKE_TRACK_FRAMES
+
+
+def _fake_source(source: str, *args, **kwargs):
+    if source.startswith("udp://"):
+        return _UDPOpusAudio(source, *args, **kwargs)
+    return _FakeTrackAudio(source, *args, **kwargs)
+
+
+class _FakeSender:
+    """Sends a frame of silent Opus every 20ms, stands in for FFmpeg"""
+
+    def __init__(self, port: int):
+        self._address = ("127.0.0.1", port)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(self._address)
+            start = time.perf_counter()
+            frames = 0
+            while not self._stop.is_set():
+                try:
+                    s.send(SILENCE)
+                except ConnectionRefusedError:
+                    # nothing is listening yet, once something is the sender
+                    # is ahead of real time like FFmpeg's output buffer, so
+                    # reads do not wait on the sender's clock
+                    time.sleep(0.001)
+                    start = time.perf_counter()
+                    frames = -SENDER_AHEAD
+                    continue
+                frames += 1
+                delay = start + frames * FRAME_LENGTH - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class _FFmpegSender:
+    """Sends a tone as AAC in MPEG-TS over UDP, like sxm-player's HLS stream"""
+
+    def __init__(self, port: int):
+        self._process = subprocess.Popen(  # nosec
+            [
+                "ffmpeg",
+                "-loglevel",
+                "fatal",
+                "-re",
+                "-f",
+                "lavfi",
+                "-i",
+                "sine=frequency=440:sample_rate=44100",
+                "-c:a",
+                "aac",
+                "-b:a",
+                "256k",
+                "-f",
+                "mpegts",
+                f"udp://127.0.0.1:{port}?pkt_size=1316",
+            ],
+            stdin=subprocess.DEVNULL,
+        )
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+class FrameProbe:
+    """Times the frames a `FakeVoiceClient` sends, called from its thread.
+
+    The first frame of a source ends a gap, a skip or a start, whichever
+    was asked for last. All other frames count towards the jitter.
+    """
+
+    frames: int = 0
+    # sources that sent at least one frame
+    tracks: int = 0
+    # frames more than `UNDERRUN_GAP` after the one before
+    late: int = 0
+    jitter: List[float]
+    gaps: List[float]
+    skips: List[float]
+    starts: List[float]
+
+    _last: Optional[float] = None
+    _skip_at: Optional[float] = None
+    _start_at: Optional[float] = None
+
+    def __init__(self, voice: FakeVoiceClient):
+        self.jitter = []
+        self.gaps = []
+        self.skips = []
+        self.starts = []
+
+        self._voice = voice
+        self._plays = voice.plays
+        voice.on_frame = self._on_frame
+
+    @property
+    def seconds(self) -> float:
+        """Seconds of audio sent"""
+
+        return self.frames * FRAME_LENGTH
+
+    def mark_start(self) -> None:
+        self._start_at = time.perf_counter()
+
+    def mark_skip(self) -> None:
+        self._skip_at = time.perf_counter()
+
+    def _on_frame(self, now: float) -> None:
+        self.frames += 1
+        plays = self._voice.plays
+        if plays != self._plays:
+            self._plays = plays
+            self.tracks += 1
+            if self._start_at is not None:
+                self.starts.append(now - self._start_at)
+                self._start_at = None
+            elif self._skip_at is not None:
+                self.skips.append(now - self._skip_at)
+                self._skip_at = None
+            elif self._last is not None:
+                self.gaps.append(max(0.0, now - self._last - FRAME_LENGTH))
+        elif self._last is not None:
+            interval = now - self._last
+            self.jitter.append(abs(interval - FRAME_LENGTH))
+            if interval > UNDERRUN_GAP:
+                self.late += 1
+        self._last = now
+
+    async def wait_tracks(self, count: int, timeout: float = 30) -> None:
+        end = time.monotonic() + timeout
+        while self.tracks < count:
+            if time.monotonic() > end:
+                raise TimeoutError(f"only {self.tracks} of {count} tracks played")
+            await asyncio.sleep(0.005)
+
+
+class ScenarioResult:
+    name: str
+    probe: FrameProbe
+    cpu: float
+    ffmpeg_cpu: Optional[float]
+
+    def __init__(
+        self, name: str, probe: FrameProbe, cpu: float, ffmpeg_cpu: Optional[float]
+    ):
+        self.name = name
+        self.probe = probe
+        self.cpu = cpu
+        self.ffmpeg_cpu = ffmpeg_cpu
+
+    def timings(self) -> Dict[str, List[float]]:
+        return {
+            "start": self.probe.starts,
+            "jitter": self.probe.jitter,
+            "gap": self.probe.gaps,
+            "skip": self.probe.skips,
+        }
+
+    def to_dict(self) -> dict:
+        seconds = self.probe.seconds
+        return {
+            "audio_seconds": seconds,
+            "tracks": self.probe.tracks,
+            "late_frames": self.probe.late,
+            "cpu": self.cpu / seconds if seconds > 0 else 0,
+            "ffmpeg_cpu": (
+                None
+                if self.ffmpeg_cpu is None or seconds == 0
+                else self.ffmpeg_cpu / seconds
+            ),
+            **{
+                key: {
+                    "count": len(samples),
+                    "p50": percentile(samples, 0.5),
+                    "p99": percentile(samples, 0.99),
+                    "max": max(samples),
+                }
+                for key, samples in self.timings().items()
+                if len(samples) > 0
+            },
+        }
+
+
+class AudioEnv:
+    """Archive and `AudioPlayer` setup shared by the scenarios"""
+
+    backend: str
+    db: Session
+    players: List[AudioPlayer]
+    xm_channel: XMChannel
+    seconds: float
+    tracks: int
+
+    def __init__(self, backend: str, db: Session, seconds: float, tracks: int):
+        self.backend = backend
+        self.db = db
+        self.seconds = seconds
+        self.tracks = tracks
+        self.players = []
+
+        # the channel with the most songs archived
+        channel_id = (
+            db.query(DBSong.channel)
+            .group_by(DBSong.channel)
+            .order_by(func.count().desc())
+            .limit(1)
+            .scalar()
+        )
+        self.xm_channel = XMChannel.from_dict(
+            create_raw_channel(1, channel_id, channel_id)
+        )
+        self.voice_channel = FakeVoiceChannel("radio", bitrate=128000, speed=1)
+
+    def create_player(self) -> AudioPlayer:
+        source = FFmpegOpusAudio if self.backend == "ffmpeg" else _fake_source
+
+        class _BenchAudioPlayer(AudioPlayer):
+            opus_source = staticmethod(source)
+            recording_source = staticmethod(source)
+
+        # `FakeQueue` has the methods of `Queue` the player uses
+        event_queue = cast(Queue, FakeQueue())
+        player = _BenchAudioPlayer(event_queue, asyncio.get_event_loop())
+        # the task of a dropped player is garbage collected while pending
+        self.players.append(player)
+        return player
+
+    def create_sender(self, port: int):
+        if self.backend == "ffmpeg":
+            return _FFmpegSender(port)
+        return _FakeSender(port)
+
+    def songs(self, count: int) -> List[Song]:
+        query = (
+            self.db.query(DBSong)
+            .filter(DBSong.channel == self.xm_channel.id)
+            .order_by(DBSong.air_time.desc())
+            .limit(count)
+        )
+        return [Song.from_orm(s) for s in query]
+
+    async def run(
+        self, name: str, scenario: Callable[[AudioPlayer, FrameProbe], Awaitable[Any]]
+    ) -> ScenarioResult:
+        """Runs `scenario` with a new player and the CPU it used"""
+
+        player = self.create_player()
+        await player.set_voice(self.voice_channel)  # type: ignore
+        probe = FrameProbe(player.voice)  # type: ignore
+
+        cpu_start = time.process_time()
+        ffmpeg_start = _cpu_children()
+        try:
+            await scenario(player, probe)
+        finally:
+            await player.stop()
+            await player.cleanup()
+            # voice thread reaps FFmpeg after it stops
+            await asyncio.sleep(0.2)
+
+        ffmpeg_cpu = _cpu_children() - ffmpeg_start
+        return ScenarioResult(
+            name,
+            probe,
+            time.process_time() - cpu_start,
+            ffmpeg_cpu if self.backend == "ffmpeg" else None,
+        )
+
+
+async def scenario_live(env: AudioEnv) -> ScenarioResult:
+    port = _free_port()
+    sender = env.create_sender(port)
+
+    async def _play(player: AudioPlayer, probe: FrameProbe):
+        probe.mark_start()
+        await player.add_live_stream(env.xm_channel, f"udp://127.0.0.1:{port}")
+        await probe.wait_tracks(1)
+        await asyncio.sleep(env.seconds)
+
+    try:
+        # FFmpeg CPU is measured once the player's FFmpeg exited, the
+        # sender's is not included
+        return await env.run("live", _play)
+    finally:
+        sender.stop()
+
+
+async def scenario_files(env: AudioEnv) -> ScenarioResult:
+    async def _play(player: AudioPlayer, probe: FrameProbe):
+        songs = env.songs(env.tracks)
+        probe.mark_start()
+        for song in songs:
+            await player.add_file(song)
+        await probe.wait_tracks(len(songs))
+        while player.current is not None:
+            await asyncio.sleep(0.005)
+
+    return await env.run("files", _play)
+
+
+async def scenario_repeat(env: AudioEnv) -> ScenarioResult:
+    async def _play(player: AudioPlayer, probe: FrameProbe):
+        player.repeat = True
+        probe.mark_start()
+        await player.add_file(env.songs(1)[0])
+        await probe.wait_tracks(env.tracks + 1)
+
+    return await env.run("repeat", _play)
+
+
+async def scenario_playlist(env: AudioEnv) -> ScenarioResult:
+    async def _play(player: AudioPlayer, probe: FrameProbe):
+        probe.mark_start()
+        await player.add_playlist([env.xm_channel], env.db)
+        for track in range(1, env.tracks + 1):
+            await probe.wait_tracks(track)
+            # every other track is skipped, the rest play to the end
+            if track % 2 == 0:
+                await asyncio.sleep(SKIP_AFTER)
+                probe.mark_skip()
+                await player.skip()
+
+    return await env.run("playlist", _play)
+
+
+async def run_scenarios(env: AudioEnv) -> List[ScenarioResult]:
+    results: List[ScenarioResult] = []
+    for scenario in (scenario_live, scenario_files, scenario_repeat, scenario_playlist):
+        results.append(await scenario(env))
+    return results
+
+
+def flatten_timings(results: Dict[str, dict], min_samples: int) -> Dict[str, dict]:
+    """Timings of the `to_dict` results as "<scenario> <timing>" for
+    `compare_results`, leaving out ones with less than `min_samples`"""
+
+    return {
+        f"{name} {key}": value
+        for name, result in results.items()
+        for key, value in result.items()
+        if isinstance(value, dict) and value["count"] >= min_samples
+    }
+
+
+def compare_cpu(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    """Returns descriptions of every scenario that used more CPU than the
+    baseline allows"""
+
+    regressions: List[str] = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        for key in ("cpu", "ffmpeg_cpu"):
+            if result.get(key) is None or old.get(key) is None:
+                continue
+            allowed = max(old[key] * (1 + tolerance), old[key] + MIN_CPU_REGRESSION)
+            if result[key] > allowed:
+                regressions.append(
+                    f"{name} {key}: {result[key] * 100:.2f}%, "
+                    f"was {old[key] * 100:.2f}%"
+                )
+    return regressions
+
+
+def _ms(result: dict, key: str, quantile: str) -> str:
+    if key not in result:
+        return ""
+    return f"{result[key][quantile] * 1000:.2f}"
+
+
+def _summary(results: Dict[str, dict]) -> str:
+    from tabulate import tabulate
+
+    rows = []
+    for name, r in results.items():
+        ffmpeg_cpu = "" if r["ffmpeg_cpu"] is None else f"{r['ffmpeg_cpu'] * 100:.1f}"
+        rows.append(
+            (
+                name,
+                f"{r['audio_seconds']:.0f}",
+                r["tracks"],
+                _ms(r, "start", "p50"),
+                _ms(r, "jitter", "p99"),
+                r["late_frames"],
+                _ms(r, "gap", "p50"),
+                _ms(r, "gap", "max"),
+                _ms(r, "skip", "p50"),
+                f"{r['cpu'] * 100:.1f}",
+                ffmpeg_cpu,
+            )
+        )
+    return tabulate(
+        rows,
+        headers=[
+            "Scenario",
+            "Audio (s)",
+            "Tracks",
+            "Start (ms)",
+            "Jitter p99 (ms)",
+            "Late",
+            "Gap p50 (ms)",
+            "Gap max (ms)",
+            "Skip p50 (ms)",
+            "CPU %",
+            "FFmpeg CPU %",
+        ],
+    )
+
+
+def _ffmpeg_version() -> Optional[str]:
+    if shutil.which("ffmpeg") is None:
+        return None
+
+    output = subprocess.run(  # nosec
+        ["ffmpeg", "-version"], capture_output=True, text=True
+    ).stdout
+    return output.split("\n", 1)[0]
+
+
+@click.command()
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="auto",
+    help="Play through FFmpeg or fake sources, FFmpeg if installed by default",
+)
+@click.option("--seconds", type=float, default=10, help="Seconds of live audio")
+@click.option("--tracks", type=int, default=20, help="Tracks of each file scenario")
+@click.option(
+    "--folder",
+    type=click.Path(file_okay=False),
+    help="Processed folder with real songs to play, instead of a silent archive",
+)
+@click.option("--json", "json_path", type=click.Path(), help="Writes results to file")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results from `--json` to compare against",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.25,
+    help="How much slower or more CPU than the baseline is allowed",
+)
+def main(
+    backend: str,
+    seconds: float,
+    tracks: int,
+    folder: Optional[str],
+    json_path: Optional[str],
+    baseline: Optional[str],
+    tolerance: float,
+):
+    logging.basicConfig(level=logging.WARNING)
+
+    ffmpeg = _ffmpeg_version()
+    if backend == "auto":
+        backend = "fake" if ffmpeg is None else "ffmpeg"
+    elif backend == "ffmpeg" and ffmpeg is None:
+        raise click.UsageError("FFmpeg is not installed")
+
+    async def _run(db: Session) -> List[ScenarioResult]:
+        env = AudioEnv(backend, db, seconds, tracks)
+        try:
+            return await run_scenarios(env)
+        finally:
+            # audio player tasks
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    loop = asyncio.get_event_loop()
+    if folder is None:
+        with tempfile.TemporaryDirectory() as temp_folder:
+            db = create_archive(temp_folder, songs=1000, channels=[CHANNELS[0][0]])
+            results = loop.run_until_complete(_run(db))
+    else:
+        from sxm_player.utils import init_db
+
+        results = loop.run_until_complete(_run(init_db(folder, cleanup=False)))
+
+    results_data = {r.name: r.to_dict() for r in results}
+    data = {
+        "backend": backend,
+        "ffmpeg": ffmpeg if backend == "ffmpeg" else None,
+        "archive": "silent" if folder is None else os.path.abspath(folder),
+        "results": results_data,
+    }
+    click.echo(_summary(results_data))
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline_data = json.load(f)
+        for key in ("backend", "ffmpeg", "archive"):
+            if baseline_data.get(key) != data[key]:
+                click.echo(f"warning: baseline was ran with a different {key}")
+
+        regressions: List[str] = []
+        for quantile, min_samples in (("p50", MIN_SAMPLES), ("p99", MIN_P99_SAMPLES)):
+            regressions += compare_results(
+                flatten_timings(results_data, min_samples),
+                flatten_timings(baseline_data["results"], min_samples),
+                tolerance,
+                quantiles=(quantile,),
+                min_regression=MIN_TIMING_REGRESSION,
+            )
+        regressions += compare_cpu(results_data, baseline_data["results"], tolerance)
+        if len(regressions) > 0:
+            click.echo("\nworse than baseline:\n" + "\n".join(regressions))
+            sys.exit(1)
+        click.echo("\nno regressions from baseline")
+
+
+if __name__ == "__main__":
+    main()
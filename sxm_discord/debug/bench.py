@@ -0,0 +1,423 @@
+"""Latency benchmarks of the slash commands, run offline.
+
+Commands go through their real handlers (`deferrable`, checks and the player
+command serializer) with the stand-ins from `sxm_discord.debug.fakes`, an
+archive from `sxm_discord.debug.archive` and 5 hours of live metadata.
+Results can be saved as JSON and compared against an earlier run, which
+exits with 1 if any benchmark got slower than `--tolerance` allows.
+
+.. code-block:: console
+
+    $ python -m sxm_discord.debug.bench --songs 50000 --json before.json
+    $ python -m sxm_discord.debug.bench --songs 50000 --baseline before.json
+
+Pass `--folder` to reuse an archive, like a large one made with
+`python -m sxm_discord.debug.archive`.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import click
+from sxm_player.models import DBSong
+from sxm_player.queue import EventMessage, EventTypes
+
+from sxm_discord.debug.archive import CHANNELS, create_archive, get_searches
+from sxm_discord.debug.fakes import (
+    FakeContext,
+    FakeGuild,
+    FakeReaction,
+    api_calls,
+    create_raw_channel,
+    create_raw_live,
+    create_worker,
+    set_api_latency,
+)
+from sxm_discord.music import PlayType
+
+__all__ = [
+    "BenchEnv",
+    "BenchResult",
+    "compare_results",
+    "percentile",
+    "run_benchmarks",
+]
+
+LIVE_CHANNEL = CHANNELS[0][0]
+LIVE_STREAM = "udp://127.0.0.1:9999"
+# slower than the baseline by less than this is always noise
+MIN_REGRESSION = 0.001
+
+Step = Callable[[], Awaitable[Any]]
+
+
+def percentile(samples: List[float], quantile: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(quantile * len(ordered)))
+    return ordered[index]
+
+
+class BenchResult:
+    name: str
+    samples: List[float]
+    api_calls: int
+
+    def __init__(self, name: str, samples: List[float], api_calls: int):
+        self.name = name
+        self.samples = samples
+        self.api_calls = api_calls
+
+    @property
+    def p50(self) -> float:
+        return percentile(self.samples, 0.5)
+
+    @property
+    def p99(self) -> float:
+        return percentile(self.samples, 0.99)
+
+    @property
+    def throughput(self) -> float:
+        """Commands per second when ran one after another"""
+
+        total = sum(self.samples)
+        if total == 0:
+            return 0
+        return len(self.samples) / total
+
+    def to_dict(self) -> dict:
+        return {
+            "iterations": len(self.samples),
+            "p50": self.p50,
+            "p99": self.p99,
+            "max": max(self.samples),
+            "throughput": self.throughput,
+            "api_calls": self.api_calls / len(self.samples),
+        }
+
+
+class BenchEnv:
+    """A fake worker in a guild with someone in voice to run commands as"""
+
+    iterations: int
+    warmup: int
+    # size of the archive
+    songs: int = 0
+
+    def __init__(self, worker, iterations: int = 100, warmup: int = 3):
+        self.worker = worker
+        self.iterations = iterations
+        self.warmup = warmup
+
+        self.guild = FakeGuild()
+        self.text_channel = self.guild.create_text_channel("music")
+        self.voice_channel = self.guild.create_voice_channel("radio", listeners=3)
+        self.author = self.guild.add_member("dj")
+        self.author.join(self.voice_channel)
+
+    def context(self) -> FakeContext:
+        return FakeContext(self.worker.bot, self.author, self.text_channel)
+
+    async def invoke(self, command: str, **kwargs) -> FakeContext:
+        """Runs cog slash command `command` like Discord would"""
+
+        ctx = self.context()
+        slash_command = getattr(type(self.worker), command)
+        await slash_command.func(self.worker, ctx, **kwargs)
+        return ctx
+
+    async def wait_playing(self, timeout: float = 5) -> None:
+        end = time.monotonic() + timeout
+        while not self.worker.player.is_playing:
+            if time.monotonic() > end:
+                raise TimeoutError("player did not start playing")
+            await asyncio.sleep(0.001)
+
+    async def stop_player(self) -> None:
+        self.worker._pending = None
+        await self.worker.player.stop()
+
+    async def measure(
+        self, name: str, step: Step, prepare: Optional[Step] = None
+    ) -> BenchResult:
+        samples: List[float] = []
+        calls = 0
+        for index in range(self.warmup + self.iterations):
+            if prepare is not None:
+                await prepare()
+
+            calls_before = sum(api_calls.values())
+            start = time.perf_counter()
+            await step()
+            elapsed = time.perf_counter() - start
+
+            if index >= self.warmup:
+                samples.append(elapsed)
+                calls += sum(api_calls.values()) - calls_before
+        return BenchResult(name, samples, calls)
+
+
+async def bench_playing(env: BenchEnv) -> BenchResult:
+    return await env.measure("playing", lambda: env.invoke("playing"))
+
+
+async def bench_recent(env: BenchEnv) -> BenchResult:
+    return await env.measure("recent", lambda: env.invoke("recent", count=10))
+
+
+async def bench_carousel(env: BenchEnv) -> BenchResult:
+    carousel = None
+
+    async def _prepare():
+        nonlocal carousel
+        if carousel is None or carousel.index >= len(carousel.items) - 1:
+            ctx = await env.invoke("recent", count=10)
+            carousel = env.worker.carousels[ctx.message.id]
+
+    async def _next_page():
+        await env.worker.on_reaction_add(
+            FakeReaction(carousel.message, "➡️"), env.author  # type: ignore
+        )
+
+    return await env.measure("carousel page", _next_page, _prepare)
+
+
+async def bench_songs(env: BenchEnv) -> BenchResult:
+    terms = get_searches() + ["no such song"]
+    index = 0
+
+    async def _search():
+        nonlocal index
+        index += 1
+        await env.invoke("sxm_songs", search=terms[index % len(terms)])
+
+    return await env.measure("sxm songs", _search)
+
+
+async def bench_playlist(env: BenchEnv) -> BenchResult:
+    return await env.measure(
+        "sxm playlist",
+        lambda: env.invoke("sxm_playlist", channels=LIVE_CHANNEL, threshold=40),
+        env.stop_player,
+    )
+
+
+async def bench_skip(env: BenchEnv) -> BenchResult:
+    async def _prepare():
+        if env.worker.player.play_type != PlayType.RANDOM:
+            await env.stop_player()
+            await env.invoke("sxm_playlist", channels=LIVE_CHANNEL, threshold=40)
+        await env.wait_playing()
+
+    return await env.measure("skip", lambda: env.invoke("skip"), _prepare)
+
+
+async def _start_live(env: BenchEnv) -> None:
+    await env.worker.player.set_voice(env.voice_channel)
+    await env.worker._process_events(
+        [
+            (
+                "hls_stream",
+                EventMessage(
+                    "hls", EventTypes.HLS_STREAM_STARTED, (LIVE_CHANNEL, LIVE_STREAM)
+                ),
+            )
+        ]
+    )
+    await env.wait_playing()
+
+
+async def run_benchmarks(env: BenchEnv) -> List[BenchResult]:
+    results: List[BenchResult] = []
+
+    await _start_live(env)
+    for live_bench in (bench_playing, bench_recent, bench_carousel):
+        results.append(await live_bench(env))
+
+    await env.stop_player()
+    for archive_bench in (bench_songs, bench_playlist, bench_skip):
+        results.append(await archive_bench(env))
+    return results
+
+
+def create_env(folder: str, songs: int, iterations: int, warmup: int) -> BenchEnv:
+    """Creates worker for `folder`, archiving `songs` into it if empty"""
+
+    from sxm_discord.bot import DiscordArchivedWorker
+
+    if os.path.exists(os.path.join(folder, "songs.db")):
+        from sxm_player.utils import init_db
+
+        db = init_db(folder, cleanup=False)
+        songs = db.query(DBSong).count()
+    else:
+        db = create_archive(folder, songs)
+
+    now = datetime.now(timezone.utc)
+    worker = create_worker(
+        DiscordArchivedWorker,
+        processed_folder=folder,
+        sxm_status=True,
+        channels=[
+            create_raw_channel(number, channel_id, name)
+            for number, (channel_id, name) in enumerate(CHANNELS, start=1)
+        ],
+        raw_live_data=(
+            now - timedelta(hours=1),
+            timedelta(0),
+            create_raw_live(LIVE_CHANNEL, now),
+        ),
+    )
+    # the archive was made with no clean up of missing files
+    worker._state._db = db
+    # no status updates or background scans while measuring
+    worker._update_interval = float("inf")
+
+    env = BenchEnv(worker, iterations, warmup)
+    env.songs = songs
+    return env
+
+
+def compare_results(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    tolerance: float,
+    quantiles: Tuple[str, ...] = ("p50", "p99"),
+    min_regression: float = MIN_REGRESSION,
+) -> List[str]:
+    """Returns descriptions of every result slower than the baseline allows"""
+
+    regressions: List[str] = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+
+        # p99 is only the slowest couple of runs, so it is a lot noisier
+        for key in quantiles:
+            key_tolerance = tolerance * 2 if key == "p99" else tolerance
+            allowed = max(old[key] * (1 + key_tolerance), old[key] + min_regression)
+            if result[key] > allowed:
+                regressions.append(
+                    f"{name} {key}: {result[key] * 1000:.2f}ms, "
+                    f"was {old[key] * 1000:.2f}ms"
+                )
+    return regressions
+
+
+def _summary(results: List[BenchResult]) -> str:
+    from tabulate import tabulate
+
+    return tabulate(
+        [
+            (
+                r.name,
+                len(r.samples),
+                f"{r.p50 * 1000:.2f}",
+                f"{r.p99 * 1000:.2f}",
+                f"{r.throughput:.0f}",
+                f"{r.api_calls / len(r.samples):.1f}",
+            )
+            for r in results
+        ],
+        headers=[
+            "Benchmark",
+            "Runs",
+            "p50 (ms)",
+            "p99 (ms)",
+            "Per second",
+            "API calls",
+        ],
+    )
+
+
+@click.command()
+@click.option("--songs", type=int, default=10000, help="Songs in the archive")
+@click.option("--iterations", type=int, default=100, help="Runs of each benchmark")
+@click.option("--warmup", type=int, default=3, help="Runs before measuring")
+@click.option(
+    "--api-latency",
+    type=float,
+    default=0,
+    help="Simulated round trip of Discord API calls in ms",
+)
+@click.option(
+    "--folder",
+    type=click.Path(file_okay=False),
+    help="Processed folder to use, archives `--songs` into it if it has no database",
+)
+@click.option("--json", "json_path", type=click.Path(), help="Writes results to file")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results from `--json` to compare against",
+)
+@click.option(
+    "--tolerance",
+    type=float,
+    default=0.25,
+    help="How much slower than the baseline p50 is allowed, twice that for p99",
+)
+def main(
+    songs: int,
+    iterations: int,
+    warmup: int,
+    api_latency: float,
+    folder: Optional[str],
+    json_path: Optional[str],
+    baseline: Optional[str],
+    tolerance: float,
+):
+    logging.basicConfig(level=logging.WARNING)
+    set_api_latency(api_latency / 1000)
+
+    async def _run(folder: str) -> List[BenchResult]:
+        nonlocal songs
+        env = create_env(folder, songs, iterations, warmup)
+        songs = env.songs
+        await env.worker._scan_archive()
+        try:
+            return await run_benchmarks(env)
+        finally:
+            await env.stop_player()
+            # bot and audio player tasks
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    loop = asyncio.get_event_loop()
+    if folder is None:
+        with tempfile.TemporaryDirectory() as temp_folder:
+            results = loop.run_until_complete(_run(temp_folder))
+    else:
+        results = loop.run_until_complete(_run(folder))
+
+    click.echo(_summary(results))
+    results_data = {r.name: r.to_dict() for r in results}
+    data = {"songs": songs, "api_latency": api_latency, "results": results_data}
+    if json_path is not None:
+        with open(json_path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            baseline_data = json.load(f)
+        if baseline_data.get("songs") != songs:
+            click.echo("warning: baseline was ran with a different archive size")
+
+        regressions = compare_results(results_data, baseline_data["results"], tolerance)
+        if len(regressions) > 0:
+            click.echo("\nslower than baseline:\n" + "\n".join(regressions))
+            sys.exit(1)
+        click.echo("\nno regressions from baseline")
+
+
+if __name__ == "__main__":
+    main()
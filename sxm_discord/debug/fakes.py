@@ -0,0 +1,593 @@
+"""Stand-ins for the Discord and `sxm-player` objects the worker talks to.
+
+Only what `DiscordWorker` and `AudioPlayer` actually use is implemented.
+Nothing connects to Discord, SiriusXM or starts FFmpeg. REST calls are
+counted in `api_calls` and can be given a simulated round trip with
+`set_api_latency`.
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from discord import TextChannel
+from discord.player import AudioPlayer as VoicePlayer
+from discord_slash import SlashContext  # type: ignore
+from sxm_player.queue import EventMessage
+
+from sxm_discord.config import SXM_COG_NAME
+from sxm_discord.music import AudioPlayer
+
+__all__ = [
+    "FakeContext",
+    "FakeGuild",
+    "FakeMember",
+    "FakeMessage",
+    "FakeOpusAudio",
+    "FakeQueue",
+    "FakeReaction",
+    "FakeTextChannel",
+    "FakeVoiceChannel",
+    "FakeVoiceClient",
+    "FakeVoiceState",
+    "FakeAudioPlayer",
+    "api_calls",
+    "create_raw_channel",
+    "create_raw_live",
+    "create_worker",
+    "set_api_latency",
+]
+
+# a 20ms Opus frame of silence
+SILENCE = b"\xf8\xff\xfe"
+FRAME_LENGTH = VoicePlayer.DELAY
+
+_ids = itertools.count(1000)
+
+# calls made to the Discord REST API, by name
+api_calls: Counter = Counter()
+_api_latency: float = 0
+
+
+def _next_id() -> int:
+    return next(_ids)
+
+
+def set_api_latency(seconds: float) -> None:
+    """Sets how long each simulated REST call takes"""
+
+    global _api_latency
+    _api_latency = seconds
+
+
+async def _request(name: str) -> None:
+    api_calls[name] += 1
+    if _api_latency > 0:
+        await asyncio.sleep(_api_latency)
+
+
+class FakeQueue:
+    """`sxm_player.queue.Queue` that keeps everything put on it"""
+
+    items: List[EventMessage]
+
+    def __init__(self):
+        self.items = []
+
+    def safe_get(self, timeout: Optional[float] = None) -> Optional[EventMessage]:
+        if len(self.items) == 0:
+            return None
+        return self.items.pop(0)
+
+    def safe_put(self, item: EventMessage, timeout: Optional[float] = None) -> bool:
+        self.items.append(item)
+        return True
+
+    def qsize(self) -> int:
+        return len(self.items)
+
+
+class FakeVoiceState:
+    def __init__(self, channel: "FakeVoiceChannel"):
+        self.channel = channel
+        self.deaf = False
+        self.self_deaf = False
+
+
+class FakeMember:
+    voice: Optional[FakeVoiceState] = None
+
+    def __init__(
+        self,
+        name: str = "listener",
+        bot: bool = False,
+        guild: Optional["FakeGuild"] = None,
+    ):
+        self.id = _next_id()
+        self.name = name
+        self.bot = bot
+        self.guild = guild
+        self.mention = f"@{name}"
+        # direct messages sent to the member
+        self.messages: List[FakeMessage] = []
+
+    def __str__(self) -> str:
+        return self.name
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> "FakeMessage":
+        await _request("send_dm")
+        message = FakeMessage(None, content, **kwargs)
+        self.messages.append(message)
+        return message
+
+    def join(self, channel: Optional["FakeVoiceChannel"]) -> None:
+        """Moves the member to `channel`, leaves voice if `None`"""
+
+        if self.voice is not None:
+            self.voice.channel.members.remove(self)
+            self.voice = None
+        if channel is not None:
+            channel.members.append(self)
+            self.voice = FakeVoiceState(channel)
+
+
+class FakeGuild:
+    def __init__(self, name: str = "guild"):
+        self.id = _next_id()
+        self.name = name
+        self.members: List[FakeMember] = []
+        self.text_channels: List[FakeTextChannel] = []
+        self.voice_channels: List[FakeVoiceChannel] = []
+        self.me: Optional[FakeMember] = None
+
+    def add_member(self, name: str = "listener", bot: bool = False) -> FakeMember:
+        member = FakeMember(name, bot=bot, guild=self)
+        self.members.append(member)
+        return member
+
+    def create_text_channel(self, name: str = "general") -> "FakeTextChannel":
+        return FakeTextChannel(name, guild=self)
+
+    def create_voice_channel(self, name: str = "voice", **kwargs) -> "FakeVoiceChannel":
+        return FakeVoiceChannel(name, guild=self, **kwargs)
+
+
+class FakeReaction:
+    def __init__(self, message: "FakeMessage", emoji: str, count: int = 1):
+        self.message = message
+        self.emoji = emoji
+        self.count = count
+
+    async def clear(self) -> None:
+        await _request("clear_reaction")
+        if self in self.message.reactions:
+            self.message.reactions.remove(self)
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        channel: Optional["FakeTextChannel"],
+        content: Optional[str] = None,
+        embed=None,
+        file=None,
+        **kwargs,
+    ):
+        self.id = _next_id()
+        self.channel = channel
+        self.guild = None if channel is None else channel.guild
+        self.content = content
+        self.embed = embed
+        self.file = file
+        self.edits = 0
+        self.reactions: List[FakeReaction] = []
+
+    async def edit(self, content: Optional[str] = None, embed=None) -> None:
+        await _request("edit_message")
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+        self.edits += 1
+
+    async def add_reaction(self, emoji: str) -> None:
+        await _request("add_reaction")
+        if self.get_reaction(emoji) is None:
+            self.reactions.append(FakeReaction(self, emoji))
+
+    def get_reaction(self, emoji: str) -> Optional[FakeReaction]:
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                return reaction
+        return None
+
+
+class FakeTextChannel(TextChannel):
+    """Passes the `isinstance(ctx.channel, TextChannel)` of `no_pm`"""
+
+    def __init__(self, name: str = "general", guild: Optional[FakeGuild] = None):
+        self.id = _next_id()
+        self.name = name
+        self.guild = guild or FakeGuild()
+        self.guild.text_channels.append(self)
+        self.messages: List[FakeMessage] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        await _request("send_message")
+        message = FakeMessage(self, content, **kwargs)
+        self.messages.append(message)
+        return message
+
+
+class FakeContext(SlashContext):
+    """`SlashContext` for `author` running a command in `channel`"""
+
+    def __init__(
+        self,
+        bot,
+        author: FakeMember,
+        channel: FakeTextChannel,
+        name: str = "music",
+    ):
+        self.bot = bot
+        self.author = author
+        self.author_id = author.id
+        self._channel = channel
+        self.channel_id = channel.id
+        self.guild_id = channel.guild.id
+        self.name = self.command = self.invoked_with = name
+        self.args: List[Any] = []
+        self.kwargs: Dict[str, Any] = {}
+        self.message: Optional[FakeMessage] = None
+        self.deferred = False
+        self.responded = False
+        self._deferred_hidden = False
+        # everything sent for the interaction, in order
+        self.messages: List[FakeMessage] = []
+
+    @property
+    def guild(self) -> FakeGuild:
+        return self._channel.guild
+
+    @property
+    def channel(self) -> FakeTextChannel:
+        return self._channel
+
+    async def defer(self, hidden: bool = False) -> None:
+        await _request("defer")
+        self.deferred = True
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        if self.deferred and not self.responded:
+            await _request("edit_response")
+        else:
+            await _request("respond" if not self.responded else "followup")
+
+        message = FakeMessage(self._channel, content, **kwargs)
+        self._channel.messages.append(message)
+        self.messages.append(message)
+        if self.message is None:
+            self.message = message
+        self.deferred = False
+        self.responded = True
+        return message
+
+
+class FakeOpusAudio:
+    """Replaces `FFmpegOpusAudio`, takes the same arguments.
+
+    Reads `length` frames of silence, endless like a live stream if `None`.
+    """
+
+    length: Optional[int] = None
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.packets = 0
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        if self.length is not None and self.packets >= self.length:
+            return b""
+        self.packets += 1
+        return SILENCE
+
+    def cleanup(self) -> None:
+        pass
+
+
+class _FakeVoicePlayer(VoicePlayer):
+    """`discord.player.AudioPlayer` reading frames every `delay` seconds"""
+
+    def __init__(self, source, client: "FakeVoiceClient", after, delay: float):
+        super().__init__(source, client, after=after)
+        self.DELAY = delay
+
+    def _speak(self, speaking: bool) -> None:
+        pass
+
+
+class FakeVoiceClient:
+    """Reads frames from the playing source like `discord.VoiceClient`.
+
+    Frames are read in a thread `speed` times faster than real time. At a
+    speed of 0 nothing is read and `stop` ends the current source right away.
+    """
+
+    speed: float
+    # frames "sent" to Discord and when the last one was
+    frames: int = 0
+    last_frame: float = 0
+    # sources played, the frames after a change are from a new source
+    plays: int = 0
+    # called with `time.perf_counter()` of every frame, from the voice thread
+    on_frame: Optional[Callable[[float], Any]] = None
+
+    _source: Any = None
+    _after: Optional[Callable[[Optional[Exception]], Any]] = None
+    _player: Optional[_FakeVoicePlayer] = None
+
+    def __init__(self, channel: "FakeVoiceChannel", speed: float = 0):
+        self.channel = channel
+        self.guild = channel.guild
+        self.speed = speed
+        self.loop = asyncio.get_event_loop()
+        self._connected = threading.Event()
+        self._connected.set()
+
+    @property
+    def source(self) -> Any:
+        if self._player is not None:
+            return self._player.source
+        return self._source
+
+    def is_connected(self) -> bool:
+        return self._connected.is_set()
+
+    def is_playing(self) -> bool:
+        if self._player is not None:
+            return self._player.is_playing()
+        return self._source is not None
+
+    def play(self, source, after=None) -> None:
+        self.plays += 1
+        if self.speed > 0:
+            self._player = _FakeVoicePlayer(
+                source, self, after, delay=FRAME_LENGTH / self.speed
+            )
+            self._player.start()
+            return
+
+        self._source = source
+        self._after = after
+
+    def send_audio_packet(self, data: bytes, encode: bool = True) -> None:
+        self.frames += 1
+        self.last_frame = time.perf_counter()
+        if self.on_frame is not None:
+            self.on_frame(self.last_frame)
+
+    def stop(self) -> None:
+        if self._player is not None:
+            self._player.stop()
+            self._player = None
+            return
+
+        if self._source is None:
+            return
+
+        self._source = None
+        after, self._after = self._after, None
+        if after is not None:
+            after(None)
+
+    async def move_to(self, channel: "FakeVoiceChannel") -> None:
+        self.channel = channel
+        self.guild = channel.guild
+
+    async def disconnect(self) -> None:
+        self.stop()
+        self._connected.clear()
+
+
+class FakeVoiceChannel:
+    def __init__(
+        self,
+        name: str = "voice",
+        guild: Optional[FakeGuild] = None,
+        bitrate: int = 64000,
+        listeners: int = 1,
+        speed: float = 0,
+    ):
+        self.id = _next_id()
+        self.name = name
+        self.mention = f"#{name}"
+        self.guild = guild or FakeGuild()
+        self.guild.voice_channels.append(self)
+        self.bitrate = bitrate
+        self.speed = speed
+        self.members: List[FakeMember] = []
+        for i in range(listeners):
+            self.guild.add_member(f"listener-{i}").join(self)
+
+    async def connect(self) -> FakeVoiceClient:
+        await _request("voice_connect")
+        return FakeVoiceClient(self, speed=self.speed)
+
+
+class FakeAudioPlayer(AudioPlayer):
+    opus_source = FakeOpusAudio
+    recording_source = FakeOpusAudio
+
+
+def create_raw_channel(number: int, channel_id: str, name: str) -> dict:
+    """Channel as it comes from the SXM API, for `UPDATE_CHANNELS`"""
+
+    return {
+        "channelGuid": f"channel-{number}",
+        "channelId": channel_id,
+        "name": name,
+        "streamingName": name,
+        "sortOrder": number,
+        "shortDescription": f"{name} on SiriusXM",
+        "mediumDescription": f"{name} on SiriusXM",
+        "url": "",
+        "isAvailable": True,
+        "isFavorite": False,
+        "isMature": False,
+        "siriusChannelNumber": str(number),
+        "images": {"images": []},
+        "categories": {"categories": []},
+    }
+
+
+def _art(guid: str) -> List[dict]:
+    return [
+        {
+            "type": "IMAGE",
+            "name": "image",
+            "url": f"https://example.com/art/{guid}/{size}.jpg",
+            "size": size,
+            "height": height,
+            "width": height,
+        }
+        for size, height in (("THUMBNAIL", 150), ("MEDIUM", 300), ("LARGE", 600))
+    ]
+
+
+def create_raw_live(
+    channel_id: str,
+    now: Optional[datetime] = None,
+    hours: float = 5,
+    song_length: int = 210,
+    show_length: float = 3,
+) -> dict:
+    """Live channel data from the SXM API for the last `hours` of radio.
+
+    Every 4th cut is a non song (spot, DJ break) like on the real channels.
+    """
+
+    if now is None:
+        now = datetime.now(timezone.utc)
+    start = now - timedelta(hours=hours)
+
+    cuts: List[dict] = []
+    time_ = start
+    index = 0
+    while time_ < now:
+        guid = f"{channel_id}-cut-{index}"
+        if index % 4 == 3:
+            length = 30
+            cut: dict = {"title": "Spot", "artists": [], "cutContentType": "Spot"}
+        else:
+            length = song_length
+            cut = {
+                "title": f"Song {index}",
+                "artists": [{"name": f"Artist {index % 37}"}],
+                "cutContentType": "Song",
+                "album": {"title": f"Album {index % 53}", "creativeArts": _art(guid)},
+            }
+        cuts.append(
+            {
+                "assetGUID": guid,
+                "time": int(time_.timestamp() * 1000),
+                "duration": length,
+                "cut": cut,
+            }
+        )
+        time_ += timedelta(seconds=length)
+        index += 1
+
+    episodes: List[dict] = []
+    time_ = start
+    index = 0
+    while time_ < now:
+        show_guid = f"{channel_id}-show-{index % 3}"
+        episodes.append(
+            {
+                "assetGUID": f"{channel_id}-episode-{index}",
+                "time": int(time_.timestamp() * 1000),
+                "duration": show_length * 3600,
+                "episode": {
+                    "episodeGUID": f"{channel_id}-episode-{index}",
+                    "mediumTitle": f"Episode {index}",
+                    "longTitle": f"Episode {index}",
+                    "shortDescription": "",
+                    "longDescription": "",
+                    "show": {
+                        "showGUID": show_guid,
+                        "mediumTitle": f"Show {index % 3}",
+                        "longTitle": f"Show {index % 3}",
+                        "shortDescription": "",
+                        "longDescription": "",
+                        "creativeArts": _art(show_guid),
+                    },
+                },
+            }
+        )
+        time_ += timedelta(hours=show_length)
+        index += 1
+
+    return {
+        "wallClockRenderTime": now.strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+        "moduleResponse": {
+            "liveChannelData": {
+                "channelId": channel_id,
+                "hlsAudioInfos": [],
+                "customAudioInfos": [],
+                "markerLists": [
+                    {"layer": "episode", "markers": episodes},
+                    {"layer": "cut", "markers": cuts},
+                ],
+            }
+        },
+    }
+
+
+def create_worker(worker_class=None, **kwargs):
+    """Creates a worker with fake queues that never logs into Discord.
+
+    Has to be called with a running event loop, the bot uses it.
+    """
+
+    if worker_class is None:
+        from sxm_discord.bot import DiscordWorker
+
+        worker_class = DiscordWorker
+
+    class _FakeWorker(worker_class, name=SXM_COG_NAME):  # type: ignore
+        def _create_player(self) -> AudioPlayer:
+            return FakeAudioPlayer(
+                self.event_queue,
+                self.bot.loop,
+                on_state_change=self._check_voice_idle,
+                rewind=self.rewind,
+                loudness=self.loudness,
+                prefetcher=self.prefetcher,
+            )
+
+    params = {
+        "token": "",
+        "description": "",
+        "output_channel_id": None,
+        "processed_folder": None,
+        "sxm_status": False,
+        "startup_event": threading.Event(),
+        "shutdown_event": threading.Event(),
+        "local_shutdown_event": threading.Event(),
+        "event_queue": FakeQueue(),
+        "sxm_status_queue": FakeQueue(),
+        "hls_stream_queue": FakeQueue(),
+    }
+    params.update(kwargs)
+    worker = _FakeWorker(**params)
+    # `bot.user` is only set after logging in
+    worker.bot._connection.user = FakeMember("sxm", bot=True)
+    return worker
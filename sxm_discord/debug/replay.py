@@ -0,0 +1,173 @@
+"""Plays a recording from `--record-events` back into a `DiscordWorker`.
+
+Events are fed in with the same spacing they were recorded with, sped up by
+`speed` (0 feeds them as fast as possible). The worker runs against the
+stand-ins from `sxm_discord.debug.fakes`, so metadata storms, reconnect loops
+and `_reset_live` cascades can be reproduced and timed offline.
+
+.. code-block:: console
+
+    $ python -m sxm_discord.debug.replay events.jsonl.gz --speed 100 --channel octane
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import click
+
+from sxm_discord.debug.fakes import FakeVoiceChannel, create_worker
+from sxm_discord.execution import LatencyHistogram
+from sxm_discord.metrics import FAST_BUCKETS
+from sxm_discord.recorder import RecordedEvent, load_recording
+
+__all__ = ["ReplayStats", "replay_events"]
+
+# `_reset_live` waits this long for the new stream at 1x
+LIVE_RESUME_DELAY = 10.0
+
+
+class ReplayStats:
+    events: int = 0
+    duration: float = 0
+    # furthest the replay fell behind the recording (scaled by speed)
+    max_behind: float = 0
+    triggers: int = 0
+    handle_time: Dict[str, LatencyHistogram]
+    player_commands: Dict[str, int]
+
+    def __init__(self):
+        self.handle_time = {}
+        self.player_commands = {}
+
+    @property
+    def rate(self) -> float:
+        if self.duration == 0:
+            return 0
+        return self.events / self.duration
+
+    def observe(self, msg_type: str, seconds: float) -> None:
+        histogram = self.handle_time.get(msg_type)
+        if histogram is None:
+            histogram = self.handle_time[msg_type] = LatencyHistogram(FAST_BUCKETS)
+        histogram.observe(seconds)
+
+    def summary(self) -> str:
+        from tabulate import tabulate
+
+        rows = [
+            (
+                msg_type,
+                h.count,
+                f"{h.total / h.count * 1000:.2f}",
+                h.quantile(0.99),
+                f"{h.total * 1000:.0f}",
+            )
+            for msg_type, h in sorted(self.handle_time.items())
+        ]
+        commands = ", ".join(
+            f"{k}={v}" for k, v in sorted(self.player_commands.items())
+        )
+        return "\n".join(
+            [
+                f"{self.events} events in {self.duration:.2f}s "
+                f"({self.rate:.0f}/s), at most {self.max_behind * 1000:.0f}ms "
+                "behind the recording",
+                f"HLS streams triggered: {self.triggers}",
+                f"player commands: {commands or 'none'}",
+                "",
+                tabulate(
+                    rows,
+                    headers=["Event", "Count", "Mean (ms)", "p99 (s)", "Total (ms)"],
+                ),
+            ]
+        )
+
+
+async def _start_channel(worker, channel: str) -> bool:
+    """Plays `channel` like `/music sxm channel` once channels are known"""
+
+    xm_channel = worker._state.find_channel(channel)
+    if xm_channel is None:
+        return False
+
+    voice_channel = FakeVoiceChannel()
+    await worker.player.set_voice(voice_channel)
+    await worker.player.add_live_stream(xm_channel)
+    worker._pending = (xm_channel, voice_channel)
+    return True
+
+
+async def replay_events(
+    events: List[RecordedEvent],
+    speed: float = 1.0,
+    channel: Optional[str] = None,
+    worker=None,
+) -> ReplayStats:
+    """Feeds recorded events into `worker` (a fake one if not given)"""
+
+    if worker is None:
+        worker = create_worker()
+    worker._live_resume_delay = LIVE_RESUME_DELAY / speed if speed > 0 else 0
+
+    stats = ReplayStats()
+    started = channel is None
+    start = time.perf_counter()
+    for recorded in events:
+        if speed > 0:
+            due = start + recorded.offset / speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                stats.max_behind = max(stats.max_behind, -wait)
+
+        handle_start = time.perf_counter()
+        await worker._process_events([(recorded.queue, recorded.event)])
+        stats.observe(recorded.event.msg_type.name, time.perf_counter() - handle_start)
+        stats.events += 1
+
+        if not started:
+            started = await _start_channel(worker, channel)  # type: ignore
+
+    stats.duration = time.perf_counter() - start
+    stats.triggers = sum(
+        1 for e in worker.event_queue.items if e.msg_type.name == "TRIGGER_HLS_STREAM"
+    )
+    stats.player_commands = dict(worker.player_commands.executed)
+    return stats
+
+
+@click.command()
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--speed",
+    type=float,
+    default=1.0,
+    help="How much faster than recorded to replay, 0 for as fast as possible",
+)
+@click.option("--channel", type=str, help="SXM channel to be playing")
+@click.option("--verbose", "-v", is_flag=True, help="Show the worker's logs")
+def main(recording: str, speed: float, channel: Optional[str], verbose: bool):
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.WARNING)
+
+    events = load_recording(recording)
+    pace = f"{speed}x" if speed > 0 else "full speed"
+    click.echo(f"replaying {len(events)} events at {pace}")
+
+    async def _run() -> ReplayStats:
+        stats = await replay_events(events, speed, channel)
+
+        # bot and audio player tasks
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return stats
+
+    click.echo(asyncio.get_event_loop().run_until_complete(_run()).summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Execution layer for slash commands.
+
+Discord invalidates an interaction if it is not responded to in about 3
+seconds. `deferrable` runs a command as a task and defers the interaction
+("Bot is thinking...") if the command is expected to be slow or has not
+finished in time. The command then finishes in the background and its first
+`send_message` edits the deferred response.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from discord_slash import SlashContext  # type: ignore
+
+from sxm_discord.tracing import tracer
+
+__all__ = ["LatencyHistogram", "command_latency", "deferrable", "get_response_lock"]
+
+DEFER_AFTER = 2.0
+SLOW_COMMAND = 1.5
+SLOW_QUANTILE = 0.9
+MIN_SAMPLES = 5
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    1.5,
+    2.0,
+    3.0,
+    5.0,
+    10.0,
+    30.0,
+)
+
+_log = logging.getLogger("sxm_discord.execution")
+
+
+class LatencyHistogram:
+    """Histogram of command latencies in seconds.
+
+    Each bucket counts only the latencies up to its bound that are over the
+    bound of the bucket before it, they are not cumulative.
+    """
+
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    count: int = 0
+    total: float = 0
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # last count is for everything over the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        """Returns upper bound of the bucket containing `quantile`"""
+
+        if self.count == 0:
+            return None
+
+        target = quantile * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                break
+        return float("inf")
+
+    @property
+    def is_slow(self) -> bool:
+        """If the command has been observed to be slow"""
+
+        if self.count < MIN_SAMPLES:
+            return False
+
+        latency = self.quantile(SLOW_QUANTILE)
+        return latency is not None and latency > SLOW_COMMAND
+
+
+command_latency: Dict[str, LatencyHistogram] = {}
+
+
+def get_response_lock(ctx: SlashContext) -> asyncio.Lock:
+    """Lock that must be held while sending the initial response"""
+
+    lock: Optional[asyncio.Lock] = getattr(ctx, "_sxm_response_lock", None)
+    if lock is None:
+        lock = asyncio.Lock()
+        ctx._sxm_response_lock = lock
+    return lock
+
+
+async def defer(ctx: SlashContext) -> bool:
+    """Defers interaction if nothing has been sent for it yet"""
+
+    async with get_response_lock(ctx):
+        if ctx.deferred or ctx.responded:
+            return False
+
+        try:
+            await ctx.defer()
+        except Exception:
+            _log.exception("could not defer interaction")
+            return False
+        return True
+
+
+CommandFunc = Callable[..., Coroutine[Any, Any, None]]
+
+
+def deferrable(slow: bool = False) -> Callable[[CommandFunc], CommandFunc]:
+    """Decorator for cog slash commands that defers slow commands.
+
+    `slow` marks a command that should always be deferred right away.
+    Otherwise it is deferred if it has been slow before or it is still running
+    after `DEFER_AFTER` seconds.
+    """
+
+    def decorator(func: CommandFunc) -> CommandFunc:
+        name = func.__name__
+        stats = command_latency.setdefault(name, LatencyHistogram())
+
+        @wraps(func)
+        async def wrapper(self, ctx: SlashContext, *args, **kwargs) -> None:
+            start = time.monotonic()
+            with tracer.span(f"command.{name}", guild_id=ctx.guild_id) as span:
+                # the command task inherits the span as its parent
+                task = asyncio.ensure_future(func(self, ctx, *args, **kwargs))
+
+                try:
+                    if slow or stats.is_slow:
+                        if await defer(ctx):
+                            span.set("deferred", True)
+                            _log.debug(f"deferred {name}, expected to be slow")
+                    else:
+                        done, _ = await asyncio.wait({task}, timeout=DEFER_AFTER)
+                        if len(done) == 0 and await defer(ctx):
+                            span.set("deferred", True)
+                            _log.info(
+                                f"deferred {name}, still running after {DEFER_AFTER}s"
+                            )
+
+                    await task
+                finally:
+                    stats.observe(time.monotonic() - start)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, Dict, Tuple
+
+from discord import VoiceChannel
+
+__all__ = ["IDLE_TIMEOUT", "EMPTY_TIMEOUT", "VoiceIdleMonitor", "has_listeners"]
+
+# seconds in voice with nothing playing before leaving
+IDLE_TIMEOUT = 30
+# seconds in voice with no one else in the channel before leaving
+EMPTY_TIMEOUT = 60
+
+IdleCallback = Callable[[int, str], Coroutine[Any, Any, None]]
+
+
+def has_listeners(channel: VoiceChannel) -> bool:
+    """If anyone other than bots is in the voice channel"""
+
+    return any(not member.bot for member in channel.members)
+
+
+class VoiceIdleMonitor:
+    """Per guild timers for leaving voice channels.
+
+    Timers are armed and cancelled from voice state and player events, when
+    one runs out `on_idle` is called with the guild ID and the reason the
+    timer was armed for.
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    _on_idle: IdleCallback
+    _timers: Dict[int, Tuple[str, asyncio.TimerHandle]]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_idle: IdleCallback):
+        self._loop = loop
+        self._on_idle = on_idle
+        self._timers = {}
+        self._log = logging.getLogger("sxm_discord.idle")
+
+    def arm(self, guild_id: int, reason: str, timeout: float) -> None:
+        """Starts timer for guild unless one for the same reason is running"""
+
+        armed = self._timers.get(guild_id)
+        if armed is not None:
+            if armed[0] == reason:
+                return
+            armed[1].cancel()
+
+        self._log.debug(f"{guild_id}: leaving voice in {timeout}s, {reason}")
+        self._timers[guild_id] = (
+            reason,
+            self._loop.call_later(timeout, self._expire, guild_id, reason),
+        )
+
+    def cancel(self, guild_id: int) -> None:
+        armed = self._timers.pop(guild_id, None)
+        if armed is not None:
+            self._log.debug(f"{guild_id}: cancelled {armed[0]} timer")
+            armed[1].cancel()
+
+    def cancel_all(self) -> None:
+        for guild_id in list(self._timers.keys()):
+            self.cancel(guild_id)
+
+    def is_armed(self, guild_id: int) -> bool:
+        return guild_id in self._timers
+
+    def _expire(self, guild_id: int, reason: str) -> None:
+        del self._timers[guild_id]
+        self._loop.create_task(self._on_idle(guild_id, reason))
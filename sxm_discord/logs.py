@@ -0,0 +1,315 @@
+"""Structured logging for the hot paths and a ring buffer of recent records.
+
+Subsystems log through `get_logger("<subsystem>")`, which writes to the
+`sxm_discord.<subsystem>` logger. Messages are an event name and fields,
+only turned into text when a record is actually written out, so a debug
+line on every event or status update costs a `LogRecord` and nothing else.
+
+Once `configure_logging` ran, every record of `sxm_discord` is kept in a
+`RingBuffer`, debug ones included, no matter what is logged. Records are
+written out by the level of their subsystem (the root logger's level by
+default). When an error is logged, the recent records that were not
+written out are, so the debug detail leading up to it ends up in the logs.
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, TypeVar
+
+__all__ = [
+    "RingBuffer",
+    "StructuredLogger",
+    "configure_logging",
+    "get_logger",
+    "parse_level",
+    "parse_subsystems",
+]
+
+ROOT_LOGGER = "sxm_discord"
+DEFAULT_CAPACITY = 2000
+# errors in a row only dump the buffer once per this many seconds
+DUMP_INTERVAL = 60.0
+FORMAT = "%(asctime)s %(name)s %(levelname)s %(message)s"
+
+T = TypeVar("T")
+
+_loggers: Dict[str, "StructuredLogger"] = {}
+
+
+class LogMessage:
+    """Event and fields of a record, formatted as `event key=value ...`.
+
+    Fields are only formatted when the record is written out, which can be
+    much later for records in the ring buffer.
+    """
+
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event: str, fields: Dict[str, object]):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if len(self.fields) == 0:
+            return self.event
+        values = " ".join(f"{key}={value}" for key, value in self.fields.items())
+        return f"{self.event} {values}"
+
+
+class StructuredLogger:
+    """Logs `LogMessage`s for a subsystem.
+
+    Can be used in place of a `logging.Logger` for plain messages.
+    """
+
+    subsystem: str
+    logger: logging.Logger
+
+    def __init__(self, subsystem: str):
+        self.subsystem = subsystem
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{subsystem}")
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def _log(self, level: int, event: str, fields: Dict[str, object], **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        self.logger.log(level, LogMessage(event, fields), **kwargs)
+
+    def debug(self, event: str, **fields) -> None:
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event: str, **fields) -> None:
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+def get_logger(subsystem: str) -> StructuredLogger:
+    logger = _loggers.get(subsystem)
+    if logger is None:
+        logger = _loggers[subsystem] = StructuredLogger(subsystem)
+    return logger
+
+
+def _subsystem(record: logging.LogRecord) -> str:
+    return record.name[len(ROOT_LOGGER) + 1 :]
+
+
+def _is_written(record: logging.LogRecord) -> bool:
+    return getattr(record, "written", False)
+
+
+def _mark_written(record: logging.LogRecord) -> None:
+    record.written = True  # type: ignore
+
+
+class RingBuffer(logging.Handler):
+    """Keeps the last `capacity` records, unformatted.
+
+    On a error, the records no handler wrote out yet are passed to
+    `on_error`, after that they count as written out. They stay in the buffer.
+    """
+
+    capacity: int
+    on_error: Optional[Callable[[List[logging.LogRecord]], None]]
+
+    _records: Deque[logging.LogRecord]
+    _last_dump: float = 0
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        on_error: Optional[Callable[[List[logging.LogRecord]], None]] = None,
+    ):
+        super().__init__(logging.DEBUG)
+        self.capacity = capacity
+        self.on_error = on_error
+        self._records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter(FORMAT))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.levelno < logging.ERROR or self.on_error is None:
+            self._records.append(record)
+            return
+
+        now = time.monotonic()
+        if now - self._last_dump < DUMP_INTERVAL:
+            self._records.append(record)
+            return
+
+        self._last_dump = now
+        records = [r for r in self.get_records() if not _is_written(r)]
+        self._records.append(record)
+        try:
+            self.on_error(records)
+        except Exception:
+            self.handleError(record)
+
+        # so the next error does not write them again
+        for unwritten in records:
+            _mark_written(unwritten)
+
+    def get_records(self) -> List[logging.LogRecord]:
+        # `deque` can be appended to from other threads while copying
+        self.acquire()
+        try:
+            return list(self._records)
+        finally:
+            self.release()
+
+    def render(self, records: Optional[Iterable[logging.LogRecord]] = None) -> str:
+        """Formats `records` (all of them by default), oldest first"""
+
+        if records is None:
+            records = self.get_records()
+        return "".join(f"{self.format(r)}\n" for r in records)
+
+
+class _SubsystemHandler(logging.Handler):
+    """Passes records to the root logger's handlers by the level of their
+    subsystem, instead of the handlers' own levels.
+
+    Only 1 in every N debug records of a subsystem in `sample_rates` is
+    passed on, the ring buffer still gets all of them.
+    """
+
+    def __init__(
+        self,
+        levels: Dict[str, int],
+        default: int,
+        skip: Optional[logging.Handler],
+        sample_rates: Dict[str, int],
+    ):
+        super().__init__(logging.DEBUG)
+        self.levels = levels
+        self.default = default
+        self.skip = skip
+        self.sample_rates = sample_rates
+        self._counts: Dict[str, int] = {}
+
+    def _is_sampled(self, subsystem: str) -> bool:
+        rate = self.sample_rates.get(subsystem, 1)
+        if rate <= 1:
+            return True
+
+        count = self._counts[subsystem] = self._counts.get(subsystem, 0) + 1
+        return count % rate == 0
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        subsystem = _subsystem(record)
+        if record.levelno < self.levels.get(subsystem, self.default):
+            return False
+        if record.levelno == logging.DEBUG and not self._is_sampled(subsystem):
+            return False
+
+        # marks the record as written out for `RingBuffer`
+        _mark_written(record)
+        for handler in logging.getLogger().handlers:
+            if handler is not self.skip:
+                handler.handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        pass
+
+
+def _write_unwritten(buffer: RingBuffer, records: List[logging.LogRecord]) -> None:
+    """Writes the records before a error that were not written out"""
+
+    for handler in logging.getLogger().handlers:
+        if handler is buffer:
+            continue
+
+        # records of other loggers went to the handlers directly
+        unwritten = [
+            r
+            for r in records
+            if not _is_written(r)
+            and (r.name.startswith(f"{ROOT_LOGGER}.") or r.levelno < handler.level)
+        ]
+        if len(unwritten) == 0:
+            continue
+
+        handler.handle(
+            logging.makeLogRecord(
+                {
+                    "name": ROOT_LOGGER,
+                    "levelno": logging.INFO,
+                    "levelname": "INFO",
+                    "msg": f"{len(unwritten)} recent records before this error:",
+                }
+            )
+        )
+        for record in unwritten:
+            handler.handle(record)
+
+
+def configure_logging(
+    capacity: int = DEFAULT_CAPACITY,
+    levels: Optional[Dict[str, int]] = None,
+    sample_rates: Optional[Dict[str, int]] = None,
+) -> Optional[RingBuffer]:
+    """Routes `sxm_discord` records through the subsystem levels and keeps
+    them in a ring buffer of `capacity` records, if it is not 0"""
+
+    root = logging.getLogger()
+    logger = logging.getLogger(ROOT_LOGGER)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in list(root.handlers):
+        if isinstance(handler, RingBuffer):
+            root.removeHandler(handler)
+
+    buffer: Optional[RingBuffer] = None
+    if capacity > 0:
+        buffer = RingBuffer(capacity)
+        buffer.on_error = lambda records: _write_unwritten(buffer, records)
+        # records of other loggers, like the `sxm_player.discord` one of the
+        # worker, only if they are created at their level
+        root.addHandler(buffer)
+        logger.addHandler(buffer)
+
+    default = root.getEffectiveLevel()
+    levels = levels or {}
+    # with a buffer every record is created, otherwise only the ones that
+    # could be written out
+    lowest = min([default, *levels.values()])
+    logger.setLevel(logging.DEBUG if buffer is not None else lowest)
+    logger.propagate = False
+    logger.addHandler(_SubsystemHandler(levels, default, buffer, sample_rates or {}))
+    return buffer
+
+
+def parse_subsystems(value: Optional[str], convert: Callable[[str], T]) -> Dict[str, T]:
+    """Parses `subsystem=value,...` of a command line option"""
+
+    parsed: Dict[str, T] = {}
+    if not value:
+        return parsed
+
+    for item in value.split(","):
+        subsystem, _, raw = item.partition("=")
+        if not subsystem.strip() or not raw.strip():
+            raise ValueError(f"expected subsystem=value, got {item!r}")
+        parsed[subsystem.strip()] = convert(raw.strip())
+    return parsed
+
+
+def parse_level(value: str) -> int:
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"unknown log level {value!r}")
+    return level
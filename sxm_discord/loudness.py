@@ -0,0 +1,215 @@
+"""Offline loudness analysis of archived songs and shows.
+
+Integrated loudness (EBU R128) of each archive file is measured once with
+FFmpeg's `ebur128` filter in a process pool and saved to `loudness.json` in
+the processed folder. Playback then only needs a static `volume` filter
+instead of running `loudnorm` on every stream.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import literal_column
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.session import Session
+from sxm_player.models import DBEpisode, DBSong
+
+from sxm_discord.tracing import run_in_executor
+
+__all__ = ["LoudnessIndex", "measure_loudness"]
+
+LOUDNESS_FILE = "loudness.json"
+# LUFS every file is normalized to
+TARGET_LOUDNESS = -16.0
+MAX_BOOST = 6.0
+MAX_CUT = -20.0
+# gains smaller than this are not worth the filter
+MIN_GAIN = 0.5
+ANALYSIS_WORKERS = 2
+ANALYSIS_BATCH = 50
+ANALYSIS_TIMEOUT = 300
+# rows read at once while looking for files to analyze
+PENDING_PAGE_SIZE = 1000
+
+INTEGRATED_REGEX = re.compile(r"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+
+def measure_loudness(path: str) -> Optional[float]:
+    """Returns integrated loudness of file in LUFS.
+
+    Raises `OSError` if FFmpeg cannot be ran, so files are not marked as
+    failed because of it.
+    """
+
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg",
+                "-nostats",
+                "-hide_banner",
+                "-i",
+                path,
+                "-map",
+                "0:a:0",
+                "-af",
+                "ebur128",
+                "-f",
+                "null",
+                "-",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=ANALYSIS_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return None
+
+    # the summary at the end is the last match
+    matches = INTEGRATED_REGEX.findall(result.stderr)
+    if result.returncode != 0 or len(matches) == 0:
+        return None
+    return float(matches[-1])
+
+
+def _analyze(path: str) -> Tuple[str, Optional[float]]:
+    return path, measure_loudness(path)
+
+
+class LoudnessIndex:
+    """Loudness of archive files, keyed by file path.
+
+    Files that could not be analyzed are kept as `None` so they are not
+    retried on every pass.
+    """
+
+    path: str
+
+    _loudness: Dict[str, Optional[float]]
+    # last rowid read of each table by `get_pending`
+    _cursors: Dict[str, int]
+    _pool: Optional[ProcessPoolExecutor] = None
+    _running: bool = False
+
+    def __init__(self, processed_folder: str):
+        self.path = os.path.join(processed_folder, LOUDNESS_FILE)
+        self._loudness = {}
+        self._cursors = {}
+        self._log = logging.getLogger("sxm_discord.loudness")
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._loudness)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                self._loudness = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            self._log.warning(f"could not read {self.path}, starting over")
+
+    def _save(self, loudness: Dict[str, Optional[float]]) -> None:
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(loudness, f)
+        os.replace(temp_path, self.path)
+
+    def get_gain(self, file_path: str) -> Optional[float]:
+        """Returns gain in dB to normalize file or `None` if not needed"""
+
+        loudness = self._loudness.get(file_path)
+        if loudness is None:
+            return None
+
+        gain = min(MAX_BOOST, max(MAX_CUT, TARGET_LOUDNESS - loudness))
+        if abs(gain) < MIN_GAIN:
+            return None
+        return round(gain, 1)
+
+    def get_pending(
+        self, bind: Engine, batch: int = ANALYSIS_BATCH
+    ) -> Tuple[List[str], Dict[str, int]]:
+        """Returns up to `batch` archive files that have not been analyzed yet
+        and the last row read of each table.
+
+        Continues from the rows in `_cursors`, once at the end only rows added
+        since are read. Blocking, run it in a executor.
+        """
+
+        pending: List[str] = []
+        cursors = dict(self._cursors)
+        # the session of the bot can not be used from another thread
+        db = Session(bind=bind)
+        try:
+            for model in (DBSong, DBEpisode):
+                table = model.__tablename__
+                while len(pending) < batch:
+                    rowid = literal_column(f"{table}.rowid")
+                    rows = (
+                        db.query(rowid, model.file_path)
+                        .filter(rowid > cursors.get(table, 0))
+                        .order_by(rowid)
+                        .limit(PENDING_PAGE_SIZE)
+                        .all()
+                    )
+                    if len(rows) == 0:
+                        break
+
+                    for row_id, file_path in rows:
+                        cursors[table] = row_id
+                        if file_path is not None and file_path not in self._loudness:
+                            pending.append(file_path)
+                            if len(pending) >= batch:
+                                break
+        finally:
+            db.close()
+        return pending, cursors
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    async def analyze(self, db: Session, batch: int = ANALYSIS_BATCH) -> int:
+        """Analyzes up to `batch` new archive files, returns number analyzed"""
+
+        if self._running:
+            return 0
+
+        self._running = True
+        loop = asyncio.get_event_loop()
+        try:
+            pending, cursors = await run_in_executor(
+                self.get_pending, db.get_bind(), batch
+            )
+            if len(pending) == 0:
+                self._cursors = cursors
+                return 0
+
+            pool = self._get_pool()
+            results = await asyncio.gather(
+                *[loop.run_in_executor(pool, _analyze, p) for p in pending]
+            )
+
+            for file_path, loudness in results:
+                self._loudness[file_path] = loudness
+            # only moved on once analyzed, so files are retried if FFmpeg failed
+            self._cursors = cursors
+            await loop.run_in_executor(None, self._save, dict(self._loudness))
+        finally:
+            self._running = False
+
+        self._log.info(f"analyzed loudness of {len(results)} files")
+        return len(results)
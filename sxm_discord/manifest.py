@@ -0,0 +1,193 @@
+"""Manifest of the files in the processed (archive) folder.
+
+Kept up to date by a background scanner so checking if a archived song or
+show can be played never has to touch the file system on the event loop.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+__all__ = ["ArchiveManifest", "ManifestEntry"]
+
+AUDIO_EXTENSIONS = (".mp3", ".opus")
+
+
+class ManifestEntry(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    guid: Optional[str]
+
+
+class _ScannedFolder(NamedTuple):
+    mtime: float
+    files: List[ManifestEntry]
+    folders: List[str]
+
+
+def get_guid(path: str) -> Optional[str]:
+    """GUID from a archive file name, `<title>[.<date>].<guid>.<ext>`"""
+
+    parts = os.path.basename(path).split(".")
+    if len(parts) < 3:
+        return None
+    return parts[-2]
+
+
+def _add_entry(
+    entry: ManifestEntry, entries: Dict[str, ManifestEntry], guids: Dict[str, str]
+) -> None:
+    entries[entry.path] = entry
+    if entry.guid is not None:
+        guids[entry.guid] = entry.path
+
+
+class ArchiveManifest:
+    """Playable files of the processed folder.
+
+    Scans only re-list folders whose mtime changed since the last scan.
+    Until the first scan is done every file is assumed to be playable.
+    """
+
+    folder: str
+    ready: bool = False
+    last_scan: Optional[float] = None
+
+    _entries: Dict[str, ManifestEntry]
+    _guids: Dict[str, str]
+    _folders: Dict[str, _ScannedFolder]
+    _scanning: bool = False
+    # files given to `add_file` during a scan, the scan may have missed them
+    _added: Optional[Dict[str, ManifestEntry]] = None
+    _lock: threading.Lock
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._entries = {}
+        self._guids = {}
+        self._folders = {}
+        self._lock = threading.Lock()
+        self._log = logging.getLogger("sxm_discord.manifest")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        return self._entries.get(path)
+
+    def is_playable(self, path: Optional[str]) -> bool:
+        if path is None:
+            return False
+        return not self.ready or path in self._entries
+
+    def has_guid(self, guid: str) -> bool:
+        return not self.ready or guid in self._guids
+
+    def add_file(self, path: str) -> bool:
+        """Adds a single new file without waiting for the next scan"""
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+
+        entry = ManifestEntry(path, stat.st_size, stat.st_mtime, get_guid(path))
+        with self._lock:
+            _add_entry(entry, self._entries, self._guids)
+            if self._added is not None:
+                self._added[path] = entry
+        return True
+
+    def _scan_folder(
+        self, path: str, folders: Dict[str, _ScannedFolder]
+    ) -> Tuple[int, int]:
+        """Scans folder into `folders`, returns (folders listed, reused)"""
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return 0, 0
+
+        listed, reused = 0, 0
+        cached = self._folders.get(path)
+        if cached is not None and cached.mtime == mtime:
+            scanned = cached
+            reused += 1
+        else:
+            files: List[ManifestEntry] = []
+            subfolders: List[str] = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                        elif entry.name.endswith(AUDIO_EXTENSIONS):
+                            stat = entry.stat()
+                            files.append(
+                                ManifestEntry(
+                                    entry.path,
+                                    stat.st_size,
+                                    stat.st_mtime,
+                                    get_guid(entry.path),
+                                )
+                            )
+            except OSError:
+                return 0, 0
+
+            scanned = _ScannedFolder(mtime, files, subfolders)
+            listed += 1
+
+        folders[path] = scanned
+        for subfolder in scanned.folders:
+            sub_listed, sub_reused = self._scan_folder(subfolder, folders)
+            listed += sub_listed
+            reused += sub_reused
+        return listed, reused
+
+    def scan(self) -> int:
+        """Updates manifest from the processed folder, returns number of files.
+
+        Blocking, run it in a executor.
+        """
+
+        start = time.monotonic()
+        with self._lock:
+            self._added = {}
+        folders: Dict[str, _ScannedFolder] = {}
+        listed, reused = self._scan_folder(self.folder, folders)
+
+        entries: Dict[str, ManifestEntry] = {}
+        guids: Dict[str, str] = {}
+        for scanned in folders.values():
+            for entry in scanned.files:
+                _add_entry(entry, entries, guids)
+
+        with self._lock:
+            for entry in (self._added or {}).values():
+                _add_entry(entry, entries, guids)
+            self._added = None
+
+            # swap everything at once so readers never see a partial scan
+            self._folders, self._entries, self._guids = folders, entries, guids
+        self.ready = True
+        self.last_scan = time.time()
+
+        self._log.debug(
+            f"scanned {len(entries)} files in {time.monotonic() - start:.2f}s "
+            f"({listed} folders listed, {reused} unchanged)"
+        )
+        return len(entries)
+
+    async def refresh(self) -> None:
+        if self._scanning:
+            return
+
+        self._scanning = True
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.scan)
+        finally:
+            self._scanning = False
@@ -0,0 +1,297 @@
+"""Performance metrics of the Discord worker in the Prometheus text format.
+
+Everything is plain counters and `LatencyHistogram`s that are updated inline,
+the text is only built when `/metrics` is scraped. The HTTP endpoint is off
+unless a port is set.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+from discord import AudioSource, HTTPException
+from discord.http import HTTPClient
+
+from sxm_discord.execution import LATENCY_BUCKETS, LatencyHistogram, command_latency
+
+__all__ = [
+    "MeteredAudio",
+    "MetricsServer",
+    "MetricsWriter",
+    "instrument_http",
+    "monitor_loop_lag",
+    "observe",
+]
+
+# for things that should take milliseconds, not seconds
+FAST_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+LAG_INTERVAL = 0.5
+# Discord sends a packet every 20ms, a read this much later was late
+UNDERRUN_GAP = 0.06
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+event_latency: Dict[str, LatencyHistogram] = {}
+loop_lag = LatencyHistogram(FAST_BUCKETS)
+ffmpeg_spawn: Dict[str, LatencyHistogram] = {}
+first_packet: Dict[str, LatencyHistogram] = {}
+voice_underruns: Counter = Counter()
+rest_latency: Dict[Tuple[str, str], LatencyHistogram] = {}
+rest_requests: Counter = Counter()
+
+_log = logging.getLogger("sxm_discord.metrics")
+
+
+def observe(
+    histograms: Dict, key, seconds: float, buckets: Tuple[float, ...] = FAST_BUCKETS
+) -> None:
+    """Adds observation to histogram for `key`, creating it if needed"""
+
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = LatencyHistogram(buckets)
+    histogram.observe(seconds)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, object]) -> str:
+    if len(labels) == 0:
+        return ""
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f"{{{pairs}}}"
+
+
+class MetricsWriter:
+    """Builds a Prometheus text exposition.
+
+    All samples of a metric have to be written one after another.
+    """
+
+    _lines: List[str]
+    _declared: Set[str]
+
+    def __init__(self):
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name: str, kind: str, description: str) -> None:
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f"# HELP {name} {description}")
+            self._lines.append(f"# TYPE {name} {kind}")
+
+    def gauge(self, name: str, description: str, value: float, **labels) -> None:
+        self._declare(name, "gauge", description)
+        self._lines.append(f"{name}{_labels(labels)} {value}")
+
+    def counter(self, name: str, description: str, value: float, **labels) -> None:
+        self._declare(name, "counter", description)
+        self._lines.append(f"{name}_total{_labels(labels)} {value}")
+
+    def histogram(
+        self,
+        name: str,
+        description: str,
+        histogram: LatencyHistogram,
+        **labels,
+    ) -> None:
+        self._declare(name, "histogram", description)
+
+        # `LatencyHistogram` counts per bucket, Prometheus wants cumulative
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            bucket_labels = _labels({**labels, "le": bound})
+            self._lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        inf_labels = _labels({**labels, "le": "+Inf"})
+        self._lines.append(f"{name}_bucket{inf_labels} {histogram.count}")
+        self._lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+        self._lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
+
+
+def write_global_metrics(metrics: MetricsWriter) -> None:
+    """Writes the metrics kept in this module and `execution`"""
+
+    metrics.histogram(
+        "sxm_discord_event_loop_lag_seconds",
+        "How late the event loop woke up a sleeping task",
+        loop_lag,
+    )
+    for msg_type, histogram in sorted(event_latency.items()):
+        metrics.histogram(
+            "sxm_discord_event_handle_seconds",
+            "Time to handle a event from the sxm-player queues",
+            histogram,
+            type=msg_type,
+        )
+    for name, histogram in sorted(command_latency.items()):
+        metrics.histogram(
+            "sxm_discord_command_seconds",
+            "Latency of slash commands",
+            histogram,
+            command=name,
+        )
+    for kind, histogram in sorted(ffmpeg_spawn.items()):
+        metrics.histogram(
+            "sxm_discord_source_spawn_seconds",
+            "Time to create a audio source (starts FFmpeg)",
+            histogram,
+            kind=kind,
+        )
+    for kind, histogram in sorted(first_packet.items()):
+        metrics.histogram(
+            "sxm_discord_source_first_packet_seconds",
+            "Time from creating a audio source to its first packet",
+            histogram,
+            kind=kind,
+        )
+    for kind, count in sorted(voice_underruns.items()):
+        metrics.counter(
+            "sxm_discord_voice_underruns",
+            "Voice packets that were read late",
+            count,
+            kind=kind,
+        )
+    for (method, route), histogram in sorted(rest_latency.items()):
+        metrics.histogram(
+            "sxm_discord_rest_seconds",
+            "Latency of Discord REST calls, including rate limit waits",
+            histogram,
+            method=method,
+            route=route,
+        )
+    for (method, route, status), count in sorted(rest_requests.items()):
+        metrics.counter(
+            "sxm_discord_rest_requests",
+            "Discord REST calls",
+            count,
+            method=method,
+            route=route,
+            status=status,
+        )
+
+
+class MeteredAudio(AudioSource):
+    """Wraps a `AudioSource` to time its first packet and count late reads"""
+
+    def __init__(self, source: AudioSource, kind: str, created: float):
+        self.source = source
+        self.kind = kind
+        # `perf_counter` from before the source was created
+        self._created: Optional[float] = created
+        self._last_read: Optional[float] = None
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def read(self) -> bytes:
+        start = time.perf_counter()
+        if self._last_read is not None and start - self._last_read > UNDERRUN_GAP:
+            voice_underruns[self.kind] += 1
+        self._last_read = start
+
+        packet = self.source.read()
+        if self._created is not None and len(packet) > 0:
+            elapsed = time.perf_counter() - self._created
+            observe(first_packet, self.kind, elapsed, LATENCY_BUCKETS)
+            self._created = None
+        return packet
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+
+
+def instrument_http(http: HTTPClient) -> None:
+    """Times every Discord REST call by route template"""
+
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await request(route, **kwargs)
+        except HTTPException as e:
+            status = str(e.status)
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            key = (route.method, route.path)
+            observe(rest_latency, key, time.perf_counter() - start, LATENCY_BUCKETS)
+            rest_requests[(*key, status)] += 1
+
+    http.request = timed_request
+
+
+async def monitor_loop_lag(interval: float = LAG_INTERVAL) -> None:
+    """Measures how much later than asked the event loop wakes up"""
+
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, time.perf_counter() - start - interval))
+
+
+class MetricsServer:
+    """Serves `/metrics` over HTTP on the bot's event loop"""
+
+    host: str
+    port: int
+
+    _collect: Callable[[MetricsWriter], None]
+    _runner: Optional[web.AppRunner] = None
+
+    def __init__(self, host: str, port: int, collect: Callable[[MetricsWriter], None]):
+        self.host = host
+        self.port = port
+        self._collect = collect
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        metrics = MetricsWriter()
+        write_global_metrics(metrics)
+        try:
+            self._collect(metrics)
+        except Exception:
+            _log.exception("error while collecting metrics")
+            raise web.HTTPInternalServerError()
+
+        return web.Response(
+            body=metrics.render().encode("utf8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        _log.info(f"serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,27 +1,31 @@
 from datetime import datetime, timezone
 from typing import Any, List, Optional, Tuple, Union
 
-from discord import Client, Embed, FFmpegOpusAudio, Game, Message, errors
+from discord import AudioSource, Client, Embed, Game, Message, errors
 from discord.channel import DMChannel, GroupChannel, TextChannel
 from discord_slash import SlashContext  # type: ignore
 from humanize import naturaltime  # type: ignore
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
-from sxm.models import XMChannel, XMCutMarker, XMLiveChannel, XMSong
-from sxm_player.models import Episode, PlayerState, Song
+from sxm.models import XMChannel, XMCutMarker, XMSong
+from sxm_player.models import Episode, Song
 
+from .state import DiscordPlayerState
+from .timeline import LiveTimeline
 from .utils import (
     generate_embed_from_archived,
     generate_embed_from_cut,
-    get_art_url_by_size,
+    get_album_art_map,
     send_message,
 )
 
+REPLAY_EMOJI = "⏪"
+
 
 class QueuedItem(BaseModel):
     audio_file: Union[Song, Episode, None] = None
     stream_data: Optional[Tuple[XMChannel, str]] = None
 
-    source: Optional[FFmpegOpusAudio] = None
+    source: Optional[AudioSource] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -35,6 +39,11 @@ class SXMQueuedItem(QueuedItem):
     stream_data: Tuple[XMChannel, str]
 
 
+class ReplayQueuedItem(SXMQueuedItem):
+    # radio time range in ms to play from the rewind buffer
+    replay: Tuple[int, int]
+
+
 class SongActivity(Game):
     def __init__(
         self,
@@ -73,7 +82,7 @@ class SXMActivity(SongActivity):
         start: Optional[datetime],
         radio_time: Optional[datetime],
         channel: XMChannel,
-        live_channel: XMLiveChannel,
+        timeline: LiveTimeline,
         **kwargs,
     ):
 
@@ -91,9 +100,9 @@ class SXMActivity(SongActivity):
         self.session_id = kwargs.pop("session_id", None)
 
         suffix = f"SXM {channel.pretty_name}"
-        song = self.create_song(channel, live_channel, radio_time)
+        song = self.create_song(channel, timeline, radio_time)
         if song is None:
-            episode = live_channel.get_latest_episode(now=radio_time)
+            episode = timeline.get_latest_episode(now=radio_time)
             if episode is not None:
                 suffix = f'"{episode.episode.long_title}" on {suffix}'
         else:
@@ -108,18 +117,18 @@ class SXMActivity(SongActivity):
     def create_song(
         self,
         channel: XMChannel,
-        live_channel: XMLiveChannel,
+        timeline: LiveTimeline,
         radio_time: Optional[datetime],
     ) -> Optional[Song]:
         """Updates activity object from current channel playing"""
 
-        latest_cut = live_channel.get_latest_cut(now=radio_time)
+        latest_cut = timeline.get_latest_cut(now=radio_time)
         if latest_cut is not None and isinstance(latest_cut.cut, XMSong):
-            image_url = (
-                None
-                if latest_cut.cut.album is None
-                else get_art_url_by_size(latest_cut.cut.album.arts, "MEDIUM")
-            )
+            image_url: Optional[str] = None
+            art = get_album_art_map(latest_cut.cut)
+            if art is not None:
+                image_url = art.sizes.get("MEDIUM")
+
             return Song(
                 guid="",
                 title=latest_cut.cut.title,
@@ -146,7 +155,7 @@ class ReactionCarousel(BaseModel):
     def current(self):
         return self.items[self.index]
 
-    def get_message_kwargs(self, state: PlayerState) -> dict:
+    def get_message_kwargs(self, state: DiscordPlayerState) -> dict:
         raise NotImplementedError()
 
     async def update_message(
@@ -170,14 +179,20 @@ class ReactionCarousel(BaseModel):
         except errors.NotFound:
             self.message = None
 
-    async def clear_reactions(self):
+    def get_kept_reactions(self) -> Tuple[str, ...]:
+        """Reactions that are added once and kept between pages"""
+
+        return ()
+
+    async def clear_reactions(self, keep: Tuple[str, ...] = ()):
         if self.message is None:
             return
 
         for reaction in self.message.reactions:
-            await reaction.clear()
+            if reaction.emoji not in keep:
+                await reaction.clear()
 
-    async def handle_reaction(self, state: PlayerState, emoji: str):
+    async def handle_reaction(self, state: DiscordPlayerState, emoji: str):
         if emoji == "⬅️":
             self.index = max(0, self.index - 1)
         elif emoji == "➡️":
@@ -185,13 +200,15 @@ class ReactionCarousel(BaseModel):
 
         await self.update(state)
 
-    async def update(self, state: PlayerState, ctx: Optional[SlashContext] = None):
+    async def update(
+        self, state: DiscordPlayerState, ctx: Optional[SlashContext] = None
+    ):
         if self.message is None:
             self.message = await send_message(ctx, **self.get_message_kwargs(state))
         else:
             await self.update_message(**self.get_message_kwargs(state))
 
-        await self.clear_reactions()
+        await self.clear_reactions(keep=self.get_kept_reactions())
 
         if self.index > 0:
             await self.message.add_reaction("⬅️")
@@ -206,12 +223,13 @@ class SXMCutCarousel(ReactionCarousel):
     latest: XMCutMarker
     channel: XMChannel
     body: str
+    replayable: bool = False
 
     @property
     def current(self) -> XMCutMarker:
         return super().current
 
-    def _get_footer(self, state: PlayerState):
+    def _get_footer(self, state: DiscordPlayerState):
         if self.current == self.latest:
             return f"Now Playing | {self.index+1}/{len(self.items)} Recent Songs"
 
@@ -229,11 +247,24 @@ class SXMCutCarousel(ReactionCarousel):
         if self.message is not None and embed is not None:
             await self.message.edit(embed=embed)
 
-    def get_message_kwargs(self, state: PlayerState) -> dict:
-        if state.live is None:
+    def get_kept_reactions(self) -> Tuple[str, ...]:
+        return (REPLAY_EMOJI,) if self.replayable else ()
+
+    async def update(
+        self, state: DiscordPlayerState, ctx: Optional[SlashContext] = None
+    ):
+        created = self.message is None
+        await super().update(state, ctx)
+
+        if created and self.replayable and self.message is not None:
+            await self.message.add_reaction(REPLAY_EMOJI)
+
+    def get_message_kwargs(self, state: DiscordPlayerState) -> dict:
+        timeline = state.timeline
+        if timeline is None:
             raise ValueError("Nothing is playing")
 
-        episode = state.live.get_latest_episode(self.latest.time)
+        episode = timeline.get_latest_episode(self.latest.time)
 
         return {
             "message": self.body,
@@ -263,7 +294,7 @@ class ArchivedSongCarousel(ReactionCarousel):
         if self.message is not None and embed is not None:
             await self.message.edit(embed=embed)
 
-    def get_message_kwargs(self, state: PlayerState) -> dict:
+    def get_message_kwargs(self, state: DiscordPlayerState) -> dict:
         return {
             "message": self.body,
             "embed": generate_embed_from_archived(
@@ -1,18 +1,81 @@
 import asyncio
-import logging
+import time
 import traceback
 from enum import Enum, auto
-from random import SystemRandom
-from typing import List, Optional, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
-from discord import FFmpegOpusAudio, VoiceChannel, VoiceClient
-from sqlalchemy import and_
+from discord import AudioSource, FFmpegOpusAudio, VoiceChannel, VoiceClient
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm.session import Session
 from sxm.models import XMChannel
 from sxm_player.models import DBSong, Episode, Song
 from sxm_player.queue import EventMessage, EventTypes, Queue
 
-from sxm_discord.models import ArchivedQueuedItem, QueuedItem, SXMQueuedItem
+from sxm_discord.logs import StructuredLogger, get_logger
+from sxm_discord.loudness import LoudnessIndex
+from sxm_discord.metrics import MeteredAudio, ffmpeg_spawn, observe
+from sxm_discord.models import (
+    ArchivedQueuedItem,
+    QueuedItem,
+    ReplayQueuedItem,
+    SXMQueuedItem,
+)
+from sxm_discord.prefetch import FilePrefetcher
+from sxm_discord.rewind import RecordingOpusAudio, RewindAudio, RewindBuffer
+from sxm_discord.tracing import Span, run_in_executor, traced, tracer
+
+# Opus bitrates (kbps) to encode with, picked by the voice channel bitrate
+BITRATE_PROFILES = (64, 96, 128, 192, 256, 384)
+DEFAULT_BITRATE = 128
+# extra random songs picked for a playlist in case some are not playable
+PLAYLIST_CANDIDATES = 20
+
+
+def get_bitrate_profile(channel_bitrate: int) -> int:
+    """Returns highest profile that is not over the channel's bitrate (bps)"""
+
+    kbps = channel_bitrate // 1000
+    profile = BITRATE_PROFILES[0]
+    for bitrate in BITRATE_PROFILES:
+        if bitrate <= kbps:
+            profile = bitrate
+    return profile
+
+
+PlayableFilter = Callable[[Optional[str]], bool]
+
+
+def _all_playable(file_path: Optional[str]) -> bool:
+    return True
+
+
+def pick_random_songs(
+    bind: Engine, channel_ids: List[str], is_playable: PlayableFilter, count: int
+) -> List[Song]:
+    """Returns up to `count` random songs of the channels that have a
+    playable file, every title/artist is as likely. Blocking, run it in a
+    executor."""
+
+    # the session of the bot can not be used from another thread
+    db = Session(bind=bind)
+    try:
+        candidates = (
+            db.query(DBSong)
+            .filter(DBSong.channel.in_(channel_ids))
+            .group_by(DBSong.title, DBSong.artist)
+            .order_by(func.random())
+            .limit(count + PLAYLIST_CANDIDATES)
+        )
+        songs: List[Song] = []
+        for song in candidates:
+            if is_playable(song.file_path):
+                songs.append(Song.from_orm(song))
+                if len(songs) >= count:
+                    break
+    finally:
+        db.close()
+    return songs
 
 
 class PlayType(Enum):
@@ -21,32 +84,56 @@ class PlayType(Enum):
     RANDOM = auto()
 
 
+SourceFactory = Callable[..., AudioSource]
+
+
 class AudioPlayer:
+    # swapped out by `sxm_discord.debug` to play without FFmpeg
+    opus_source: SourceFactory = FFmpegOpusAudio
+    recording_source: SourceFactory = RecordingOpusAudio
+
+    bitrate: int = DEFAULT_BITRATE
     play_type: Optional[PlayType] = None
     recent: List[Union[Episode, Song]]
     upcoming: List[Union[Episode, Song]]
     repeat: bool = False
 
     _event_queue: Queue
-    _log: logging.Logger
+    _log: StructuredLogger
+    _loudness: Optional[LoudnessIndex]
     _loop: asyncio.AbstractEventLoop
+    _on_state_change: Optional[Callable[[], None]]
     _player_event: asyncio.Event
     _player_queue: asyncio.Queue
-    _random: SystemRandom
+    _prefetcher: Optional[FilePrefetcher]
+    _rewind: Optional[RewindBuffer]
     _shutdown_event: asyncio.Event
 
     _current: Optional[QueuedItem] = None
-    _playlist_data: Optional[Tuple[List[XMChannel], Session]] = None
+    # from triggering a HLS stream until sxm-player says it started
+    _hls_span: Optional[Span] = None
+    _playlist_data: Optional[Tuple[List[XMChannel], Session, PlayableFilter]] = None
     _voice: Optional[VoiceClient] = None
 
-    def __init__(self, event_queue: Queue, loop: asyncio.AbstractEventLoop):
+    def __init__(
+        self,
+        event_queue: Queue,
+        loop: asyncio.AbstractEventLoop,
+        on_state_change: Optional[Callable[[], None]] = None,
+        rewind: Optional[RewindBuffer] = None,
+        loudness: Optional[LoudnessIndex] = None,
+        prefetcher: Optional[FilePrefetcher] = None,
+    ):
 
         self._event_queue = event_queue
-        self._log = logging.getLogger("sxm_discord.player")
+        self._log = get_logger("player")
         self._loop = loop
+        self._loudness = loudness
+        self._prefetcher = prefetcher
+        self._on_state_change = on_state_change
         self._player_event = asyncio.Event()
         self._player_queue = asyncio.Queue()
-        self._random = SystemRandom()
+        self._rewind = rewind
         self._shutdown_event = asyncio.Event()
 
         self.recent = []
@@ -68,6 +155,7 @@ class AudioPlayer:
         """Gets the voice client for audio player"""
         return self._voice
 
+    @traced()
     async def set_voice(self, channel: VoiceChannel) -> None:
         """Sets voice channel for audio player"""
 
@@ -76,6 +164,31 @@ class AudioPlayer:
         else:
             await self._voice.move_to(channel)
 
+        bitrate = get_bitrate_profile(channel.bitrate)
+        if bitrate != self.bitrate:
+            self._log.info("encoding", bitrate=bitrate, channel=channel.id)
+            self.bitrate = bitrate
+            await self._restart_live()
+        self._state_changed()
+
+    async def _restart_live(self) -> None:
+        """Restarts live stream so it is encoded with the current bitrate.
+        Files and replays pick up the bitrate with the next item."""
+
+        if (
+            self.play_type != PlayType.LIVE
+            or self._voice is None
+            or not isinstance(self._current, SXMQueuedItem)
+            or isinstance(self._current, ReplayQueuedItem)
+            or not self._player_queue.empty()
+        ):
+            return
+
+        await self._player_queue.put(
+            SXMQueuedItem(stream_data=self._current.stream_data)
+        )
+        self._voice.stop()
+
     @property
     def current(self) -> Optional[QueuedItem]:
         """Returns current `Song` or `Episode` that is being played"""
@@ -87,7 +200,7 @@ class AudioPlayer:
     async def stop(self, disconnect=True, kill_hls=True):
         """Stops the `AudioPlayer`"""
 
-        self._log.debug(f"player stop: {disconnect}")
+        self._log.debug("player stop", disconnect=disconnect)
 
         while not self._player_queue.empty():
             self._player_queue.get_nowait()
@@ -119,7 +232,13 @@ class AudioPlayer:
                         EventMessage("discord", EventTypes.KILL_HLS_STREAM, None)
                     )
 
+        if self._hls_span is not None:
+            self._hls_span.set("cancelled", True)
+            self._hls_span.end()
+            self._hls_span = None
+
         self.play_type = None
+        self._state_changed()
 
     async def skip(self) -> bool:
         """Skips current `QueueItem`"""
@@ -140,12 +259,13 @@ class AudioPlayer:
         if self._current is not None and self._current.source is not None:
             self._current.source.cleanup()
 
+    @traced()
     async def add_live_stream(self, channel: XMChannel, stream_url=None) -> bool:
         """Adds HLS live stream to playing queue"""
 
         if self.play_type is None:
             self.play_type = PlayType.LIVE
-            self._log.debug(f"adding live stream: {channel} ({stream_url})")
+            self._log.debug("adding live stream", channel=channel, url=stream_url)
             await self._add(stream_data=(channel, stream_url))
             return True
 
@@ -155,15 +275,51 @@ class AudioPlayer:
         )
         return False
 
-    async def add_playlist(self, xm_channels: List[XMChannel], db: Session) -> bool:
-        """Creates a playlist of random songs from an channel"""
+    @traced()
+    async def add_replay(self, start_ms: int, end_ms: int) -> bool:
+        """Replays radio time range of the live stream from the rewind buffer
+        and then goes back to the live stream"""
+
+        if (
+            self._rewind is None
+            or self.play_type != PlayType.LIVE
+            or self._voice is None
+            or self._current is None
+            or self._current.stream_data is None
+        ):
+            return False
+
+        if not self._rewind.contains(start_ms):
+            self._log.debug("not in rewind buffer", start_ms=start_ms)
+            return False
+
+        stream_data = self._current.stream_data
+        while not self._player_queue.empty():
+            self._player_queue.get_nowait()
+
+        await self._player_queue.put(
+            ReplayQueuedItem(stream_data=stream_data, replay=(start_ms, end_ms))
+        )
+        await self._player_queue.put(SXMQueuedItem(stream_data=stream_data))
+        # ends the current item so the replay starts right away
+        self._voice.stop()
+        return True
+
+    @traced()
+    async def add_playlist(
+        self,
+        xm_channels: List[XMChannel],
+        db: Session,
+        is_playable: PlayableFilter = _all_playable,
+    ) -> bool:
+        """Creates a playlist of random songs from an channel. Only songs
+        with a file that `is_playable` are picked."""
 
         if self.play_type is None:
-            self._log.debug(f"adding playlist: {xm_channels}")
-            self._playlist_data = (xm_channels, db)
+            self._log.debug("adding playlist", channels=xm_channels)
+            self._playlist_data = (xm_channels, db, is_playable)
 
-            for _ in range(5):
-                await self._add_random_playlist_song()
+            await self._add_random_playlist_songs(5)
 
             self.play_type = PlayType.RANDOM
             return True
@@ -174,6 +330,7 @@ class AudioPlayer:
         )
         return False
 
+    @traced()
     async def add_file(self, file_info: Union[Song, Episode]) -> bool:
         """Adds file to playing queue"""
 
@@ -185,7 +342,7 @@ class AudioPlayer:
         elif self.play_type is None:
             self.play_type = PlayType.FILE
 
-        self._log.debug(f"adding file: {file_info}")
+        self._log.debug("adding file", file=file_info)
         await self._add(file_info=file_info)
         return True
 
@@ -204,8 +361,10 @@ class AudioPlayer:
         if stream_data is None:
             item = ArchivedQueuedItem(audio_file=file_info)
             self.upcoming.append(item.audio_file)
+            self._prefetch_upcoming()
         elif stream_data[1] is None:
-            self._log.debug(f"trigging HLS stream for channel {stream_data[0].id}")
+            self._log.debug("triggering HLS stream", channel=stream_data[0].id)
+            self._hls_span = tracer.span("player.hls_stream", channel=stream_data[0].id)
             success = self._event_queue.safe_put(
                 EventMessage(
                     "discord",
@@ -217,41 +376,35 @@ class AudioPlayer:
             if not success:
                 self._log.warning("Could not trigger HLS stream")
         else:
+            if self._hls_span is not None:
+                self._hls_span.end()
+                self._hls_span = None
             item = SXMQueuedItem(stream_data=(stream_data[0], stream_data[1]))
 
         if item is not None:
-            self._log.debug(f"adding queued item: {item}")
+            self._log.debug("adding queued item", item=item)
             await self._player_queue.put(item)
 
-    async def _add_random_playlist_song(self) -> bool:
+    async def _add_random_playlist_songs(self, count: int = 1) -> bool:
         if self._playlist_data is None:
             self._discard("Playlist data missing")
             return False
 
-        channel_ids = [x.id for x in self._playlist_data[0]]
-
-        song_query = (
-            self._playlist_data[1]
-            .query(DBSong.title, DBSong.artist)
-            .filter(DBSong.channel.in_(channel_ids))
-        )
-        songs = song_query.distinct().all()
-
-        song = self._random.choice(songs)
-        song = (
-            self._playlist_data[1]
-            .query(DBSong)
-            .filter(
-                and_(
-                    DBSong.channel.in_(channel_ids),
-                    DBSong.title == song[0],
-                    DBSong.artist == song[1],
-                )
-            )
-            .first()
+        xm_channels, db, is_playable = self._playlist_data
+        songs = await run_in_executor(
+            pick_random_songs,
+            db.get_bind(),
+            [x.id for x in xm_channels],
+            is_playable,
+            count,
         )
+        if len(songs) == 0:
+            self._discard("No playable songs for playlist")
+            return False
 
-        return await self.add_file(file_info=Song.from_orm(song))
+        for song in songs:
+            await self.add_file(file_info=song)
+        return True
 
     async def _audio_player(self) -> None:
         """Bot task to manage and run the audio player"""
@@ -259,7 +412,7 @@ class AudioPlayer:
         while not self._shutdown_event.is_set():
             self._player_event.clear()
             self._current = await self._player_queue.get()
-            self._log.debug(f"audio player, new item: {self._current}")
+            self._log.debug("new item", item=self._current)
 
             # validate event before starting to block
             if self._shutdown_event.is_set():
@@ -270,6 +423,8 @@ class AudioPlayer:
                 continue
 
             log_item = ""
+            kind = "file"
+            spawn_start = time.perf_counter()
             # wait until player is instructed to start playing
             if self.play_type is None or self._current is None:
                 self._discard("nothing playing")
@@ -283,11 +438,33 @@ class AudioPlayer:
                     continue
 
                 log_item = self._current.stream_data[0].id
-                self._current.source = FFmpegOpusAudio(
-                    self._current.stream_data[1],
-                    before_options="-f mpegts",
-                    options="-loglevel fatal",
-                )
+                kind = "live"
+                if (
+                    isinstance(self._current, ReplayQueuedItem)
+                    and self._rewind is not None
+                ):
+                    log_item = f"{log_item} (replay {self._current.replay[0]})"
+                    kind = "replay"
+                    self._current.source = RewindAudio(
+                        self._rewind, *self._current.replay
+                    )
+                elif self._rewind is not None and self._rewind.start_recording(
+                    self._current.stream_data[0].id
+                ):
+                    self._current.source = self.recording_source(
+                        self._current.stream_data[1],
+                        bitrate=self.bitrate,
+                        before_options="-f mpegts",
+                        options="-loglevel fatal",
+                        rewind=self._rewind,
+                    )
+                else:
+                    self._current.source = self.opus_source(
+                        self._current.stream_data[1],
+                        bitrate=self.bitrate,
+                        before_options="-f mpegts",
+                        options="-loglevel fatal",
+                    )
             else:
                 if self._current.stream_data is not None:
                     self._discard("not file")
@@ -298,22 +475,39 @@ class AudioPlayer:
 
                 if len(self.upcoming) > 0:
                     self.upcoming.pop(0)
+                if self._prefetcher is not None:
+                    self._prefetcher.track_started(self._current.audio_file.file_path)
+                    self._prefetch_upcoming()
 
                 self.recent.insert(0, self._current.audio_file)
                 self.recent = self.recent[:10]
 
                 log_item = self._current.audio_file.file_path
-                self._current.source = FFmpegOpusAudio(
-                    self._current.audio_file.file_path
+                options: Optional[str] = None
+                if self._loudness is not None:
+                    gain = self._loudness.get_gain(log_item)
+                    if gain is not None:
+                        log_item = f"{log_item} ({gain:+}dB)"
+                        options = f"-filter:a volume={gain}dB"
+
+                self._current.source = self.opus_source(
+                    self._current.audio_file.file_path,
+                    bitrate=self.bitrate,
+                    options=options,
                 )
 
-            self._log.info(f"playing {log_item}")
-            self._voice.play(self._current.source, after=self._song_end)
+            observe(ffmpeg_spawn, kind, time.perf_counter() - spawn_start)
+            self._log.info("playing", item=log_item, kind=kind)
+            self._voice.play(
+                MeteredAudio(self._current.source, kind, spawn_start),
+                after=self._song_end,
+            )
+            self._state_changed()
 
             await self._player_event.wait()
 
             if self.play_type == PlayType.RANDOM and self._player_queue.qsize() < 5:
-                await self._add_random_playlist_song()
+                await self._add_random_playlist_songs()
             elif self.repeat and self.play_type == PlayType.FILE:
                 try:
                     await self._add(file_info=self._current.audio_file)
@@ -322,11 +516,26 @@ class AudioPlayer:
                     self._log.error(traceback.format_exc())
 
             self._current = None
+            self._state_changed()
+
+    def _prefetch_upcoming(self) -> None:
+        if self._prefetcher is not None:
+            self._prefetcher.prefetch(f.file_path for f in self.upcoming)
 
     def _discard(self, message: str):
-        self._log.debug(f"discarding item, {message}")
+        self._log.debug("discarding item", reason=message)
         self.play_type = None
         self._current = None
+        self._state_changed()
+
+    def _state_changed(self) -> None:
+        """Notifies listener the player started/stopped playing or moved"""
+
+        if self._on_state_change is not None:
+            try:
+                self._on_state_change()
+            except Exception:
+                self._log.exception("error in player state change callback")
 
     def _song_end(self, error: Optional[Exception] = None) -> None:
         """Callback for `discord.AudioPlayer`/`discord.VoiceClient`"""
@@ -1,13 +1,65 @@
 import os
-from typing import List, Optional, Tuple, Type
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Type
 
 import click
-from sxm_player.models import PlayerState
 from sxm_player.players import BasePlayer, Option
-from sxm_player.runner import Runner
-from sxm_player.workers import BaseWorker
+from sxm_player.workers import (
+    HLSStatusSubscriber,
+    InterruptableWorker,
+    SXMStatusSubscriber,
+)
 
-from sxm_discord.utils import set_root_command
+from sxm_discord.config import set_root_command
+from sxm_discord.logs import DEFAULT_CAPACITY, parse_level, parse_subsystems
+from sxm_discord.snapshot import StateSnapshot
+
+if TYPE_CHECKING:  # pragma: no cover
+    from sxm_player.models import PlayerState
+    from sxm_player.runner import Runner
+    from sxm_player.workers import BaseWorker
+
+
+def _sample_rate(value: str) -> int:
+    rate = int(value)
+    if rate < 1:
+        raise ValueError(f"sample rate has to be at least 1, got {rate}")
+    return rate
+
+
+def _parse_log_levels(context, param, value: Optional[str]) -> Dict[str, int]:
+    try:
+        return parse_subsystems(value, parse_level)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _parse_log_sample(context, param, value: Optional[str]) -> Dict[str, int]:
+    try:
+        return parse_subsystems(value, _sample_rate)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+class DiscordWorkerLoader(
+    InterruptableWorker, HLSStatusSubscriber, SXMStatusSubscriber
+):
+    """Stand-in worker class handed to the `Runner`.
+
+    Defers importing `discord`, `discord_slash` and the rest of the bot
+    until the worker process actually creates the worker.
+    """
+
+    worker_name: str = "DiscordWorker"
+
+    def __new__(cls, *args, **kwargs):
+        from sxm_discord import bot
+
+        worker_class = getattr(bot, cls.worker_name)
+        return worker_class(*args, **kwargs)
+
+
+class DiscordArchivedWorkerLoader(DiscordWorkerLoader):
+    worker_name: str = "DiscordArchivedWorker"
 
 
 class DiscordPlayer(BasePlayer):
@@ -38,6 +90,87 @@ class DiscordPlayer(BasePlayer):
             help="Discord channel ID for various bot status updates",
             envvar="SXM_DISCORD_OUTPUT_CHANNEL",
         ),
+        Option(
+            "--rewind-minutes",
+            type=int,
+            default=60,
+            help="Minutes of the live stream to keep for replays, 0 to disable",
+            envvar="SXM_DISCORD_REWIND_MINUTES",
+        ),
+        Option(
+            "--metrics-port",
+            type=int,
+            help="Port to serve Prometheus metrics on, disabled if not set",
+            envvar="SXM_DISCORD_METRICS_PORT",
+        ),
+        Option(
+            "--metrics-host",
+            type=str,
+            default="127.0.0.1",
+            help="Address to serve Prometheus metrics on",
+            envvar="SXM_DISCORD_METRICS_HOST",
+        ),
+        Option(
+            "--watchdog-ms",
+            type=int,
+            default=0,
+            help=(
+                "Log where the event loop is blocked for longer than this many "
+                "ms, 0 to disable"
+            ),
+            envvar="SXM_DISCORD_WATCHDOG_MS",
+        ),
+        Option(
+            "--trace-file",
+            type=click.Path(dir_okay=False, writable=True),
+            help="File to write tracing spans of slash commands to as JSON lines",
+            envvar="SXM_DISCORD_TRACE_FILE",
+        ),
+        Option(
+            "--trace-endpoint",
+            type=str,
+            help=(
+                "OpenTelemetry collector to send tracing spans of slash commands "
+                "to (OTLP/HTTP), for example http://localhost:4318"
+            ),
+            envvar="SXM_DISCORD_TRACE_ENDPOINT",
+        ),
+        Option(
+            "--record-events",
+            type=click.Path(dir_okay=False, writable=True),
+            help="File to record events from sxm-player to, for replaying later",
+            envvar="SXM_DISCORD_RECORD_EVENTS",
+        ),
+        Option(
+            "--log-levels",
+            type=str,
+            help=(
+                "Log levels of bot subsystems, for example "
+                "player=debug,events=warning"
+            ),
+            callback=_parse_log_levels,
+            envvar="SXM_DISCORD_LOG_LEVELS",
+        ),
+        Option(
+            "--log-sample",
+            type=str,
+            help=(
+                "Write only 1 in N debug records of bot subsystems to the log, "
+                "for example events=10"
+            ),
+            callback=_parse_log_sample,
+            envvar="SXM_DISCORD_LOG_SAMPLE",
+        ),
+        Option(
+            "--log-buffer",
+            type=int,
+            default=DEFAULT_CAPACITY,
+            help=(
+                "Recent log records (debug included) to keep in memory for "
+                "errors and `admin logs`, 0 to disable"
+            ),
+            envvar="SXM_DISCORD_LOG_BUFFER",
+        ),
     ]
 
     @staticmethod
@@ -46,8 +179,8 @@ class DiscordPlayer(BasePlayer):
 
     @staticmethod
     def get_worker_args(
-        runner: Runner, state: PlayerState, **kwargs
-    ) -> Optional[Tuple[Type[BaseWorker], str, dict]]:
+        runner: "Runner", state: "PlayerState", **kwargs
+    ) -> Optional[Tuple[Type["BaseWorker"], str, dict]]:
 
         context = click.get_current_context()
         processed_folder: Optional[str] = None
@@ -58,17 +191,26 @@ class DiscordPlayer(BasePlayer):
             "token": context.meta["token"],
             "description": context.meta["description"],
             "output_channel_id": context.meta["output_channel_id"],
+            "rewind_minutes": context.meta["rewind_minutes"],
+            "metrics_host": context.meta["metrics_host"],
+            "metrics_port": context.meta["metrics_port"],
+            "watchdog_ms": context.meta["watchdog_ms"],
+            "trace_file": context.meta["trace_file"],
+            "trace_endpoint": context.meta["trace_endpoint"],
+            "record_events": context.meta["record_events"],
+            "log_levels": context.meta["log_levels"],
+            "log_sample": context.meta["log_sample"],
+            "log_buffer": context.meta["log_buffer"],
             "processed_folder": processed_folder,
             "sxm_status": state.sxm_running,
             "stream_data": state.stream_data,
-            "channels": state.get_raw_channels(),
-            "raw_live_data": state.get_raw_live(),
+            "state_snapshot": StateSnapshot.from_state(state),
         }
 
+        # the root command is read from the environment when `sxm_discord.bot`
+        # is imported inside of the worker process, so it must be set here
         set_root_command(context.meta["root_command"])
-        # must be imported _after_ `set_root_command`
-        from sxm_discord.bot import DiscordArchivedWorker, DiscordWorker
 
         if processed_folder is None:
-            return (DiscordWorker, "discord", params)
-        return (DiscordArchivedWorker, "discord", params)
+            return (DiscordWorkerLoader, "discord", params)
+        return (DiscordArchivedWorkerLoader, "discord", params)
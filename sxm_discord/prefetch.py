@@ -0,0 +1,106 @@
+"""Warms the page cache for archive files that are about to be played.
+
+On spinning disks or network mounts the first read FFmpeg does for a file can
+stall for a long time. The next few files on the play queue are read ahead in
+a small thread pool, so by the time they start they come from the page cache.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Optional
+
+__all__ = ["FilePrefetcher"]
+
+PREFETCH_AHEAD = 2
+PREFETCH_WORKERS = 2
+# only the start of a file is read, FFmpeg reads the rest while playing
+PREFETCH_BYTES = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+MAX_TRACKED = 32
+
+
+def warm_file(path: str, max_bytes: int = PREFETCH_BYTES) -> float:
+    """Reads start of file into the page cache, returns seconds it took"""
+
+    start = time.monotonic()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+        # `WILLNEED` is only a hint and does nothing on some network
+        # filesystems, so also read through the start of the file
+        remaining = max_bytes
+        while remaining > 0:
+            data = os.read(fd, min(READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+    finally:
+        os.close(fd)
+    return time.monotonic() - start
+
+
+class FilePrefetcher:
+    """Prefetches the next `ahead` files and counts cache hits/misses.
+
+    A track is a hit if it was done prefetching when it started playing.
+    """
+
+    ahead: int
+    hits: int = 0
+    misses: int = 0
+
+    _pool: ThreadPoolExecutor
+    _warming: "OrderedDict[str, Future]"
+
+    def __init__(self, ahead: int = PREFETCH_AHEAD):
+        self.ahead = ahead
+        self._pool = ThreadPoolExecutor(
+            max_workers=PREFETCH_WORKERS, thread_name_prefix="sxm-prefetch"
+        )
+        self._warming = OrderedDict()
+        self._log = logging.getLogger("sxm_discord.prefetch")
+
+    def prefetch(self, paths: Iterable[Optional[str]]) -> None:
+        """Starts warming the first `ahead` of `paths`"""
+
+        count = 0
+        for path in paths:
+            if count >= self.ahead:
+                break
+            if path is None:
+                continue
+
+            count += 1
+            if path in self._warming:
+                continue
+
+            self._log.debug(f"prefetching {path}")
+            self._warming[path] = self._pool.submit(warm_file, path)
+            while len(self._warming) > MAX_TRACKED:
+                self._warming.popitem(last=False)
+
+    def track_started(self, path: str) -> bool:
+        """Records if a track that just started was prefetched"""
+
+        future = self._warming.pop(path, None)
+        if (
+            future is not None
+            and future.done()
+            and not future.cancelled()
+            and future.exception() is None
+        ):
+            self.hits += 1
+            self._log.debug(f"prefetch hit ({future.result():.3f}s): {path}")
+            return True
+
+        self.misses += 1
+        self._log.debug(f"prefetch miss: {path}")
+        return False
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
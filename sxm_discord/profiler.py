@@ -0,0 +1,187 @@
+"""Sampling profiler for the running worker process.
+
+A background thread samples the stacks of the selected threads with
+`sys._current_frames()` every few ms. Nothing is hooked into the profiled
+code, so it is cheap enough to run on the real load. Results are written in
+the collapsed stack format (`thread;outer;inner count`), which can be opened
+with speedscope or flamegraph.pl.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+__all__ = ["ProfileResult", "SamplingProfiler"]
+
+SAMPLE_INTERVAL = 0.005
+MAX_DEPTH = 64
+
+# returns label to profile thread under or `None` to skip it
+ThreadFilter = Callable[[threading.Thread], Optional[str]]
+
+
+def _all_threads(thread: threading.Thread) -> Optional[str]:
+    return thread.name
+
+
+def _frame_name(code) -> str:
+    filename = code.co_filename
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            filename = filename[len(path) + 1 :]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class ProfileResult:
+    """Samples of a profile, keyed by the collapsed stack"""
+
+    duration: float
+    samples: int
+    stacks: Counter
+
+    def __init__(self, stacks: Counter, samples: int, duration: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def get_top(self, limit: int = 10) -> List[Tuple[str, int, int]]:
+        """Returns (frame, self samples, total samples) of the busiest frames"""
+
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if len(frames) == 0:
+                continue
+
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+        return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+    def summary(self, limit: int = 10) -> str:
+        from tabulate import tabulate
+
+        threads: Counter = Counter()
+        for stack, count in self.stacks.items():
+            threads[stack.split(";", 1)[0]] += count
+
+        lines = [
+            f"{self.samples} samples over {self.duration:.1f}s",
+            tabulate(threads.most_common(), headers=["Thread", "Samples"]),
+            "",
+            tabulate(
+                [
+                    (
+                        frame,
+                        f"{own / self.samples:.1%}" if self.samples else "-",
+                        f"{total / self.samples:.1%}" if self.samples else "-",
+                    )
+                    for frame, own, total in self.get_top(limit)
+                ],
+                headers=["Frame", "Self", "Total"],
+            ),
+        ]
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """Samples stacks of the threads `thread_filter` picks"""
+
+    interval: float
+    running: bool = False
+
+    _names: Dict[object, str]
+    _stacks: Counter
+    _samples: int = 0
+    _started: float = 0
+    _stop: threading.Event
+    _thread: Optional[threading.Thread] = None
+
+    def __init__(
+        self,
+        thread_filter: ThreadFilter = _all_threads,
+        interval: float = SAMPLE_INTERVAL,
+    ):
+        self.interval = interval
+        self._thread_filter = thread_filter
+        self._names = {}
+        self._stacks = Counter()
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if self.running:
+            raise RuntimeError("profiler is already running")
+
+        self.running = True
+        self._samples = 0
+        self._stacks = Counter()
+        self._stop.clear()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name="sxm-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.running = False
+
+        return ProfileResult(
+            self._stacks, self._samples, time.monotonic() - self._started
+        )
+
+    def _get_threads(self) -> Dict[int, str]:
+        threads: Dict[int, str] = {}
+        for thread in threading.enumerate():
+            if thread is self._thread or thread.ident is None:
+                continue
+
+            label = self._thread_filter(thread)
+            if label is not None:
+                threads[thread.ident] = label
+        return threads
+
+    def _run(self) -> None:
+        # new voice players start with each song, so look for them again
+        # every so often instead of on each sample
+        threads = self._get_threads()
+        next_refresh = time.monotonic() + 1
+
+        while not self._stop.wait(self.interval):
+            if time.monotonic() > next_refresh:
+                threads = self._get_threads()
+                next_refresh = time.monotonic() + 1
+
+            frames = sys._current_frames()
+            for ident, label in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+
+                names: List[str] = []
+                while frame is not None and len(names) < MAX_DEPTH:
+                    code = frame.f_code
+                    name = self._names.get(code)
+                    if name is None:
+                        name = self._names[code] = _frame_name(code)
+                    names.append(name)
+                    frame = frame.f_back
+
+                names.append(label)
+                self._stacks[";".join(reversed(names))] += 1
+                self._samples += 1
+            del frames
@@ -0,0 +1,137 @@
+"""Records the events the Discord worker gets from `sxm-player`.
+
+Events are written as gzipped JSON lines with the time they were received,
+so a recording can be played back into a worker later with
+`sxm_discord.debug.replay`. Datetimes, timedeltas and tuples in the payloads
+are tagged so they decode back to the same types.
+"""
+
+import gzip
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import IO, Any, Iterator, List, NamedTuple, Optional
+
+from sxm_player.queue import EventMessage, EventTypes
+
+__all__ = ["EventRecorder", "RecordedEvent", "load_recording", "read_recording"]
+
+SNAPSHOT_SOURCE = "snapshot"
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"__timedelta__": value.total_seconds()}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if "__datetime__" in value:
+                return datetime.fromisoformat(value["__datetime__"])
+            if "__timedelta__" in value:
+                return timedelta(seconds=value["__timedelta__"])
+            if "__tuple__" in value:
+                return tuple(_decode(v) for v in value["__tuple__"])
+        return {k: _decode(v) for k, v in value.items()}
+    return value
+
+
+class RecordedEvent(NamedTuple):
+    # seconds since the recording started
+    offset: float
+    queue: str
+    event: EventMessage
+
+
+class EventRecorder:
+    """Appends received events to a gzipped JSON lines file"""
+
+    path: str
+    count: int = 0
+
+    _file: Optional[IO[str]]
+    _start: float
+
+    def __init__(self, path: str):
+        self.path = path
+        self._start = time.monotonic()
+        self._file = gzip.open(path, "wt", encoding="utf8")
+        self._log = logging.getLogger("sxm_discord.recorder")
+        self._log.info(f"recording events to {path}")
+
+    def record(self, queue: str, event: EventMessage) -> None:
+        if self._file is None:
+            return
+
+        line = {
+            "t": round(time.monotonic() - self._start, 4),
+            "q": queue,
+            "src": event.msg_src,
+            "relay": event.msg_relay,
+            "type": event.msg_type.name,
+            "msg": _encode(event.msg),
+        }
+        self._file.write(json.dumps(line, separators=(",", ":")) + "\n")
+        self.count += 1
+
+    def record_state(self, sxm_running: bool, channels, raw_live) -> None:
+        """Records the state the worker started with as events"""
+
+        for msg_type, msg in (
+            (EventTypes.SXM_STATUS, sxm_running),
+            (EventTypes.UPDATE_CHANNELS, channels),
+            (EventTypes.UPDATE_METADATA, raw_live),
+        ):
+            self.record(SNAPSHOT_SOURCE, EventMessage(SNAPSHOT_SOURCE, msg_type, msg))
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._log.info(f"recorded {self.count} events to {self.path}")
+
+
+def read_recording(path: str) -> Iterator[RecordedEvent]:
+    """Reads events of a recording. Recordings that were not closed, like
+    when the bot crashed, are read up to the last event that was flushed."""
+
+    with gzip.open(path, "rt", encoding="utf8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    # event was only partly flushed
+                    break
+
+                data = json.loads(line)
+                event = EventMessage(
+                    data["src"],
+                    EventTypes[data["type"]],
+                    _decode(data["msg"]),
+                    msg_relay=data["relay"],
+                )
+                yield RecordedEvent(data["t"], data["q"], event)
+        except EOFError:
+            logging.getLogger("sxm_discord.recorder").warning(
+                f"{path} was not closed, read up to the last flushed event"
+            )
+
+
+def load_recording(path: str) -> List[RecordedEvent]:
+    return list(read_recording(path))
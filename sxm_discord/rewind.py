@@ -0,0 +1,258 @@
+"""Rewind buffer for the live stream.
+
+The Opus packets FFmpeg encodes for the live channel are copied into a fixed
+size, memory-mapped ring file and indexed by radio time, so recently aired
+cuts can be played again without decoding or re-encoding anything.
+"""
+
+import mmap
+import tempfile
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from discord import AudioSource, FFmpegOpusAudio
+
+__all__ = [
+    "RecordingOpusAudio",
+    "RewindAudio",
+    "RewindBuffer",
+    "create_rewind_buffer",
+]
+
+# length of a Opus frame sent to Discord
+FRAME_MS = 20
+# 128 kbps Opus plus some slack for packet sizes. Channels with a higher
+# bitrate profile keep less time in the same size buffer
+BYTES_PER_SECOND = 20_000
+
+Clock = Callable[[], Optional[datetime]]
+
+
+def to_ms(value: datetime) -> int:
+    return int(value.timestamp() * 1000)
+
+
+class RewindBuffer:
+    """Ring file of Opus packets indexed by radio time (in ms).
+
+    Packets are written back to back and wrap to the start of the file once
+    they do not fit anymore, evicting the oldest packets. Written from the
+    Discord audio thread, so all access is behind a lock.
+    """
+
+    channel_id: Optional[str] = None
+    max_ms: int
+    size: int
+
+    _clock: Clock
+    _lock: threading.Lock
+    _map: mmap.mmap
+    _write_pos: int = 0
+    _next_ms: Optional[int] = None
+
+    # index of packets, oldest first. `_first` is the first live entry so
+    # evicting does not have to shift the lists on every packet
+    _first: int = 0
+    _times: List[int]
+    _offsets: List[int]
+    _lengths: List[int]
+
+    def __init__(self, size: int, max_seconds: int, clock: Clock):
+        self.size = size
+        self.max_ms = max_seconds * 1000
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self._file = tempfile.TemporaryFile(prefix="sxm-discord-rewind-")
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+        self._times = []
+        self._offsets = []
+        self._lengths = []
+
+    def __len__(self) -> int:
+        return len(self._times) - self._first
+
+    @property
+    def start(self) -> Optional[int]:
+        if len(self) == 0:
+            return None
+        return self._times[self._first]
+
+    @property
+    def end(self) -> Optional[int]:
+        if len(self) == 0:
+            return None
+        return self._times[-1] + FRAME_MS
+
+    def close(self) -> None:
+        with self._lock:
+            self._map.close()
+            self._file.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self.channel_id = None
+        self._next_ms = None
+        self._write_pos = 0
+        self._first = 0
+        self._times = []
+        self._offsets = []
+        self._lengths = []
+
+    def start_recording(self, channel_id: str) -> bool:
+        """Anchors the next recorded packet to the current radio time"""
+
+        radio_time = self._clock()
+        if radio_time is None:
+            return False
+
+        now_ms = to_ms(radio_time)
+        with self._lock:
+            end = self.end
+            if channel_id != self.channel_id or (end is not None and now_ms < end):
+                self._clear()
+                self.channel_id = channel_id
+            self._next_ms = now_ms
+        return True
+
+    def stop_recording(self) -> None:
+        with self._lock:
+            self._next_ms = None
+
+    def record(self, packet: bytes) -> None:
+        length = len(packet)
+        if self._next_ms is None or length == 0 or length > self.size:
+            return
+
+        with self._lock:
+            if self._next_ms is None:
+                return
+
+            packet_ms = self._next_ms
+            self._next_ms += FRAME_MS
+
+            if self._write_pos + length > self.size:
+                # the rest of the file is skipped, so drop packets stored there
+                self._evict_from(self._write_pos)
+                self._write_pos = 0
+            self._evict_overlapping(self._write_pos, self._write_pos + length)
+            self._evict_before(packet_ms - self.max_ms)
+
+            self._map[self._write_pos : self._write_pos + length] = packet
+            self._times.append(packet_ms)
+            self._offsets.append(self._write_pos)
+            self._lengths.append(length)
+            self._write_pos += length
+
+            if self._first > 4096 and self._first * 2 > len(self._times):
+                self._compact()
+
+    def _evict_from(self, offset: int) -> None:
+        while self._first < len(self._times) and self._offsets[self._first] >= offset:
+            self._first += 1
+
+    def _evict_overlapping(self, start: int, end: int) -> None:
+        while (
+            self._first < len(self._times)
+            and self._offsets[self._first] < end
+            and self._offsets[self._first] + self._lengths[self._first] > start
+        ):
+            self._first += 1
+
+    def _evict_before(self, packet_ms: int) -> None:
+        while self._first < len(self._times) and self._times[self._first] < packet_ms:
+            self._first += 1
+
+    def _compact(self) -> None:
+        del self._times[: self._first]
+        del self._offsets[: self._first]
+        del self._lengths[: self._first]
+        self._first = 0
+
+    def contains(self, packet_ms: int) -> bool:
+        with self._lock:
+            start, end = self.start, self.end
+            return start is not None and start <= packet_ms < end  # type: ignore
+
+    def read(self, packet_ms: int) -> Optional[Tuple[int, bytes]]:
+        """Returns time and data of first packet at or after `packet_ms`"""
+
+        with self._lock:
+            index = bisect_left(self._times, packet_ms, lo=self._first)
+            if index >= len(self._times):
+                return None
+
+            offset = self._offsets[index]
+            return (
+                self._times[index],
+                self._map[offset : offset + self._lengths[index]],
+            )
+
+    def iter_packets(self, start_ms: int, end_ms: int) -> Iterator[bytes]:
+        """Yields the packets recorded in `[start_ms, end_ms)`"""
+
+        packet_ms = start_ms
+        while True:
+            packet = self.read(packet_ms)
+            if packet is None or packet[0] >= end_ms:
+                return
+            yield packet[1]
+            packet_ms = packet[0] + FRAME_MS
+
+
+def create_rewind_buffer(minutes: int, clock: Clock) -> Optional[RewindBuffer]:
+    if minutes <= 0:
+        return None
+
+    seconds = minutes * 60
+    return RewindBuffer(seconds * BYTES_PER_SECOND, seconds, clock)
+
+
+class RecordingOpusAudio(FFmpegOpusAudio):
+    """`FFmpegOpusAudio` that copies every packet into a `RewindBuffer`"""
+
+    def __init__(self, *args, rewind: RewindBuffer, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rewind = rewind
+
+    def read(self) -> bytes:
+        packet = super().read()
+        self._rewind.record(packet)
+        return packet
+
+    def cleanup(self) -> None:
+        self._rewind.stop_recording()
+        super().cleanup()
+
+
+class RewindAudio(AudioSource):
+    """Plays `[start_ms, end_ms)` of radio time from a `RewindBuffer`.
+
+    Packets are already Opus encoded, so they are sent as is.
+    """
+
+    def __init__(self, rewind: RewindBuffer, start_ms: int, end_ms: int):
+        self._rewind = rewind
+        self._next_ms = start_ms
+        self._end_ms = end_ms
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        if self._next_ms >= self._end_ms:
+            return b""
+
+        packet = self._rewind.read(self._next_ms)
+        if packet is None or packet[0] >= self._end_ms:
+            return b""
+
+        self._next_ms = packet[0] + FRAME_MS
+        return packet[1]
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+__all__ = ["PlayerCommandSerializer", "SUPERSEDES"]
+
+# pending operations that are pointless once a operation of the key is queued
+SUPERSEDES: Dict[str, Tuple[str, ...]] = {
+    "play": ("play", "add_file", "replay", "reset_live", "resume_live"),
+    "stop": ("play", "add_file", "replay", "skip", "reset_live", "resume_live"),
+    "reset": (
+        "play",
+        "add_file",
+        "replay",
+        "skip",
+        "stop",
+        "reset_live",
+        "resume_live",
+    ),
+    "replay": ("replay",),
+    "reset_live": ("reset_live", "resume_live"),
+}
+
+
+class PlayerOperation:
+    __slots__ = ("name", "superseded")
+
+    name: str
+    superseded: bool
+
+    def __init__(self, name: str):
+        self.name = name
+        self.superseded = False
+
+
+class PlayerCommandSerializer:
+    """Runs operations that change the `AudioPlayer` one at a time per guild.
+
+    Queued operations that have not started yet are dropped by a newer
+    operation that supersedes them (see `SUPERSEDES`), so three quick channel
+    switches only start the first one and the last one.
+    """
+
+    executed: Counter
+    superseded: Counter
+    max_depth: int = 0
+
+    _locks: Dict[int, asyncio.Lock]
+    _pending: Dict[int, List[PlayerOperation]]
+    _running: Dict[int, PlayerOperation]
+
+    def __init__(self):
+        self.executed = Counter()
+        self.superseded = Counter()
+
+        self._locks = {}
+        self._pending = {}
+        self._running = {}
+        self._log = logging.getLogger("sxm_discord.serializer")
+
+    def depth(self, guild_id: int) -> int:
+        """Number of operations waiting or running for guild"""
+
+        running = 1 if guild_id in self._running else 0
+        return len(self._pending.get(guild_id, [])) + running
+
+    @property
+    def depths(self) -> Dict[int, int]:
+        guild_ids = set(self._pending.keys()) | set(self._running.keys())
+        return {guild_id: self.depth(guild_id) for guild_id in guild_ids}
+
+    async def run(
+        self,
+        guild_id: int,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+    ) -> bool:
+        """Runs `func` after all earlier operations for the guild.
+
+        Returns `False` if a newer operation superseded it before it started.
+        """
+
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        pending = self._pending.setdefault(guild_id, [])
+
+        supersedes = SUPERSEDES.get(name, ())
+        for other in list(pending):
+            if other.name in supersedes:
+                self._log.debug(f"{name} superseded pending {other.name}")
+                other.superseded = True
+                pending.remove(other)
+
+        operation = PlayerOperation(name)
+        pending.append(operation)
+        self.max_depth = max(self.max_depth, self.depth(guild_id))
+
+        async with lock:
+            if operation.superseded:
+                self.superseded[name] += 1
+                return False
+
+            pending.remove(operation)
+            self._running[guild_id] = operation
+            try:
+                await func()
+            finally:
+                del self._running[guild_id]
+                self.executed[name] += 1
+        return True
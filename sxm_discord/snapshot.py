@@ -0,0 +1,98 @@
+"""Compact copy of the runner's `PlayerState` for the Discord worker.
+
+This module must not import `discord` or `pydantic` models since it is used by
+the runner process while creating the worker.
+"""
+
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover
+    from sxm_player.models import PlayerState
+
+__all__ = ["StateSnapshot"]
+
+RawLiveData = Tuple[Optional[datetime], Optional[timedelta], Optional[dict]]
+
+
+def _encode(value: Any) -> Optional[bytes]:
+    if value is None:
+        return None
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf8"))
+
+
+def _decode(value: Optional[bytes]) -> Any:
+    if value is None:
+        return None
+    return json.loads(zlib.decompress(value).decode("utf8"))
+
+
+class StateSnapshot:
+    """Channel list and live metadata as compressed JSON.
+
+    Much smaller to hand across the process boundary than the raw dicts and
+    nothing is decoded until the worker actually asks for it.
+    """
+
+    __slots__ = ("_channels", "_live", "start_time", "time_offset")
+
+    _channels: Optional[bytes]
+    _live: Optional[bytes]
+    start_time: Optional[datetime]
+    time_offset: Optional[timedelta]
+
+    def __init__(
+        self,
+        channels: Optional[List[dict]] = None,
+        raw_live_data: RawLiveData = (None, None, None),
+    ):
+        self._channels = _encode(channels)
+        self._live = _encode(raw_live_data[2])
+        self.start_time = raw_live_data[0]
+        self.time_offset = raw_live_data[1]
+
+    def __getstate__(self):
+        return (self._channels, self._live, self.start_time, self.time_offset)
+
+    def __setstate__(self, state):
+        self._channels, self._live, self.start_time, self.time_offset = state
+
+    @classmethod
+    def from_state(cls, state: "PlayerState") -> "StateSnapshot":
+        return cls(state.get_raw_channels(), state.get_raw_live())
+
+    @property
+    def has_channels(self) -> bool:
+        return self._channels is not None
+
+    @property
+    def has_live(self) -> bool:
+        return self._live is not None
+
+    @property
+    def size(self) -> int:
+        """Size in bytes of the compressed payloads"""
+
+        return len(self._channels or b"") + len(self._live or b"")
+
+    def pop_channels(self) -> Optional[List[dict]]:
+        """Decodes the channel list and drops it from the snapshot"""
+
+        channels = _decode(self._channels)
+        self._channels = None
+        return channels
+
+    def pop_live(self) -> RawLiveData:
+        """Decodes the live metadata and drops it from the snapshot"""
+
+        live = _decode(self._live)
+        self._live = None
+        return (self.start_time, self.time_offset, live)
+
+    def discard_channels(self) -> None:
+        self._channels = None
+
+    def discard_live(self) -> None:
+        self._live = None
@@ -0,0 +1,133 @@
+import time
+from typing import List, Optional, Union
+
+from pydantic import PrivateAttr  # pylint: disable=no-name-in-module
+from sxm.models import XMChannel, XMLiveChannel
+from sxm_player.models import PlayerState
+
+from sxm_discord.channels import ChannelIndex
+from sxm_discord.snapshot import RawLiveData, StateSnapshot
+from sxm_discord.timeline import LiveTimeline
+
+__all__ = ["DiscordPlayerState"]
+
+
+class DiscordPlayerState(PlayerState):
+    """`PlayerState` for the Discord worker.
+
+    Channels and live metadata can be loaded from a `StateSnapshot` and are
+    only decoded the first time they are used.
+    """
+
+    _snapshot: Optional[StateSnapshot] = PrivateAttr(None)
+    _channel_index: Optional[ChannelIndex] = PrivateAttr(None)
+    _channels_version: int = PrivateAttr(0)
+    _timeline: Optional[LiveTimeline] = PrivateAttr(None)
+
+    def load_snapshot(self, snapshot: StateSnapshot) -> None:
+        self._snapshot = snapshot
+        self._start_time = snapshot.start_time
+        self._time_offset = snapshot.time_offset
+
+    def _load_snapshot_channels(self) -> None:
+        if self._snapshot is not None and self._snapshot.has_channels:
+            channels = self._snapshot.pop_channels()
+            # do not go through `update_channels`, it resets `stream_data`
+            self._channels = None
+            self._channels_lookup_cache = {}
+            self._raw_channels = channels
+
+    def _load_snapshot_live(self) -> None:
+        if self._snapshot is not None and self._snapshot.has_live:
+            live_data = self._snapshot.pop_live()
+            super().set_raw_live(live_data)
+
+    @property
+    def channels(self) -> List[XMChannel]:
+        self._load_snapshot_channels()
+        return super().channels
+
+    @property
+    def channels_version(self) -> int:
+        """Incremented every time the channel list changes"""
+
+        return self._channels_version
+
+    @property
+    def channel_index(self) -> ChannelIndex:
+        """`ChannelIndex` for the current list of channels"""
+
+        if self._channel_index is None:
+            self._channel_index = ChannelIndex(
+                self.channels, version=self._channels_version
+            )
+        return self._channel_index
+
+    def update_channels(self, value: Optional[List[dict]]) -> None:
+        if self._snapshot is not None:
+            self._snapshot.discard_channels()
+        super().update_channels(value)
+        self._channel_index = None
+        self._channels_version += 1
+
+    def get_channel(self, name: str) -> Optional[XMChannel]:
+        return self.channel_index.get(name)
+
+    def find_channel(self, name: str) -> Optional[XMChannel]:
+        """Like `get_channel`, but falls back to a fuzzy match of the name"""
+
+        return self.channel_index.find(name)
+
+    def get_raw_channels(self) -> Optional[List[dict]]:
+        self._load_snapshot_channels()
+        return super().get_raw_channels()
+
+    @property
+    def is_connected(self) -> bool:
+        if self._snapshot is None or not self._snapshot.has_channels:
+            return super().is_connected
+
+        # channels of the snapshot are not decoded just to check they exist,
+        # resets the failures like `PlayerState.is_connected`
+        if time.monotonic() - self._last_failure > 300:
+            self._failures = 0
+        return True
+
+    @property
+    def live(self) -> Union[XMLiveChannel, None]:
+        self._load_snapshot_live()
+        return super().live
+
+    @property
+    def timeline(self) -> Optional[LiveTimeline]:
+        """`LiveTimeline` of the cuts and episodes for the live channel"""
+
+        live = self.live
+        if live is None:
+            return None
+
+        if self._timeline is None:
+            self._timeline = LiveTimeline(live)
+        return self._timeline
+
+    def _update_timeline(self) -> None:
+        if self._live is None:
+            self._timeline = None
+        elif self._timeline is not None:
+            self._timeline.update(self._live)
+
+    def update_live(self, value: dict) -> None:
+        if self._snapshot is not None:
+            self._snapshot.discard_live()
+        super().update_live(value)
+        self._update_timeline()
+
+    def get_raw_live(self) -> RawLiveData:
+        self._load_snapshot_live()
+        return super().get_raw_live()
+
+    def set_raw_live(self, live_data: RawLiveData):
+        if self._snapshot is not None:
+            self._snapshot.discard_live()
+        super().set_raw_live(live_data)
+        self._update_timeline()
@@ -1,31 +1,120 @@
 import asyncio
 import logging
-import os
 import traceback
-from typing import List, Optional, Tuple, Union
+from functools import partial
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
-from discord import VoiceChannel
+from discord import File, HTTPException, VoiceChannel
 from discord.ext.commands import BadArgument, Context
 from discord_slash import SlashContext, cog_ext  # type: ignore
 from discord_slash.utils.manage_commands import create_option  # type: ignore
 from sqlalchemy import or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query, Session
 from sxm.models import XMChannel
-from sxm_player.models import DBEpisode, DBSong, Episode, PlayerState, Song
-from tabulate import tabulate
-
+from sxm_player.models import DBEpisode, DBSong, Episode, Song
+
+from sxm_discord.autocomplete import (
+    MAX_CHOICE_LENGTH,
+    AutocompleteHandler,
+    Choice,
+    PrefixIndex,
+    build_channel_index,
+    build_episode_index,
+    build_song_index,
+    create_autocomplete_option,
+)
 from sxm_discord.checks import require_sxm, require_voice
 from sxm_discord.converters import XMChannelConverter, XMChannelListConverter
+from sxm_discord.execution import deferrable
+from sxm_discord.manifest import ArchiveManifest
 from sxm_discord.models import ArchivedSongCarousel, ReactionCarousel
 from sxm_discord.music import AudioPlayer
-from sxm_discord.utils import get_root_command, send_message
+from sxm_discord.serializer import PlayerCommandSerializer
+from sxm_discord.state import DiscordPlayerState
+from sxm_discord.tracing import run_in_executor
+from sxm_discord.utils import get_root_command, paginate_lines, send_message
 
 
 class SXMCommands:
     _log: logging.Logger
 
     player: AudioPlayer
-    _state: PlayerState
+    player_commands: PlayerCommandSerializer
+    archive_manifest: Optional[ArchiveManifest] = None
+    _state: DiscordPlayerState
     _pending: Optional[Tuple[XMChannel, VoiceChannel]] = None
+    _channel_choices: Optional[Tuple[int, PrefixIndex]] = None
+    _channel_table: Optional[Tuple[int, bytes, List[str]]] = None
+
+    def get_autocomplete_handlers(self) -> Dict[str, AutocompleteHandler]:
+        return {"channel": self._autocomplete_channel}
+
+    async def refresh_indexes(self) -> None:
+        """Rebuilds in-memory indexes that are backed by the archive"""
+
+    def _is_playable(self, file_path: Optional[str]) -> bool:
+        """If archive file exists, according to the `archive_manifest`"""
+
+        if self.archive_manifest is None:
+            return file_path is not None
+        return self.archive_manifest.is_playable(file_path)
+
+    def _get_channel_choices(self) -> PrefixIndex:
+        channel_index = self._state.channel_index
+        if (
+            self._channel_choices is None
+            or self._channel_choices[0] != channel_index.version
+        ):
+            self._channel_choices = (
+                channel_index.version,
+                build_channel_index(channel_index),
+            )
+        return self._channel_choices[1]
+
+    def _autocomplete_channel(self, value: str) -> List[Choice]:
+        return self._get_channel_choices().search(value)
+
+    def _get_channel_table(self) -> Tuple[bytes, List[str]]:
+        """Returns rendered channel table and it split into message pages"""
+
+        channel_index = self._state.channel_index
+        if (
+            self._channel_table is None
+            or self._channel_table[0] != channel_index.version
+        ):
+            # only needed for this command, so do not load it with the bot
+            from tabulate import tabulate
+
+            display_channels: List[Tuple[str, int, str, str]] = [
+                (
+                    channel.id,
+                    int(channel.channel_number),
+                    channel.name,
+                    channel.short_description,
+                )
+                for channel in channel_index.channels
+            ]
+            channel_table = tabulate(
+                display_channels, headers=["ID", "#", "Name", "Description"]
+            )
+            self._channel_table = (
+                channel_index.version,
+                channel_table.encode("utf8"),
+                paginate_lines(channel_table),
+            )
+        return self._channel_table[1], self._channel_table[2]
+
+    async def _run_player_command(
+        self, ctx: SlashContext, name: str, func: Callable[[], Awaitable[Any]]
+    ) -> bool:
+        """Runs a operation that changes `player` after any earlier ones"""
+
+        ran = await self.player_commands.run(ctx.guild_id or 0, name, func)
+        if not ran:
+            await send_message(ctx, "Skipped, a newer request replaced this one")
+        return ran
 
     async def _play_archive_file(
         self, ctx: Context, guid: str = None, is_song: bool = False
@@ -56,7 +145,7 @@ class SXMCommands:
                 if db_episode is not None:
                     audio_file = Episode.from_orm(db_episode)
 
-        if audio_file is not None and not os.path.exists(audio_file.file_path):
+        if audio_file is not None and not self._is_playable(audio_file.file_path):
             self._log.warn(f"File does not exist: {audio_file.file_path}")
             audio_file = None
 
@@ -71,6 +160,17 @@ class SXMCommands:
     ) -> None:
         raise NotImplementedError()
 
+    def _first_playable(
+        self, query: Query, count: int
+    ) -> List[Union[DBSong, DBEpisode]]:
+        items: List[Union[DBSong, DBEpisode]] = []
+        for item in query.yield_per(count * 2):
+            if self._is_playable(item.file_path):
+                items.append(item)
+                if len(items) >= count:
+                    break
+        return items
+
     async def _search_archive(self, ctx: Context, search: str, is_song: bool) -> None:
         """Searches song/show database and responds with results"""
 
@@ -93,9 +193,9 @@ class SXMCommands:
                         DBSong.artist.ilike(f"{search}%"),
                     )
                 )
-                .order_by(DBSong.air_time.desc())[:10]
+                .order_by(DBSong.air_time.desc())
             )
-            items = [Song.from_orm(i) for i in db_songs]
+            items = [Song.from_orm(i) for i in self._first_playable(db_songs, 10)]
         else:
             db_episodes = (
                 self._state.db.query(DBEpisode)
@@ -106,9 +206,9 @@ class SXMCommands:
                         DBEpisode.show.ilike(f"{search}%"),
                     )
                 )
-                .order_by(DBEpisode.air_time.desc())[:10]
+                .order_by(DBEpisode.air_time.desc())
             )
-            items = [Episode.from_orm(i) for i in db_episodes]
+            items = [Episode.from_orm(i) for i in self._first_playable(db_episodes, 10)]
 
         if len(items) > 0:
             message = f"{search_type.title()} matching `{search}`:"
@@ -137,14 +237,14 @@ class SXMCommands:
         subcommand_group="sxm",
         name="channel",
         options=[
-            create_option(
+            create_autocomplete_option(
                 name="channel",
                 description="SXM Channel",
-                option_type=3,
                 required=False,
             )
         ],
     )
+    @deferrable(slow=True)
     async def sxm_channel(self, ctx: SlashContext, *, channel: str) -> None:
         """Plays a specific SXM channel"""
 
@@ -157,6 +257,11 @@ class SXMCommands:
             await send_message(ctx, str(e))
             return
 
+        await self._run_player_command(
+            ctx, "play", partial(self._start_channel, ctx, xm_channel)
+        )
+
+    async def _start_channel(self, ctx: SlashContext, xm_channel: XMChannel) -> None:
         if self.player.is_playing:
             self._pending = None
             await self.player.stop(disconnect=False)
@@ -186,55 +291,104 @@ class SXMCommands:
     @cog_ext.cog_subcommand(
         base=get_root_command(), subcommand_group="sxm", name="channels"
     )
+    @deferrable()
     async def sxm_channels(self, ctx: SlashContext) -> None:
         """Bot will PM with list of possible SXM channel"""
 
         if not await require_sxm(ctx):
             return
 
-        display_channels: List[Tuple[str, int, str, str]] = []
-        for channel in self._state.channels:
-            display_channels.append(
-                (
-                    channel.id,
-                    int(channel.channel_number),
-                    channel.name,
-                    channel.short_description,
-                )
+        table, pages = self._get_channel_table()
+
+        self._log.debug(f"sending {len(self._state.channel_index)} for {ctx.author}")
+        try:
+            await ctx.author.send(
+                "SXM Channels:",
+                file=File(BytesIO(table), filename="sxm-channels.txt"),
             )
+        except HTTPException:
+            self._log.warning("could not send channels file, sending as messages")
+            await ctx.author.send("SXM Channels:")
+            for page in pages:
+                await ctx.author.send(f"```{page}```")
+
+        await send_message(ctx, "PM'd list of channels")
 
-        display_channels = sorted(display_channels, key=lambda l: l[1])
-        channel_table = tabulate(
-            display_channels, headers=["ID", "#", "Name", "Description"]
+
+class SXMArchivedCommands(SXMCommands):
+    _song_choices: Optional[PrefixIndex] = None
+    _show_choices: Optional[PrefixIndex] = None
+    _refreshing_indexes: bool = False
+
+    def get_autocomplete_handlers(self) -> Dict[str, AutocompleteHandler]:
+        handlers = super().get_autocomplete_handlers()
+        handlers.update(
+            {
+                "channels": self._autocomplete_channels,
+                "show_id": self._autocomplete_show,
+                "song_id": self._autocomplete_song,
+            }
         )
+        return handlers
 
-        self._log.debug(f"sending {len(display_channels)} for {ctx.author}")
-        await ctx.author.send("SXM Channels:")
-        await send_message(ctx, "PM'd list of channels")
-        while len(channel_table) > 0:
-            message = ""
-            if len(channel_table) < 1900:
-                message = channel_table
-                channel_table = ""
-            else:
-                index = channel_table[:1900].rfind("\n")
-                message = channel_table[:index]
-                start = index + 1
-                channel_table = channel_table[start:]
+    async def refresh_indexes(self) -> None:
+        if self._state.db is None or self._refreshing_indexes:
+            return
 
-            await ctx.author.send(f"```{message}```")
+        self._refreshing_indexes = True
+        try:
+            # the old indexes are used until the new ones are done
+            self._song_choices, self._show_choices = await run_in_executor(
+                self._build_archive_indexes, self._state.db.get_bind()
+            )
+        finally:
+            self._refreshing_indexes = False
 
+    def _build_archive_indexes(self, bind: Engine) -> Tuple[PrefixIndex, PrefixIndex]:
+        """Builds song and show indexes, blocking so run it in a executor"""
+
+        # the session of `_state` can not be used from another thread
+        db = Session(bind=bind)
+        try:
+            return (
+                build_song_index(db, is_playable=self._is_playable),
+                build_episode_index(db, is_playable=self._is_playable),
+            )
+        finally:
+            db.close()
+
+    def _autocomplete_channels(self, value: str) -> List[Choice]:
+        # only complete the last channel in the comma separated list
+        head, _, last = value.rpartition(",")
+        if head != "":
+            head += ","
+
+        return [
+            (
+                f"{head}{name}"[:MAX_CHOICE_LENGTH],
+                f"{head}{channel_id}"[:MAX_CHOICE_LENGTH],
+            )
+            for name, channel_id in self._get_channel_choices().search(last)
+        ]
+
+    def _autocomplete_show(self, value: str) -> List[Choice]:
+        if self._show_choices is None:
+            return []
+        return self._show_choices.search(value)
+
+    def _autocomplete_song(self, value: str) -> List[Choice]:
+        if self._song_choices is None:
+            return []
+        return self._song_choices.search(value)
 
-class SXMArchivedCommands(SXMCommands):
     @cog_ext.cog_subcommand(
         base=get_root_command(),
         subcommand_group="sxm",
         name="playlist",
         options=[
-            create_option(
+            create_autocomplete_option(
                 name="channels",
                 description="SXM Channels to pick from",
-                option_type=3,
                 required=True,
             ),
             create_option(
@@ -245,6 +399,7 @@ class SXMArchivedCommands(SXMCommands):
             ),
         ],
     )
+    @deferrable(slow=True)
     async def sxm_playlist(
         self,
         ctx: SlashContext,
@@ -265,16 +420,51 @@ class SXMArchivedCommands(SXMCommands):
         if self._state.db is None:
             return
 
-        channel_ids = [x.id for x in xm_channels]
-        unique_songs_query = self._state.db.query(DBSong.title, DBSong.artist).filter(
-            DBSong.channel.in_(channel_ids)
+        unique_songs = await run_in_executor(
+            self._count_playable_songs,
+            self._state.db.get_bind(),
+            [x.id for x in xm_channels],
+            threshold,
         )
-        unique_songs = unique_songs_query.distinct().all()
 
-        if len(unique_songs) < threshold:
+        if unique_songs < threshold:
             await send_message(ctx, "not enough archived songs in provided channels")
             return
 
+        await self._run_player_command(
+            ctx, "play", partial(self._start_playlist, ctx, xm_channels)
+        )
+
+    def _count_playable_songs(
+        self, bind: Engine, channel_ids: List[str], limit: int
+    ) -> int:
+        """Counts title/artists of the channels with a playable file, up to
+        `limit`. Blocking, run it in a executor."""
+
+        # the session of `_state` can not be used from another thread
+        db = Session(bind=bind)
+        try:
+            songs_query = (
+                db.query(DBSong.title, DBSong.artist, DBSong.file_path)
+                .filter(DBSong.channel.in_(channel_ids))
+                .yield_per(1000)
+            )
+            unique_songs: Set[Tuple[str, str]] = set()
+            for title, artist, file_path in songs_query:
+                if self._is_playable(file_path):
+                    unique_songs.add((title, artist))
+                    if len(unique_songs) >= limit:
+                        break
+        finally:
+            db.close()
+        return len(unique_songs)
+
+    async def _start_playlist(
+        self, ctx: SlashContext, xm_channels: List[XMChannel]
+    ) -> None:
+        if self._state.db is None:
+            return
+
         if self.player.is_playing:
             await self.player.stop(disconnect=False)
             await asyncio.sleep(0.5)
@@ -282,7 +472,9 @@ class SXMArchivedCommands(SXMCommands):
             await self._summon(ctx)
 
         try:
-            await self.player.add_playlist(xm_channels, self._state.db)
+            await self.player.add_playlist(
+                xm_channels, self._state.db, is_playable=self._is_playable
+            )
         except Exception:
             self._log.error("error while trying to create playlist:")
             self._log.error(traceback.format_exc())
@@ -314,14 +506,14 @@ class SXMArchivedCommands(SXMCommands):
         subcommand_group="sxm",
         name="show",
         options=[
-            create_option(
+            create_autocomplete_option(
                 name="show_id",
                 description="Show GUID",
-                option_type=3,
                 required=True,
             )
         ],
     )
+    @deferrable()
     async def sxm_show(self, ctx: SlashContext, show_id: Optional[str] = None) -> None:
         """Adds a show to a play queue"""
 
@@ -340,6 +532,7 @@ class SXMArchivedCommands(SXMCommands):
             )
         ],
     )
+    @deferrable()
     async def sxm_shows(self, ctx: SlashContext, search: str) -> None:
         """Searches for an archived show to play.
         Only returns the first 10 shows"""
@@ -351,14 +544,14 @@ class SXMArchivedCommands(SXMCommands):
         subcommand_group="sxm",
         name="song",
         options=[
-            create_option(
+            create_autocomplete_option(
                 name="song_id",
                 description="Song GUID",
-                option_type=3,
                 required=True,
             )
         ],
     )
+    @deferrable()
     async def sxm_song(self, ctx: SlashContext, song_id: str) -> None:
         """Adds a song to a play queue"""
 
@@ -377,6 +570,7 @@ class SXMArchivedCommands(SXMCommands):
             )
         ],
     )
+    @deferrable()
     async def sxm_songs(self, ctx: SlashContext, search: str) -> None:
         """Searches for an archived song to play.
         Only returns the first 10 songs"""
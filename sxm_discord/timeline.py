@@ -0,0 +1,130 @@
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Generic, Iterator, List, Optional, Sequence, TypeVar
+
+from sxm.models import XMCutMarker, XMEpisodeMarker, XMLiveChannel, XMMarker
+
+__all__ = ["LiveTimeline"]
+
+MAX_MARKERS = 1000
+
+MarkerType = TypeVar("MarkerType", bound=XMMarker)
+
+
+def _to_seconds(now: Optional[datetime]) -> int:
+    if now is None:
+        now = datetime.now(timezone.utc)
+    return int(now.timestamp())
+
+
+class MarkerIndex(Generic[MarkerType]):
+    """Time sorted list of markers with a cursor for the current marker"""
+
+    markers: List[MarkerType]
+
+    _times: List[int]
+    _cursor: int = -1
+
+    def __init__(self):
+        self.markers = []
+        self._times = []
+
+    def __len__(self) -> int:
+        return len(self.markers)
+
+    def merge(self, markers: Sequence[MarkerType]) -> None:
+        """Merges in a newer, time sorted window of markers.
+
+        Everything from the start of the window on is replaced, markers
+        older than the window are kept.
+        """
+
+        if len(markers) == 0:
+            return
+
+        start = bisect_left(self._times, markers[0].time_seconds)
+        del self.markers[start:]
+        del self._times[start:]
+
+        self.markers.extend(markers)
+        self._times.extend(m.time_seconds for m in markers)
+
+        if len(self.markers) > MAX_MARKERS:
+            del self.markers[:-MAX_MARKERS]
+            del self._times[:-MAX_MARKERS]
+
+    def index_before(self, now_sec: int) -> int:
+        """Returns index of the last marker before `now_sec` or -1"""
+
+        times = self._times
+        index = self._cursor
+        total = len(times)
+
+        # radio time only moves forward, so check the cursor and the marker
+        # after it before falling back to a binary search
+        for _ in range(2):
+            if 0 <= index < total and times[index] < now_sec:
+                if index + 1 == total or times[index + 1] >= now_sec:
+                    self._cursor = index
+                    return index
+            index += 1
+
+        index = bisect_left(times, now_sec) - 1
+        self._cursor = index
+        return index
+
+    def latest(self, now: Optional[datetime] = None) -> Optional[MarkerType]:
+        index = self.index_before(_to_seconds(now))
+        if index < 0:
+            return None
+        return self.markers[index]
+
+
+class LiveTimeline:
+    """Time sorted index of the cuts and episodes of the live channel.
+
+    Kept up to date from every `UPDATE_METADATA` so looking up the current cut
+    or episode is a `O(log n)` search instead of a scan of every marker.
+    """
+
+    channel_id: Optional[str] = None
+    cuts: MarkerIndex[XMCutMarker]
+    song_cuts: MarkerIndex[XMCutMarker]
+    episodes: MarkerIndex[XMEpisodeMarker]
+
+    def __init__(self, live: Optional[XMLiveChannel] = None):
+        self.reset()
+        if live is not None:
+            self.update(live)
+
+    def reset(self) -> None:
+        self.channel_id = None
+        self.cuts = MarkerIndex()
+        self.song_cuts = MarkerIndex()
+        self.episodes = MarkerIndex()
+
+    def update(self, live: XMLiveChannel) -> None:
+        if live.id != self.channel_id:
+            self.reset()
+            self.channel_id = live.id
+
+        self.cuts.merge(live.cut_markers)
+        self.song_cuts.merge(live.song_cuts)
+        self.episodes.merge(live.episode_markers)
+
+    def get_latest_cut(self, now: Optional[datetime] = None) -> Optional[XMCutMarker]:
+        return self.cuts.latest(now)
+
+    def get_latest_episode(
+        self, now: Optional[datetime] = None
+    ) -> Optional[XMEpisodeMarker]:
+        return self.episodes.latest(now)
+
+    def iter_song_cuts_before(
+        self, now: Optional[datetime] = None
+    ) -> Iterator[XMCutMarker]:
+        """Yields the song cuts that started before `now`, latest first"""
+
+        markers = self.song_cuts.markers
+        for index in range(self.song_cuts.index_before(_to_seconds(now) + 1), -1, -1):
+            yield markers[index]
@@ -0,0 +1,363 @@
+"""Lightweight tracing spans for slash commands and what they wait on.
+
+The current span is kept in a `ContextVar`, so spans started inside of a
+command (checks, DB queries, REST calls, the audio player) become children of
+the command span, even across tasks. Blocking code run with `run_in_executor`
+keeps the current span as well. Finished spans are buffered and written in
+batches by a `SpanExporter`. Without a exporter, `span` does nothing.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar, Token, copy_context
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+__all__ = [
+    "JSONLExporter",
+    "OTLPExporter",
+    "Span",
+    "SpanExporter",
+    "run_in_executor",
+    "trace_db",
+    "trace_http",
+    "traced",
+    "tracer",
+]
+
+FLUSH_INTERVAL = 5.0
+# spans are dropped if the exporter cannot keep up
+MAX_BUFFERED = 10000
+MAX_STATEMENT = 200
+SERVICE_NAME = "sxm-discord"
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar(
+    "sxm_discord_span", default=None
+)
+_log = logging.getLogger("sxm_discord.tracing")
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+        "_token",
+    )
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int]
+    attributes: Dict[str, Any]
+    error: Optional[str]
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = _new_id(8)
+        if parent is None:
+            self.trace_id = _new_id(16)
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        self._token: Optional[Token] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tracer.finish(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end(exc)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start_ns / 1e9,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NullSpan(Span):
+    """Returned by `Tracer.span` while tracing is disabled"""
+
+    def __init__(self):
+        pass
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class SpanExporter:
+    async def export(self, spans: List[Span]) -> None:
+        raise NotImplementedError()
+
+
+class JSONLExporter(SpanExporter):
+    """Appends spans to a file, one JSON object per line"""
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: List[str]) -> None:
+        with open(self.path, "a") as f:
+            f.write("".join(lines))
+
+    async def export(self, spans: List[Span]) -> None:
+        lines = [json.dumps(s.to_dict(), default=str) + "\n" for s in spans]
+        await asyncio.get_event_loop().run_in_executor(None, self._write, lines)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter(SpanExporter):
+    """Sends spans to a OpenTelemetry collector with OTLP/HTTP (JSON)"""
+
+    endpoint: str
+
+    def __init__(self, endpoint: str):
+        if not endpoint.endswith("/v1/traces"):
+            endpoint = endpoint.rstrip("/") + "/v1/traces"
+        self.endpoint = endpoint
+
+    def _to_otlp(self, span: Span) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()
+            ],
+        }
+        if span.parent_id is not None:
+            data["parentSpanId"] = span.parent_id
+        if span.error is not None:
+            # STATUS_CODE_ERROR
+            data["status"] = {"code": 2, "message": span.error}
+        return data
+
+    async def export(self, spans: List[Span]) -> None:
+        import aiohttp
+
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "sxm_discord"},
+                            "spans": [self._to_otlp(s) for s in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(self.endpoint, json=payload) as response:
+                if response.status >= 400:
+                    _log.warning(
+                        f"could not export {len(spans)} spans: {response.status}"
+                    )
+
+
+class Tracer:
+    exporter: Optional[SpanExporter] = None
+    dropped: int = 0
+
+    _buffer: List[Span]
+    _flush_task: Optional[asyncio.Task] = None
+    # spans of DB queries are finished in executor threads
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start(self, exporter: SpanExporter, loop: asyncio.AbstractEventLoop) -> None:
+        self.exporter = exporter
+        self._flush_task = loop.create_task(self._flush_loop())
+
+    def span(self, name: str, **attributes) -> Span:
+        """Starts span as a child of the current span, use it with `with`"""
+
+        if self.exporter is None:
+            return _NULL_SPAN
+        return Span(name, _current_span.get(), attributes)
+
+    def finish(self, span: Span) -> None:
+        with self._lock:
+            if len(self._buffer) >= MAX_BUFFERED:
+                self.dropped += 1
+                return
+            self._buffer.append(span)
+
+    async def flush(self) -> None:
+        if self.exporter is None:
+            return
+
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if len(spans) == 0:
+            return
+
+        try:
+            await self.exporter.export(spans)
+        except Exception:
+            _log.exception(f"could not export {len(spans)} spans")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+
+tracer = Tracer()
+
+AsyncFunc = TypeVar("AsyncFunc", bound=Callable[..., Any])
+T = TypeVar("T")
+
+
+def run_in_executor(func: Callable[..., T], *args) -> "asyncio.Future[T]":
+    """Runs `func` in the default executor with the current span, so spans
+    it starts (like DB queries) are children of it"""
+
+    context = copy_context()
+    return asyncio.get_event_loop().run_in_executor(None, context.run, func, *args)
+
+
+def traced(name: Optional[str] = None) -> Callable[[AsyncFunc], AsyncFunc]:
+    """Decorator that runs a coroutine function in a span"""
+
+    def decorator(func: AsyncFunc) -> AsyncFunc:
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if tracer.exporter is None:
+                return await func(*args, **kwargs)
+
+            with tracer.span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def trace_http(http) -> None:
+    """Runs every Discord REST call of `discord.http.HTTPClient` in a span"""
+
+    request = http.request
+
+    async def traced_request(route, **kwargs):
+        with tracer.span("discord.rest", method=route.method, route=route.path):
+            return await request(route, **kwargs)
+
+    http.request = traced_request
+
+
+def trace_db(engine) -> None:
+    """Runs every query of a SQLAlchemy engine in a span"""
+
+    from sqlalchemy import event
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context._sxm_span = tracer.span("db.query", statement=statement[:MAX_STATEMENT])
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_sxm_span", None)
+        if span is not None:
+            span.end()
+
+    def error(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "_sxm_span", None)
+        if span is not None:
+            span.end(exception_context.original_exception)
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", error)
@@ -1,32 +1,32 @@
-import os
+from collections import OrderedDict
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
 
 from discord import Embed, Message
 from discord.ext.commands import errors
 from discord_slash import SlashContext  # type: ignore
 from humanize import naturaltime  # type: ignore
 from sxm.models import XMArt, XMChannel, XMCutMarker, XMEpisodeMarker, XMImage, XMSong
-from sxm_player.models import Episode, PlayerState, Song
+from sxm_player.models import Episode, Song
 
-__all__ = ["send_message"]
+from .config import SXM_COG_NAME, get_root_command, set_root_command
+from .execution import get_response_lock
+from .state import DiscordPlayerState
+from .tracing import traced
 
-ROOT_COMMAND_ENV = "SXM_INTERNAL_ROOT_COMMAND"
-SXM_COG_NAME = "SXMMusic"
+__all__ = ["get_root_command", "send_message", "set_root_command"]
 
 
-def get_cog(ctx: SlashContext):
-    return ctx.bot.cogs[SXM_COG_NAME]
-
+MESSAGE_PAGE_SIZE = 1900
+EMBED_CACHE_SIZE = 256
+ART_CACHE_SIZE = 512
 
-def set_root_command(value: str):
-    os.environ[ROOT_COMMAND_ENV] = value
 
-
-def get_root_command() -> str:
-    return os.environ.get(ROOT_COMMAND_ENV, "Music")
+def get_cog(ctx: SlashContext):
+    return ctx.bot.cogs[SXM_COG_NAME]
 
 
+@traced()
 async def send_message(
     ctx: SlashContext,
     message: Optional[str] = None,
@@ -35,14 +35,132 @@ async def send_message(
     if message is None and embed is None:
         raise errors.CommandError("A message or a embed must be provided")
 
+    if isinstance(ctx, SlashContext) and not ctx.responded:
+        # do not race a deferral of the interaction, see `deferrable`
+        async with get_response_lock(ctx):
+            return await ctx.send(message, embed=embed)
     return await ctx.send(message, embed=embed)
 
 
+def paginate_lines(text: str, size: int = MESSAGE_PAGE_SIZE) -> List[str]:
+    """Splits text on line breaks into pages of at most `size` characters"""
+
+    pages: List[str] = []
+    page: List[str] = []
+    page_size = 0
+    for line in text.split("\n"):
+        if len(page) > 0 and page_size + len(line) > size:
+            pages.append("\n".join(page))
+            page = []
+            page_size = 0
+
+        page.append(line)
+        page_size += len(line) + 1
+
+    if len(page) > 0:
+        pages.append("\n".join(page))
+    return pages
+
+
+class LRUCache(OrderedDict):
+    """`OrderedDict` that drops the least recently used keys past `max_size`"""
+
+    max_size: int
+
+    def __init__(self, max_size: int):
+        super().__init__()
+        self.max_size = max_size
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+
+        value = factory()
+        self[key] = value
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+        return value
+
+
+class ArtMap:
+    """Image URLs from a list of `XMArt`, looked up once per album/show"""
+
+    __slots__ = ("sizes", "thumb")
+
+    sizes: Dict[str, str]
+    thumb: Optional[str]
+
+    def __init__(self, arts: List[XMArt]):
+        self.sizes = {}
+        for art in arts:
+            if isinstance(art, XMImage) and art.size is not None:
+                self.sizes.setdefault(art.size, art.url)
+        self.thumb = get_art_thumb_url(arts)
+
+
+_art_cache = LRUCache(ART_CACHE_SIZE)
+_embed_cache = LRUCache(EMBED_CACHE_SIZE)
+
+
+def get_art_map(key: Hashable, arts: List[XMArt]) -> ArtMap:
+    """Returns cached `ArtMap` for the album/show identified by `key`"""
+
+    return _art_cache.get_or_set(key, lambda: ArtMap(arts))
+
+
+def get_album_art_map(song: XMSong) -> Optional[ArtMap]:
+    """Returns cached `ArtMap` of the album of `song`, shared by every cut of
+    the album"""
+
+    album = song.album
+    if album is None:
+        return None
+
+    if album.title is not None:
+        artist = song.artists[0].name if len(song.artists) > 0 else None
+        key: Hashable = ("album", artist, album.title)
+    else:
+        key = ("album", tuple(art.url for art in album.arts))
+    return get_art_map(key, album.arts)
+
+
+def _get_cached_embed(key: Hashable, render: Callable[[], Embed]) -> Embed:
+    data = _embed_cache.get_or_set(key, lambda: render().to_dict())
+
+    # fields are the only part that gets modified in place
+    data = dict(data)
+    if "fields" in data:
+        data["fields"] = [dict(f) for f in data["fields"]]
+    return Embed.from_dict(data)
+
+
 def generate_embed_from_cut(
     xm_channel: XMChannel,
     cut: Optional[XMCutMarker],
     episode: Optional[XMEpisodeMarker] = None,
     footer: Optional[str] = None,
+) -> Embed:
+    key = (
+        "cut",
+        xm_channel.id,
+        None if cut is None else cut.guid,
+        None if episode is None else episode.guid,
+    )
+    embed = _get_cached_embed(
+        key, lambda: _render_embed_from_cut(xm_channel, cut, episode)
+    )
+
+    if footer is not None:
+        embed.set_footer(text=footer)
+
+    return embed
+
+
+def _render_embed_from_cut(
+    xm_channel: XMChannel,
+    cut: Optional[XMCutMarker],
+    episode: Optional[XMEpisodeMarker] = None,
 ) -> Embed:
     np_title = None
     np_author = None
@@ -60,13 +178,16 @@ def generate_embed_from_cut(
             if album.title is not None:
                 np_album = album.title
 
-            np_thumbnail = get_art_url_by_size(album.arts, "MEDIUM")
+            art_map = get_album_art_map(song)
+            if art_map is not None:
+                np_thumbnail = art_map.sizes.get("MEDIUM")
 
     if episode is not None:
         np_episode_title = episode.episode.long_title
 
         if np_thumbnail is None:
-            np_thumbnail = get_art_thumb_url(episode.episode.show.arts)
+            show = episode.episode.show
+            np_thumbnail = get_art_map(("show", show.guid), show.arts).thumb
 
     embed = Embed(title=np_title)
     if np_author is not None:
@@ -79,9 +200,6 @@ def generate_embed_from_cut(
     if np_episode_title is not None:
         embed.add_field(name="Show", value=np_episode_title, inline=True)
 
-    if footer is not None:
-        embed.set_footer(text=footer)
-
     return embed
 
 
@@ -94,6 +212,29 @@ def generate_embed_from_archived(
 
 
 def generate_embed_from_song(song: Song, footer: Optional[str] = None) -> Embed:
+    if song.guid == "":
+        embed = _render_embed_from_song(song)
+    else:
+        embed = _get_cached_embed(
+            ("song", song.guid), lambda: _render_embed_from_song(song)
+        )
+
+    # "Aired" is relative to now, so it is the only field that is not cached
+    aired_index = 0 if song.album is None else 1
+    embed.set_field_at(
+        aired_index,
+        name="Aired",
+        value=naturaltime(song.air_time_smart, when=datetime.now(timezone.utc)),
+        inline=True,
+    )
+
+    if footer is not None:
+        embed.set_footer(text=footer)
+
+    return embed
+
+
+def _render_embed_from_song(song: Song) -> Embed:
 
     embed = Embed(title=song.title)
     embed.set_author(name=song.artist)
@@ -103,20 +244,13 @@ def generate_embed_from_song(song: Song, footer: Optional[str] = None) -> Embed:
     if song.album is not None:
         embed.add_field(name="Album", value=song.album)
 
-    embed.add_field(
-        name="Aired",
-        value=naturaltime(song.air_time_smart, when=datetime.now(timezone.utc)),
-        inline=True,
-    )
+    embed.add_field(name="Aired", value="", inline=True)
     embed.add_field(name="SXM", value=song.channel, inline=True)
 
-    if footer is not None:
-        embed.set_footer(text=footer)
-
     return embed
 
 
-def _get_xm_channel(state: PlayerState) -> XMChannel:
+def _get_xm_channel(state: DiscordPlayerState) -> XMChannel:
     if state.stream_channel is None:
         raise ValueError("`stream_channel` cannot be empty")
 
@@ -128,28 +262,35 @@ def _get_xm_channel(state: PlayerState) -> XMChannel:
     return xm_channel
 
 
-def generate_now_playing_embed(state: PlayerState) -> Tuple[XMChannel, Embed]:
+def generate_now_playing_embed(state: DiscordPlayerState) -> Tuple[XMChannel, Embed]:
     xm_channel = _get_xm_channel(state)
-    if state.live is not None:
-        cut = state.live.get_latest_cut(now=state.radio_time)
-        episode = state.live.get_latest_episode(now=state.radio_time)
+
+    cut: Optional[XMCutMarker] = None
+    episode: Optional[XMEpisodeMarker] = None
+    timeline = state.timeline
+    if timeline is not None:
+        radio_time = state.radio_time
+        cut = timeline.get_latest_cut(now=radio_time)
+        episode = timeline.get_latest_episode(now=radio_time)
 
     return xm_channel, generate_embed_from_cut(xm_channel, cut, episode)
 
 
 def get_recent_songs(
-    state: PlayerState, count: int
+    state: DiscordPlayerState, count: int
 ) -> Tuple[XMChannel, List[XMCutMarker], Optional[XMCutMarker]]:
     xm_channel = _get_xm_channel(state)
 
-    if state.live is None or xm_channel is None:
+    timeline = state.timeline
+    if timeline is None or xm_channel is None:
         return (xm_channel, [], None)
 
     song_cuts: List[XMCutMarker] = []
     now = state.radio_time or datetime.now(timezone.utc)
-    latest_cut = state.live.get_latest_cut(now)
+    start_time = state.start_time
+    latest_cut = timeline.get_latest_cut(now)
 
-    for song_cut in reversed(state.live.song_cuts):
+    for song_cut in timeline.iter_song_cuts_before(now):
         if len(song_cuts) >= count:
             break
 
@@ -157,13 +298,15 @@ def get_recent_songs(
             song_cuts.append(song_cut)
             continue
 
+        if start_time is None:
+            continue
+
         end = song_cut.time + song_cut.duration
-        if (
-            state.start_time is not None
-            and song_cut.time < now
-            and (end > state.start_time or song_cut.time > state.start_time)
-        ):
+        if song_cut.time < now and (end > start_time or song_cut.time > start_time):
             song_cuts.append(song_cut)
+        elif end <= start_time:
+            # everything after this aired before the stream started
+            break
 
     return xm_channel, song_cuts, latest_cut
 
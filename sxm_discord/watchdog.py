@@ -0,0 +1,208 @@
+"""Watchdog for blocking calls on the bot's event loop.
+
+A heartbeat on the event loop is expected every `threshold / 4` seconds. If
+it has not run for `threshold` seconds, a watchdog thread grabs the stack of
+the event loop thread while it is still stuck. When the heartbeat runs again
+it reports the time since the last heartbeat as how long the loop was blocked
+(up to `threshold / 4` longer than the block itself) and the stall is added to
+the stats of the code location it was stuck in.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+__all__ = ["LoopWatchdog", "StallLocation"]
+
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+STACK_LIMIT = 30
+
+# `lineno` is None for frames without line numbers
+Location = Tuple[str, Optional[int], str]
+
+
+class StallLocation:
+    """Stalls of the event loop for one line of code"""
+
+    __slots__ = ("location", "count", "total", "worst", "stack")
+
+    location: Location
+    count: int
+    total: float
+    worst: float
+    stack: List[str]
+
+    def __init__(self, location: Location, stack: List[str]):
+        self.location = location
+        self.count = 0
+        self.total = 0
+        self.worst = 0
+        self.stack = stack
+
+    def add(self, seconds: float, stack: List[str]) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds >= self.worst:
+            self.worst = seconds
+            self.stack = stack
+
+    @property
+    def name(self) -> str:
+        filename, lineno, function = self.location
+        if filename.startswith(PACKAGE_PATH):
+            filename = os.path.relpath(filename, os.path.dirname(PACKAGE_PATH))
+        return f"{filename}:{lineno} ({function})"
+
+
+def _get_location(stack: traceback.StackSummary) -> Location:
+    """Innermost frame in `sxm_discord`, otherwise innermost frame"""
+
+    for frame in reversed(stack):
+        if frame.filename.startswith(PACKAGE_PATH) and not frame.filename.endswith(
+            "watchdog.py"
+        ):
+            return (frame.filename, frame.lineno, frame.name)
+
+    frame = stack[-1]
+    return (frame.filename, frame.lineno, frame.name)
+
+
+class LoopWatchdog:
+    """Finds what is blocking the event loop for over `threshold` seconds"""
+
+    threshold: float
+    stalls: Dict[Location, StallLocation]
+    total_stalls: int = 0
+
+    _beat_at: float = 0
+    _loop: asyncio.AbstractEventLoop
+    _loop_thread: Optional[int] = None
+    _lock: threading.Lock
+    _pending: Optional[Tuple[Location, List[str]]] = None
+    _stop: threading.Event
+    _thread: Optional[threading.Thread] = None
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float):
+        self.threshold = threshold
+        self.stalls = {}
+
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._log = logging.getLogger("sxm_discord.watchdog")
+
+    @property
+    def interval(self) -> float:
+        return self.threshold / 4
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._loop.call_soon_threadsafe(self._start_heartbeat)
+
+        self._thread = threading.Thread(
+            target=self._watch, name="sxm-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _start_heartbeat(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._loop.call_later(self.interval, self._heartbeat)
+
+    def _heartbeat(self) -> None:
+        now = time.monotonic()
+        blocked = now - self._beat_at
+        self._beat_at = now
+
+        self._add_stall(blocked)
+        if not self._stop.is_set():
+            self._loop.call_later(self.interval, self._heartbeat)
+
+    def _add_stall(self, seconds: float) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, None
+
+        # the watchdog thread may not have gotten the GIL while it was stuck
+        if pending is None or seconds < self.threshold:
+            return
+
+        location, stack = pending
+        stall = self.stalls.get(location)
+        if stall is None:
+            stall = self.stalls[location] = StallLocation(location, stack)
+        stall.add(seconds, stack)
+        self.total_stalls += 1
+        self._log.warning(
+            f"event loop blocked for {seconds * 1000:.0f}ms at {stall.name}"
+        )
+
+    def _watch(self) -> None:
+        captured_beat: Optional[float] = None
+        wait = self.interval
+        while not self._stop.wait(wait):
+            wait = self.interval
+            beat_at = self._beat_at
+            if self._loop_thread is None or beat_at == captured_beat:
+                continue
+
+            # wakes up right when the heartbeat is `threshold` late
+            until_stall = beat_at + self.threshold - time.monotonic()
+            if until_stall > 0:
+                wait = until_stall
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            stack = traceback.extract_stack(frame, limit=STACK_LIMIT)
+            del frame
+            if len(stack) == 0:
+                continue
+
+            captured_beat = beat_at
+            with self._lock:
+                self._pending = (_get_location(stack), stack.format())
+
+    def get_worst(self, limit: int = 10) -> List[StallLocation]:
+        """Locations that blocked the event loop the longest in total"""
+
+        stalls = sorted(self.stalls.values(), key=lambda s: s.total, reverse=True)
+        return stalls[:limit]
+
+    def report(self, limit: int = 10, stacks: bool = False) -> str:
+        from tabulate import tabulate
+
+        worst = self.get_worst(limit)
+        if len(worst) == 0:
+            return "No event loop stalls"
+
+        table = tabulate(
+            [
+                (
+                    s.name,
+                    s.count,
+                    f"{s.total * 1000:.0f}",
+                    f"{s.worst * 1000:.0f}",
+                )
+                for s in worst
+            ],
+            headers=["Location", "Stalls", "Total (ms)", "Worst (ms)"],
+        )
+        if not stacks:
+            return table
+
+        lines = [table]
+        for stall in worst:
+            lines.append("")
+            lines.append(f"{stall.name}, worst {stall.worst * 1000:.0f}ms:")
+            lines.append("".join(stall.stack).rstrip())
+        return "\n".join(lines)
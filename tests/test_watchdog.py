@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from sxm_discord.watchdog import LoopWatchdog
+
+THRESHOLD = 0.2
+
+
+def _block(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_reports_block_just_over_threshold():
+    loop = asyncio.new_event_loop()
+    watchdog = LoopWatchdog(loop, THRESHOLD)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(THRESHOLD)
+        _block(THRESHOLD * 1.25)
+        await asyncio.sleep(THRESHOLD)
+        watchdog.stop()
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert watchdog.total_stalls == 1
+    (stall,) = watchdog.stalls.values()
+    assert stall.location[2] == "_block"
+    assert THRESHOLD * 1.25 <= stall.worst <= THRESHOLD * 1.25 + watchdog.interval
+
+
+def test_ignores_block_under_threshold():
+    loop = asyncio.new_event_loop()
+    watchdog = LoopWatchdog(loop, THRESHOLD)
+
+    async def run():
+        watchdog.start()
+        await asyncio.sleep(THRESHOLD)
+        _block(THRESHOLD * 0.5)
+        await asyncio.sleep(THRESHOLD)
+        watchdog.stop()
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert watchdog.total_stalls == 0